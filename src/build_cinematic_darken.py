@@ -41,6 +41,7 @@ def main():
             sys.executable, "-m", "PyInstaller",
             "--onefile",
             "--windowed",
+            "--hidden-import", "ffmpeg",  # converter_core 延迟导入 ffmpeg-python
             "--name", "CinematicDarken",
             "--distpath", str(dist_dir),
             "--workpath", str(project_root / "build"),
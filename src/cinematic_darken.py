@@ -8,10 +8,11 @@ Supports multiple languages, configuration management, and modern UI
 import sys
 import os
 import json
-import moviepy.editor as mp
-from moviepy.video.fx.all import colorx
 from datetime import datetime
 
+from converter_core import JobControl, CANCELLED, format_progress, format_duration, default_batch_workers, scan_videos
+from darken_core import darken_video, build_darken_jobs, DarkenBatch, DARKEN_EXTENSIONS, DARKEN_SUFFIX
+
 # Import PyQt5 components
 try:
     from PyQt5.QtWidgets import *
@@ -67,26 +68,57 @@ class LanguageManager:
                 "processing_failed": "Processing failed" if self.current_lang == 'en' else "处理失败",
                 "select_output": "Select Output Location" if self.current_lang == 'en' else "选择输出位置",
                 "supported_formats": "Supported formats: MP4, AVI, MOV, MKV" if self.current_lang == 'en' else "支持格式：MP4, AVI, MOV, MKV",
-                "brightness_tooltip": "Adjust video brightness (0.1-2.0, 1.0=original)" if self.current_lang == 'en' else "调整视频亮度 (0.1-2.0, 1.0=原始)"
+                "brightness_tooltip": "Adjust video brightness (0.1-2.0, 1.0=original)" if self.current_lang == 'en' else "调整视频亮度 (0.1-2.0, 1.0=原始)",
+                "add_to_queue": "Add to Queue" if self.current_lang == 'en' else "加入队列",
+                "queued": "{count} queued" if self.current_lang == 'en' else "队列中 {count} 个",
+                "already_queued": "This output is already queued" if self.current_lang == 'en' else "该输出已在队列中",
+                "cancel": "Cancel" if self.current_lang == 'en' else "取消",
+                "cancelling": "Cancelling..." if self.current_lang == 'en' else "正在取消...",
+                "cancelled": "Cancelled" if self.current_lang == 'en' else "已取消",
+                "saved_to": "Video saved to:" if self.current_lang == 'en' else "视频已保存到：",
+                "single_mode": "Single File" if self.current_lang == 'en' else "单个文件",
+                "batch_mode": "Batch" if self.current_lang == 'en' else "批量处理",
+                "add_files": "Add Files" if self.current_lang == 'en' else "添加文件",
+                "add_folder": "Add Folder" if self.current_lang == 'en' else "添加文件夹",
+                "clear_list": "Clear List" if self.current_lang == 'en' else "清空列表",
+                "output_folder": "Output Folder" if self.current_lang == 'en' else "输出文件夹",
+                "parallel_jobs": "Parallel jobs:" if self.current_lang == 'en' else "并行任务数：",
+                "global_brightness": "Same brightness for all files" if self.current_lang == 'en' else "所有文件使用相同亮度",
+                "start_batch": "Start Batch" if self.current_lang == 'en' else "开始批量处理",
+                "col_file": "File" if self.current_lang == 'en' else "文件",
+                "col_brightness": "Brightness (%)" if self.current_lang == 'en' else "亮度 (%)",
+                "col_status": "Status" if self.current_lang == 'en' else "状态",
+                "col_throughput": "Throughput" if self.current_lang == 'en' else "处理速度",
+                "status_queued": "Queued" if self.current_lang == 'en' else "等待中",
+                "status_running": "Running" if self.current_lang == 'en' else "处理中",
+                "status_done": "Done" if self.current_lang == 'en' else "完成",
+                "status_failed": "Failed" if self.current_lang == 'en' else "失败",
+                "status_cancelled": "Cancelled" if self.current_lang == 'en' else "已取消",
+                "batch_summary": "{succeeded} succeeded, {failed} failed" if self.current_lang == 'en' else "成功 {succeeded} 个，失败 {failed} 个",
             }
         }
     
     def get_text(self, key):
-        """Get localized text"""
-        keys = key.split('.')
-        value = self.lang_data
-        for k in keys:
-            if isinstance(value, dict) and k in value:
-                value = value[k]
+        """Get localized text, falling back to the built-in defaults for keys the language file lacks"""
+        for data in (self.lang_data, self.get_default_language()):
+            value = data
+            for k in key.split('.'):
+                if isinstance(value, dict) and k in value:
+                    value = value[k]
+                else:
+                    break
             else:
-                return key  # Return key if not found
-        return value
+                return value
+        return key  # Return key if not found
     
     def switch_language(self, lang_code):
         """Switch language"""
         self.current_lang = lang_code
         self.load_language()
 
+# 模式标签页：0 单个文件，1 批量处理
+BATCH_TAB = 1
+
 class CinematicDarkenTool(QMainWindow):
     """Main application window"""
     
@@ -95,12 +127,24 @@ class CinematicDarkenTool(QMainWindow):
         self.lang_manager = LanguageManager()
         self.input_file = ""
         self.output_file = ""
+        # 处理在 DarkenThread 中进行，等待中的任务按顺序排队
+        self.pending_jobs = []  # [(input, output, brightness)]
+        self.finished_jobs = []  # [(output, ok, error)]
+        self.darken_thread = None
+        # 批量模式：表格每行一个输入 {input, brightness(%), status, throughput, error}
+        self.batch_rows = []
+        self.batch_output_dir = ""
+        self.batch_global_brightness = True
+        self.batch_workers = default_batch_workers()
+        self.batch_thread = None
+        self.batch_progress = {}  # 行号 -> 最近一次进度
+        self.closing = False  # 关闭窗口时等待任务取消完成后再关闭
         self.init_ui()
     
     def init_ui(self):
         """Initialize user interface"""
         self.setWindowTitle(self.lang_manager.get_text('cinematic_darken.title'))
-        self.setGeometry(100, 100, 600, 400)
+        self.setGeometry(100, 100, 760, 720)
         
         # Central widget
         central_widget = QWidget()
@@ -139,6 +183,11 @@ class CinematicDarkenTool(QMainWindow):
         lang_layout.addWidget(self.lang_btn)
         layout.addLayout(lang_layout)
         
+        # Mode tabs
+        self.mode_tabs = QTabWidget()
+        single_tab = QWidget()
+        single_layout = QVBoxLayout(single_tab)
+        
         # File selection
         file_group = QGroupBox(self.lang_manager.get_text('cinematic_darken.select_video'))
         file_layout = QVBoxLayout(file_group)
@@ -171,7 +220,7 @@ class CinematicDarkenTool(QMainWindow):
         self.file_path_label.setStyleSheet("color: #34495e; font-size: 14px; padding: 10px; background-color: #ecf0f1; border-radius: 5px;")
         file_layout.addWidget(self.file_path_label)
         
-        layout.addWidget(file_group)
+        single_layout.addWidget(file_group)
         
         # Output path
         output_group = QGroupBox(self.lang_manager.get_text('cinematic_darken.output_path'))
@@ -201,7 +250,13 @@ class CinematicDarkenTool(QMainWindow):
         output_input_layout.addWidget(self.select_output_btn)
         output_layout.addLayout(output_input_layout)
         
-        layout.addWidget(output_group)
+        single_layout.addWidget(output_group)
+        single_layout.addStretch()
+        
+        self.mode_tabs.addTab(single_tab, self.lang_manager.get_text('cinematic_darken.single_mode'))
+        self.mode_tabs.addTab(self.init_batch_tab(), self.lang_manager.get_text('cinematic_darken.batch_mode'))
+        self.mode_tabs.currentChanged.connect(self.update_process_button)
+        layout.addWidget(self.mode_tabs)
         
         # Brightness control
         brightness_group = QGroupBox(self.lang_manager.get_text('cinematic_darken.brightness'))
@@ -230,7 +285,7 @@ class CinematicDarkenTool(QMainWindow):
         
         # Process button
         self.process_btn = QPushButton("🎬 " + self.lang_manager.get_text('cinematic_darken.start_processing'))
-        self.process_btn.clicked.connect(self.process_video)
+        self.process_btn.clicked.connect(self.start_processing)
         self.process_btn.setStyleSheet("""
             QPushButton {
                 background-color: #e74c3c;
@@ -251,6 +306,10 @@ class CinematicDarkenTool(QMainWindow):
         self.process_btn.setEnabled(False)
         layout.addWidget(self.process_btn)
         
+        self.cancel_btn = QPushButton("⏹️ " + self.lang_manager.get_text('cinematic_darken.cancel'))
+        self.cancel_btn.clicked.connect(self.cancel_processing)
+        layout.addWidget(self.cancel_btn)
+        
         # Progress bar
         self.progress_bar = QProgressBar()
         self.progress_bar.setVisible(False)
@@ -261,6 +320,66 @@ class CinematicDarkenTool(QMainWindow):
         self.status_label.setAlignment(Qt.AlignCenter)
         self.status_label.setStyleSheet("color: #7f8c8d; font-size: 14px;")
         layout.addWidget(self.status_label)
+        
+        # 切换语言会重建界面，恢复运行中的状态
+        self.fill_batch_table()
+        self._set_running(self.darken_thread is not None or self.batch_thread is not None)
+    
+    def init_batch_tab(self):
+        """Build the batch tab: input list, queue table, parallel jobs and output folder"""
+        batch_tab = QWidget()
+        batch_layout = QVBoxLayout(batch_tab)
+        
+        buttons_layout = QHBoxLayout()
+        self.add_files_btn = QPushButton("📄 " + self.lang_manager.get_text('cinematic_darken.add_files'))
+        self.add_files_btn.clicked.connect(self.add_batch_files)
+        buttons_layout.addWidget(self.add_files_btn)
+        self.add_folder_btn = QPushButton("📁 " + self.lang_manager.get_text('cinematic_darken.add_folder'))
+        self.add_folder_btn.clicked.connect(self.add_batch_folder)
+        buttons_layout.addWidget(self.add_folder_btn)
+        self.clear_list_btn = QPushButton("🗑️ " + self.lang_manager.get_text('cinematic_darken.clear_list'))
+        self.clear_list_btn.clicked.connect(self.clear_batch)
+        buttons_layout.addWidget(self.clear_list_btn)
+        buttons_layout.addStretch()
+        batch_layout.addLayout(buttons_layout)
+        
+        # 队列表格：文件、亮度（非全局时可编辑）、状态、处理速度
+        self.batch_table = QTableWidget(0, 4)
+        self.batch_table.setHorizontalHeaderLabels([
+            self.lang_manager.get_text('cinematic_darken.col_file'),
+            self.lang_manager.get_text('cinematic_darken.col_brightness'),
+            self.lang_manager.get_text('cinematic_darken.col_status'),
+            self.lang_manager.get_text('cinematic_darken.col_throughput'),
+        ])
+        self.batch_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.batch_table.verticalHeader().setVisible(False)
+        self.batch_table.itemChanged.connect(self.batch_brightness_edited)
+        batch_layout.addWidget(self.batch_table)
+        
+        options_layout = QHBoxLayout()
+        self.global_brightness_checkbox = QCheckBox(self.lang_manager.get_text('cinematic_darken.global_brightness'))
+        self.global_brightness_checkbox.setChecked(self.batch_global_brightness)
+        self.global_brightness_checkbox.toggled.connect(self.toggle_global_brightness)
+        options_layout.addWidget(self.global_brightness_checkbox)
+        options_layout.addStretch()
+        options_layout.addWidget(QLabel(self.lang_manager.get_text('cinematic_darken.parallel_jobs')))
+        self.parallel_spin = QSpinBox()
+        self.parallel_spin.setRange(1, max(1, os.cpu_count() or 1))
+        self.parallel_spin.setValue(self.batch_workers)
+        self.parallel_spin.valueChanged.connect(self.set_batch_workers)
+        options_layout.addWidget(self.parallel_spin)
+        batch_layout.addLayout(options_layout)
+        
+        output_dir_layout = QHBoxLayout()
+        self.output_dir_label = QLabel(self.batch_output_dir)
+        self.output_dir_label.setStyleSheet("color: #34495e; font-size: 14px; padding: 10px; background-color: #ecf0f1; border-radius: 5px;")
+        output_dir_layout.addWidget(self.output_dir_label, 1)
+        self.select_output_dir_btn = QPushButton("📁 " + self.lang_manager.get_text('cinematic_darken.output_folder'))
+        self.select_output_dir_btn.clicked.connect(self.select_output_dir)
+        output_dir_layout.addWidget(self.select_output_dir_btn)
+        batch_layout.addLayout(output_dir_layout)
+        
+        return batch_tab
     
     def switch_language(self):
         """Switch between languages"""
@@ -277,6 +396,8 @@ class CinematicDarkenTool(QMainWindow):
     def update_brightness_label(self, value):
         """Update brightness label"""
         self.brightness_label.setText(f"{value}%")
+        if self.batch_global_brightness and self.batch_rows:
+            self.fill_batch_table()
     
     def select_input_file(self):
         """Select input video file"""
@@ -316,53 +437,355 @@ class CinematicDarkenTool(QMainWindow):
     
     def update_process_button(self):
         """Update process button state"""
-        if self.input_file and self.output_file:
-            self.process_btn.setEnabled(True)
+        # 单文件队列与批量任务不同时运行
+        if self.mode_tabs.currentIndex() == BATCH_TAB:
+            key = 'start_batch'
+            ready = bool(self.batch_rows and self.batch_output_dir) and self.darken_thread is None
         else:
-            self.process_btn.setEnabled(False)
+            key = 'add_to_queue' if self.darken_thread is not None else 'start_processing'
+            ready = bool(self.input_file and self.output_file)
+        self.process_btn.setText("🎬 " + self.lang_manager.get_text(f'cinematic_darken.{key}'))
+        self.process_btn.setEnabled(ready and self.batch_thread is None)
+    
+    def start_processing(self):
+        """Start the single-file queue or the batch, depending on the current tab"""
+        if self.mode_tabs.currentIndex() == BATCH_TAB:
+            self.start_batch()
+        else:
+            self.process_video()
     
     def process_video(self):
-        """Process video with cinematic darkening"""
+        """Queue the selected file for darkening; starts at once when nothing is running"""
         if not self.input_file or not self.output_file:
             return
         
-        try:
-            # Show progress
-            self.progress_bar.setVisible(True)
-            self.progress_bar.setRange(0, 0)  # Indeterminate progress
-            self.process_btn.setEnabled(False)
-            self.status_label.setText(self.lang_manager.get_text('cinematic_darken.processing'))
-            
-            # Calculate brightness factor
-            brightness_percent = self.brightness_slider.value()
-            brightness_factor = brightness_percent / 100.0
-            
-            # Process video
-            QApplication.processEvents()  # Update UI
-            
-            clip = mp.VideoFileClip(self.input_file)
-            darker_clip = colorx(clip, brightness_factor)
-            darker_clip.write_videofile(self.output_file, codec="libx264", audio_codec="aac")
-            
-            # Clean up
-            clip.close()
-            darker_clip.close()
-            
-            # Success
-            self.progress_bar.setVisible(False)
-            self.status_label.setText(self.lang_manager.get_text('cinematic_darken.success'))
-            QMessageBox.information(self, self.lang_manager.get_text('cinematic_darken.success'), 
-                                  f"Video saved to: {self.output_file}")
-            
-        except Exception as e:
+        queued = [job[1] for job in self.pending_jobs]
+        if self.darken_thread is not None:
+            queued.append(self.darken_thread.output_path)
+        if self.output_file in queued:
+            QMessageBox.warning(self, self.lang_manager.get_text('cinematic_darken.error'),
+                                self.lang_manager.get_text('cinematic_darken.already_queued'))
+            return
+        
+        # Calculate brightness factor
+        brightness_factor = self.brightness_slider.value() / 100.0
+        self.pending_jobs.append((self.input_file, self.output_file, brightness_factor))
+        if self.darken_thread is None:
+            self.finished_jobs = []
+            self.start_next_job()
+        else:
+            self.status_label.setText(self._queue_text())
+    
+    def start_next_job(self):
+        """Start the first queued job in a worker thread"""
+        input_path, output_path, brightness_factor = self.pending_jobs.pop(0)
+        self.darken_thread = DarkenThread(input_path, output_path, brightness_factor)
+        self.darken_thread.progress.connect(self.darken_progress)
+        self.darken_thread.result.connect(self.darken_finished)
+        self._set_running(True)
+        # 进度到达前（以及 moviepy 回退时）显示不确定进度
+        self.progress_bar.setRange(0, 0)
+        self.status_label.setText(self._queue_text(os.path.basename(input_path)))
+        self.darken_thread.start()
+    
+    def _queue_text(self, detail=""):
+        text = f"{self.lang_manager.get_text('cinematic_darken.processing')} {detail}".strip()
+        if self.pending_jobs:
+            text += " · " + self.lang_manager.get_text('cinematic_darken.queued').format(count=len(self.pending_jobs))
+        return text
+    
+    def darken_progress(self, info):
+        """Show frame progress, fps and ETA of the running job"""
+        if self.darken_thread is None or self.darken_thread.control.cancelled:
+            return
+        if info.get('fraction') is not None:
+            self.progress_bar.setRange(0, 1000)
+            self.progress_bar.setValue(int(info['fraction'] * 1000))
+        self.status_label.setText(self._queue_text(
+            f"{os.path.basename(self.darken_thread.input_path)} {format_progress(info)}"))
+    
+    def darken_finished(self, success, err):
+        """Record a finished job and go on with the queue"""
+        thread = self.darken_thread
+        thread.wait()
+        self.darken_thread = None
+        self.finished_jobs.append((thread.output_path, success, err))
+        if self.closing:
+            self.close()
+            return
+        if self.pending_jobs:
+            self.start_next_job()
+            return
+        
+        self._set_running(False)
+        saved = [output for output, ok, _ in self.finished_jobs if ok]
+        failed = [(output, error) for output, ok, error in self.finished_jobs if not ok and error != CANCELLED]
+        if failed:
             # Error
-            self.progress_bar.setVisible(False)
             self.status_label.setText(self.lang_manager.get_text('cinematic_darken.processing_failed'))
-            QMessageBox.critical(self, self.lang_manager.get_text('cinematic_darken.error'), 
-                               f"Error: {str(e)}")
+            QMessageBox.critical(self, self.lang_manager.get_text('cinematic_darken.error'),
+                                 "\n\n".join(f"{os.path.basename(output)}: {error}" for output, error in failed))
+        elif any(error == CANCELLED for _, _, error in self.finished_jobs):
+            self.status_label.setText(self.lang_manager.get_text('cinematic_darken.cancelled'))
+        else:
+            # Success
+            self.status_label.setText(self.lang_manager.get_text('cinematic_darken.success'))
+            QMessageBox.information(self, self.lang_manager.get_text('cinematic_darken.success'),
+                                    self.lang_manager.get_text('cinematic_darken.saved_to') + "\n" + "\n".join(saved))
+    
+    def cancel_processing(self):
+        """Cancel the running job and drop the queued ones"""
+        self.pending_jobs.clear()
+        for thread in (self.darken_thread, self.batch_thread):
+            if thread is not None:
+                thread.control.cancel()
+                self.cancel_btn.setEnabled(False)
+                self.status_label.setText(self.lang_manager.get_text('cinematic_darken.cancelling'))
+    
+    def _set_running(self, running):
+        """Show progress and the cancel button while jobs run; new single files are queued meanwhile"""
+        self.progress_bar.setVisible(running)
+        self.cancel_btn.setVisible(running)
+        self.cancel_btn.setEnabled(running)
+        self.update_process_button()
+        for widget in (self.add_files_btn, self.add_folder_btn, self.clear_list_btn, self.global_brightness_checkbox,
+                       self.parallel_spin, self.select_output_dir_btn):
+            widget.setEnabled(self.batch_thread is None)
+    
+    def add_batch_files(self):
+        """Add video files to the batch list"""
+        file_paths, _ = QFileDialog.getOpenFileNames(
+            self,
+            self.lang_manager.get_text('cinematic_darken.add_files'),
+            "",
+            "Video Files (*.mp4 *.avi *.mov *.mkv);;All Files (*)"
+        )
+        self._add_batch_inputs(file_paths)
+    
+    def add_batch_folder(self):
+        """Add every video in a folder to the batch list"""
+        folder = QFileDialog.getExistingDirectory(self, self.lang_manager.get_text('cinematic_darken.add_folder'))
+        if not folder:
+            return
+        # 排除之前生成的 *_darkened 文件
+        self._add_batch_inputs(sorted(scan_videos(folder, DARKEN_EXTENSIONS, recursive=False,
+                                                  exclude=[f"*{DARKEN_SUFFIX}.*", f"*{DARKEN_SUFFIX}_[0-9]*"])))
+        if not self.batch_output_dir:
+            self._set_output_dir(os.path.join(folder, 'darkened'))
+    
+    def _add_batch_inputs(self, paths):
+        known = {row['input'] for row in self.batch_rows}
+        for path in paths:
+            if path not in known:
+                known.add(path)
+                self.batch_rows.append({'input': path, 'brightness': self.brightness_slider.value(),
+                                        'status': 'queued', 'throughput': '', 'error': ''})
+        self.fill_batch_table()
+        self.update_process_button()
+    
+    def clear_batch(self):
+        """Empty the batch list"""
+        self.batch_rows = []
+        self.fill_batch_table()
+        self.update_process_button()
+    
+    def select_output_dir(self):
+        """Select the folder batch outputs are written to"""
+        folder = QFileDialog.getExistingDirectory(self, self.lang_manager.get_text('cinematic_darken.output_folder'),
+                                                  self.batch_output_dir)
+        if folder:
+            self._set_output_dir(folder)
+    
+    def _set_output_dir(self, folder):
+        self.batch_output_dir = folder
+        self.output_dir_label.setText(folder)
+        self.update_process_button()
+    
+    def set_batch_workers(self, value):
+        self.batch_workers = value
+    
+    def toggle_global_brightness(self, checked):
+        """Switch between one brightness for every file and per-file values"""
+        if not checked:
+            # 每个文件从当前全局亮度开始单独调整
+            for row in self.batch_rows:
+                row['brightness'] = self.brightness_slider.value()
+        self.batch_global_brightness = checked
+        self.fill_batch_table()
+    
+    def fill_batch_table(self):
+        """Rebuild the queue table from batch_rows"""
+        self.batch_table.setRowCount(len(self.batch_rows))
+        for index in range(len(self.batch_rows)):
+            self.refresh_batch_row(index)
+    
+    def refresh_batch_row(self, index):
+        """Show one row's file, brightness, status and throughput"""
+        row = self.batch_rows[index]
+        brightness = self.brightness_slider.value() if self.batch_global_brightness else row['brightness']
+        editable = not self.batch_global_brightness and self.batch_thread is None
+        cells = [
+            (os.path.basename(row['input']), row['input'], False),
+            (str(brightness), "", editable),
+            (self.lang_manager.get_text(f"cinematic_darken.status_{row['status']}"), row['error'], False),
+            (row['throughput'], "", False),
+        ]
+        # 程序填充表格时不触发 itemChanged
+        self.batch_table.blockSignals(True)
+        for column, (text, tooltip, can_edit) in enumerate(cells):
+            item = QTableWidgetItem(text)
+            item.setToolTip(tooltip)
+            if not can_edit:
+                item.setFlags(item.flags() & ~Qt.ItemIsEditable)
+            self.batch_table.setItem(index, column, item)
+        self.batch_table.blockSignals(False)
+    
+    def batch_brightness_edited(self, item):
+        """Store a per-file brightness typed into the table"""
+        if item.column() != 1 or item.row() >= len(self.batch_rows):
+            return
+        try:
+            value = int(item.text().strip().rstrip('%'))
+        except ValueError:
+            value = None
+        if value is None or not self.brightness_slider.minimum() <= value <= self.brightness_slider.maximum():
+            QMessageBox.warning(self, self.lang_manager.get_text('cinematic_darken.error'),
+                                self.lang_manager.get_text('cinematic_darken.invalid_brightness'))
+        else:
+            self.batch_rows[item.row()]['brightness'] = value
+        self.refresh_batch_row(item.row())
+    
+    def start_batch(self):
+        """Darken every listed file into the output folder with a pool of parallel jobs"""
+        if not self.batch_rows or not self.batch_output_dir or self.batch_thread is not None:
+            return
         
-        finally:
-            self.process_btn.setEnabled(True)
+        items = []
+        for row in self.batch_rows:
+            percent = self.brightness_slider.value() if self.batch_global_brightness else row['brightness']
+            items.append((row['input'], percent / 100.0))
+            row.update(status='queued', throughput='', error='')
+        jobs = build_darken_jobs(items, self.batch_output_dir)
+        self.batch_progress = {}
+        
+        self.batch_thread = DarkenBatchThread(DarkenBatch(self.batch_workers, log=print), jobs)
+        self.batch_thread.job_started.connect(self.batch_job_started)
+        self.batch_thread.job_progress.connect(self.batch_job_progress)
+        self.batch_thread.job_finished.connect(self.batch_job_finished)
+        self.batch_thread.result.connect(self.batch_finished)
+        self._set_running(True)
+        self.fill_batch_table()
+        self.progress_bar.setRange(0, len(jobs) * 1000)
+        self.progress_bar.setValue(0)
+        self.status_label.setText(self.lang_manager.get_text('cinematic_darken.processing'))
+        self.batch_thread.start()
+    
+    def batch_job_started(self, index):
+        self.batch_rows[index]['status'] = 'running'
+        self.refresh_batch_row(index)
+    
+    def batch_job_progress(self, index, info):
+        """Show a job's fps and speed and advance the overall progress"""
+        self.batch_progress[index] = info
+        parts = [f"{info['fps']:.1f} fps"]
+        if info.get('speed'):
+            parts.append(f"{info['speed']:.2f}x")
+        if info.get('eta') is not None:
+            parts.append(f"ETA {format_duration(info['eta'])}")
+        self.batch_rows[index]['throughput'] = " · ".join(parts)
+        self.refresh_batch_row(index)
+        self._update_batch_bar()
+    
+    def batch_job_finished(self, index, success, err):
+        """Mark a job done, failed or cancelled; done rows keep their average throughput"""
+        row = self.batch_rows[index]
+        row['status'] = 'done' if success else 'cancelled' if err == CANCELLED else 'failed'
+        row['error'] = "" if success or err == CANCELLED else err
+        info = self.batch_progress.get(index)
+        # 失败或取消的任务也算作完成，总进度条不会倒退
+        self.batch_progress[index] = dict(info or {}, fraction=1.0)
+        if success and info and info['elapsed'] > 0:
+            row['throughput'] = f"{info['frame'] / info['elapsed']:.1f} fps · {format_duration(info['elapsed'])}"
+        elif not success:
+            row['throughput'] = ""
+        self.refresh_batch_row(index)
+        self._update_batch_bar()
+    
+    def _update_batch_bar(self):
+        self.progress_bar.setValue(int(sum((info.get('fraction') or 0) * 1000 for info in self.batch_progress.values())))
+        finished = sum(1 for row in self.batch_rows if row['status'] in ('done', 'failed', 'cancelled'))
+        self.status_label.setText(f"{self.lang_manager.get_text('cinematic_darken.processing')} "
+                                  f"{finished}/{len(self.batch_rows)}")
+    
+    def batch_finished(self, succeeded, failed):
+        """Report the batch result"""
+        self.batch_thread.wait()
+        self.batch_thread = None
+        if self.closing:
+            self.close()
+            return
+        self._set_running(False)
+        self.fill_batch_table()
+        summary = self.lang_manager.get_text('cinematic_darken.batch_summary').format(succeeded=succeeded, failed=failed)
+        if any(row['status'] == 'cancelled' for row in self.batch_rows):
+            self.status_label.setText(f"{self.lang_manager.get_text('cinematic_darken.cancelled')} · {summary}")
+        else:
+            self.status_label.setText(summary)
+            QMessageBox.information(self, self.lang_manager.get_text('cinematic_darken.batch_mode'), summary)
+    
+    def closeEvent(self, event):
+        """Cancel running work and close once it has stopped, so no ffmpeg process outlives the window
+
+        The moviepy fallback only stops between frames, so the window does
+        not block on the threads; darken_finished / batch_finished close it
+        again when the last one is done.
+        """
+        running = [thread for thread in (self.darken_thread, self.batch_thread) if thread is not None]
+        if not running:
+            event.accept()
+            return
+        self.closing = True
+        self.cancel_processing()
+        event.ignore()
+
+class DarkenThread(QThread):
+    """Thread that runs one darken job so the UI stays responsive"""
+    progress = pyqtSignal(dict)  # frame / fps / speed / eta
+    result = pyqtSignal(bool, str)
+    
+    def __init__(self, input_path, output_path, brightness):
+        super().__init__()
+        self.input_path = input_path
+        self.output_path = output_path
+        self.brightness = brightness
+        self.control = JobControl()
+    
+    def run(self):
+        """Run darkening in thread"""
+        ok, err = darken_video(self.input_path, self.output_path, self.brightness,
+                               progress_callback=self.progress.emit, control=self.control, log=print)
+        self.result.emit(ok, err or "")
+
+class DarkenBatchThread(QThread):
+    """Thread that drives a DarkenBatch so the UI stays responsive"""
+    job_started = pyqtSignal(int)
+    job_progress = pyqtSignal(int, dict)
+    job_finished = pyqtSignal(int, bool, str)
+    result = pyqtSignal(int, int)  # succeeded, failed
+    
+    def __init__(self, batch, jobs):
+        super().__init__()
+        self.batch = batch
+        self.jobs = jobs
+        self.control = batch.control
+    
+    def run(self):
+        """Run the batch in thread"""
+        succeeded, failed = self.batch.run(
+            self.jobs, self.job_started.emit, self.job_progress.emit,
+            lambda index, ok, err: self.job_finished.emit(index, ok, err or "")
+        )
+        self.result.emit(succeeded, failed)
 
 def main():
     """Main function"""
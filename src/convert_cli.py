@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Video Format Converter CLI - headless front end for converter_core
+Non-interactive: suitable for render servers, scripts and cron jobs
+
+Exit codes:
+  0  every conversion succeeded (or was skipped as already matching)
+  1  one or more conversions failed
+  2  invalid arguments or no input files found
+  130  cancelled with Ctrl+C or SIGTERM (partial outputs are removed)
+"""
+
+import sys
+import os
+import json
+import time
+import signal
+import argparse
+
+from converter_core import (
+    VideoConverter, BatchConverter, BudgetPlanner, ProbeCache, ConversionManifest, format_progress, parse_duration,
+    format_duration, ThumbnailStrip, AdmissionControl, CANCEL_GRACE_SECONDS, ADMISSION_ACTIONS, ADMISSION_MAX_LOAD,
+    ADMISSION_MAX_STEAL, ADMISSION_MIN_FREE_MB, SCALE_FITS, SCALERS, PREVIEW_WINDOWS, PREVIEW_SECONDS, THUMB_COUNT, scan_videos
+)
+from shared_queue import SharedQueue, run_queue
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_CANCELLED = 130
+
+def parse_resolution(value, converter):
+    """Accept a preset name (720p/1080p/4K) or WIDTHxHEIGHT"""
+    if not value:
+        return None
+    for name, width, height in converter.resolution_presets:
+        if value.lower() == name.lower() and name != 'Custom':
+            return (width, height)
+    width, sep, height = value.lower().partition('x')
+    if sep and width.isdigit() and height.isdigit():
+        return (int(width), int(height))
+    raise argparse.ArgumentTypeError(f"invalid resolution: {value}")
+
+def parse_ladder(value, converter):
+    """Parse comma-separated resolution preset names (case-insensitive) into their canonical names"""
+    lookup = {name.lower(): name for name, width, height in converter.resolution_presets if (width, height) != (0, 0)}
+    names = []
+    for name in value.split(','):
+        if not name.strip():
+            continue
+        if name.strip().lower() not in lookup:
+            raise argparse.ArgumentTypeError(f"unknown ladder rendition: {name.strip()} "
+                                             f"(choose from {', '.join(lookup.values())})")
+        names.append(lookup[name.strip().lower()])
+    if not names:
+        raise argparse.ArgumentTypeError("empty ladder")
+    return names
+
+def parse_quality(args, converter):
+    """--crf wins over --quality; --quality accepts a preset name"""
+    if args.crf is not None:
+        return args.crf
+    if args.quality:
+        for name, crf in converter.quality_presets:
+            if args.quality.lower() == name.lower():
+                return crf
+        raise argparse.ArgumentTypeError(f"invalid quality preset: {args.quality}")
+    return None
+
+def parse_size(value):
+    """Parse a byte size such as 500M, 2G or 4096"""
+    text = str(value).strip().upper().rstrip('B')
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    try:
+        if text and text[-1] in units:
+            return int(float(text[:-1]) * units[text[-1]])
+        return int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size: {value}")
+
+def parse_age(value):
+    """Parse an age such as 2d, 12h or 90m into an epoch-seconds cutoff"""
+    try:
+        return time.time() - parse_duration(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def collect_inputs(args, converter):
+    """Lazily expand files and folders into (root, video path) pairs, scanning folders as they are consumed"""
+    exclude = list(args.exclude or [])
+    if not args.output_dir:
+        exclude.append('*_converted.*')  # 输出与输入同目录时，不把之前的输出当作输入
+    for path in args.inputs:
+        if os.path.isfile(path):
+            yield os.path.dirname(path), path
+        elif os.path.isdir(path):
+            for found in scan_videos(path, converter.supported_formats, args.recursive, args.include, exclude,
+                                     args.min_size, args.max_size, args.newer_than, args.older_than,
+                                     skip_dirs=[args.output_dir] if args.output_dir else None,
+                                     on_error=lambda folder, e: print(f"⚠️ Cannot read {folder}: {e}", file=sys.stderr)):
+                yield path, found
+        else:
+            print(f"⚠️ Not found: {path}", file=sys.stderr)
+
+def load_manifest(manifest_path):
+    """Read a job manifest: JSON list, JSON Lines, or one path per line
+
+    Each entry is either a path string or an object with "input" and any of
+    "output", "format", "resolution", "crf", "preset", "fit", "scaler" overriding the CLI.
+    """
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    stripped = content.strip()
+    if stripped.startswith('['):
+        entries = json.loads(stripped)
+    elif stripped.startswith('{'):
+        entries = [json.loads(line) for line in stripped.splitlines() if line.strip()]
+    else:
+        entries = [line.strip() for line in stripped.splitlines() if line.strip() and not line.startswith('#')]
+
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    jobs = []
+    for entry in entries:
+        entry = {'input': entry} if isinstance(entry, str) else dict(entry)
+        # 清单内相对路径以清单文件所在目录为基准
+        for key in ('input', 'output'):
+            if entry.get(key) and not os.path.isabs(entry[key]):
+                entry[key] = os.path.join(base, entry[key])
+        jobs.append(entry)
+    return jobs
+
+def build_jobs(args, converter, batch):
+    """Turn CLI inputs and manifest entries into a lazy stream of job dicts
+    
+    Options are validated up front; folders are only scanned as jobs are pulled.
+    """
+    resolution = parse_resolution(args.resolution, converter)
+    quality = parse_quality(args, converter)
+    remux = False if args.no_remux else 'auto'
+    entries = load_manifest(args.manifest) if args.manifest else []
+    return (finish_job(job, args, converter, args.ladder)
+            for job in iter_jobs(args, converter, batch, entries, resolution, quality, remux))
+
+def iter_jobs(args, converter, batch, entries, resolution, quality, remux):
+    for root, path in collect_inputs(args, converter):
+        output_dir = args.output_dir
+        if output_dir and args.recursive:
+            # 递归扫描时在输出目录中保留子目录结构，避免同名文件互相覆盖
+            output_dir = os.path.normpath(os.path.join(output_dir, os.path.relpath(os.path.dirname(path), root)))
+            os.makedirs(output_dir, exist_ok=True)
+        yield batch.build_jobs([path], args.format, resolution, quality, args.preset, output_dir, remux,
+                               args.fit, args.scaler)[0]
+
+    for entry in entries:
+        fmt = entry.get('format', args.format)
+        job = batch.build_jobs([entry['input']], fmt, resolution, quality, args.preset, args.output_dir, remux,
+                               entry.get('fit', args.fit), entry.get('scaler', args.scaler))[0]
+        if entry.get('output'):
+            job['output'] = entry['output']
+        if 'resolution' in entry:
+            job['resolution'] = parse_resolution(entry['resolution'], converter)
+        if 'crf' in entry:
+            job['quality'] = entry['crf']
+        if 'preset' in entry:
+            job['preset'] = entry['preset']
+        yield job
+
+def finish_job(job, args, converter, ladder):
+    if args.segments is not None:
+        job['segments'] = args.segments or 'auto'
+    if ladder:
+        fmt = os.path.splitext(job['output'])[1].lstrip('.') or args.format
+        job['renditions'] = converter.ladder_renditions(job['input'], fmt, ladder, os.path.dirname(job['output']))
+    return job
+
+def install_signal_handlers(control):
+    """Ctrl+C/SIGTERM cancel the batch (a second one kills ffmpeg at once); Ctrl+Z pauses ffmpeg too
+
+    ffmpeg runs in its own process group, so terminal signals no longer reach
+    it directly and are forwarded through the batch's JobControl instead.
+    """
+    def cancel(signum, frame):
+        force = control.cancelled
+        print("Cancelling, removing partial outputs..." if not force else "Killing ffmpeg...", file=sys.stderr)
+        control.cancel(grace=0 if force else CANCEL_GRACE_SECONDS)
+
+    def suspend(signum, frame):
+        control.pause()
+        # 恢复默认处理后再给自己发 SIGTSTP，进程在这里停住，fg 之后继续执行
+        signal.signal(signal.SIGTSTP, signal.SIG_DFL)
+        os.kill(os.getpid(), signal.SIGTSTP)
+        signal.signal(signal.SIGTSTP, suspend)
+        control.resume()
+
+    signal.signal(signal.SIGINT, cancel)
+    signal.signal(signal.SIGTERM, cancel)
+    if hasattr(signal, 'SIGTSTP'):
+        signal.signal(signal.SIGTSTP, suspend)
+
+def with_thumbnails(jobs, thumbs, futures):
+    """Queue a thumbnail strip for every job as it streams past"""
+    for job in jobs:
+        futures[job['input']] = thumbs.submit(job['input'])
+        yield job
+
+def format_queue(status):
+    """One-line throttle state and queue depth"""
+    line = f"{status['running']} running, {status['waiting']} held, {status['pending']} pending"
+    if status['state'] != 'ok':
+        line = f"{status['state']} ({'; '.join(status['reasons'])}) · {line}"
+    return line
+
+class ProgressPrinter:
+    """Throttled per-file progress lines on stderr"""
+
+    def __init__(self, interval=5.0, quiet=False, batch=None):
+        self.interval = interval
+        self.quiet = quiet
+        # 开启准入控制时，进度行附带节流状态与队列深度
+        self.batch = batch
+        self.last = {}
+
+    def file_progress(self, index, job, info):
+        if self.quiet:
+            return
+        now = time.monotonic()
+        if now - self.last.get(index, 0) < self.interval and not info.get('finished'):
+            return
+        self.last[index] = now
+        percent = f"{info['fraction'] * 100:5.1f}% " if info.get('fraction') is not None else ""
+        queue = f" · queue: {format_queue(self.batch.queue_status())}" if self.batch else ""
+        print(f"[{os.path.basename(job['input'])}] {percent}{format_progress(info)}{queue}", file=sys.stderr, flush=True)
+
+    def throttle_changed(self, status):
+        if self.quiet:
+            return
+        icon = "🟢" if status['state'] == 'ok' else "🚦"
+        print(f"{icon} throttle {format_queue(dict(self.batch.queue_status(), **status))}", file=sys.stderr, flush=True)
+
+    def file_done(self, index, job, ok, err):
+        if self.quiet:
+            return
+        status = "✅" if ok else "❌"
+        detail = "" if ok else f": {err.strip().splitlines()[-1] if err.strip() else 'failed'}"
+        print(f"{status} {job['input']}{detail}", file=sys.stderr, flush=True)
+
+def plan_with_budget(args, batch, jobs, budget_presets):
+    """Plan the whole batch and let BudgetPlanner choose the preset(s)"""
+    planned, skipped, estimate = batch.plan_batch(jobs)
+    log = (lambda message: None) if args.quiet else (lambda message: print(message, file=sys.stderr, flush=True))
+    budget = BudgetPlanner(batch, args.budget, args.budget_per_file, budget_presets, log=log).plan(planned)
+    if not args.quiet:
+        chosen = budget.get('preset') or ', '.join(sorted(set(budget.get('presets', {}).values())))
+        verdict = "fits" if budget['fits'] else "does NOT fit"
+        print(f"Budget {args.budget / 60:.0f} min: preset {chosen or '-'}, predicted "
+              f"{budget.get('wall', 0) / 60:.1f} min ({verdict}; sampling took {budget['sampling']:.0f}s)",
+              file=sys.stderr)
+        if planned:
+            print(f"Scheduling {len(planned)} file(s): {batch.max_workers} job(s) x {batch.threads} thread(s)",
+                  file=sys.stderr)
+    return planned, skipped, estimate, budget
+
+def predict(args, batch, planned):
+    """Sample-encode the planned jobs and report the predicted size and time; returns the exit code"""
+    prediction = batch.predict(planned, windows=args.predict_windows, seconds=args.predict_seconds) if planned else None
+    if args.json:
+        json.dump({'prediction': prediction}, sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write("\n")
+    elif prediction:
+        for item in prediction['jobs']:
+            print(f"{item['input']}: ~{item['size'] / (1024 * 1024):.1f} MB, ~{format_duration(item['encode_time'])}"
+                  f"{'' if item['sampled'] else ' (extrapolated)'}", file=sys.stderr)
+        print(f"Predicted: {prediction['files']} file(s), ~{prediction['size'] / (1024 * 1024):.1f} MB, "
+              f"~{format_duration(prediction['wall'])} with {batch.max_workers} job(s) "
+              f"({prediction['sampled']} sampled)", file=sys.stderr)
+    else:
+        print("error: nothing to predict (no files need encoding, or sampling failed)", file=sys.stderr)
+    return EXIT_OK if prediction else EXIT_FAILED
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        prog='convert_cli',
+        description="Headless video format converter (same options as the Format Converter GUI)",
+    )
+    converter = VideoConverter()
+    parser.add_argument('inputs', nargs='*', help="video files and/or folders")
+    parser.add_argument('-R', '--recursive', action='store_true', help="scan folders recursively")
+    parser.add_argument('--include', action='append', metavar='GLOB',
+                        help="only files whose name or relative path matches (repeatable)")
+    parser.add_argument('--exclude', action='append', metavar='GLOB',
+                        help="skip files and folders whose name or relative path matches (repeatable)")
+    parser.add_argument('--min-size', type=parse_size, help="skip files smaller than this (e.g. 10M)")
+    parser.add_argument('--max-size', type=parse_size, help="skip files larger than this (e.g. 4G)")
+    parser.add_argument('--newer-than', type=parse_age, metavar='AGE', help="only files modified within AGE (e.g. 2d, 12h)")
+    parser.add_argument('--older-than', type=parse_age, metavar='AGE', help="only files not modified for AGE")
+    parser.add_argument('-m', '--manifest', help="job manifest (JSON list, JSON Lines or one path per line)")
+    parser.add_argument('-f', '--format', default='mp4', choices=converter.supported_formats,
+                        help="output container (default: mp4)")
+    parser.add_argument('-r', '--resolution', help="720p, 1080p, 4K or WIDTHxHEIGHT (default: keep)")
+    parser.add_argument('-q', '--quality', help="quality preset: High, Medium or Low")
+    parser.add_argument('--crf', type=int, help="x264 CRF (overrides --quality)")
+    parser.add_argument('-p', '--preset', default='fast', choices=converter.encoding_presets,
+                        help="x264 encoding preset (default: fast)")
+    parser.add_argument('--fit', default='pad', choices=SCALE_FITS,
+                        help="keep the aspect ratio when resizing by padding or cropping, or stretch (default: pad)")
+    parser.add_argument('--scaler', choices=SCALERS,
+                        help="swscale algorithm: fast_bilinear is fastest, lanczos sharpest (default: bicubic)")
+    parser.add_argument('-o', '--output-dir', help="write outputs here instead of next to each input")
+    parser.add_argument('-j', '--jobs', type=int,
+                        help="concurrent ffmpeg processes (default: auto from cores, resolution and preset)")
+    parser.add_argument('--threads', type=int,
+                        help="threads per ffmpeg process (default: auto; derived from --jobs when that is given)")
+    parser.add_argument('--no-remux', action='store_true', help="always re-encode, never stream-copy")
+    parser.add_argument('--throttle', nargs='?', const='delay', choices=ADMISSION_ACTIONS,
+                        help="when the host is busy, hold new jobs back ('delay', default) or start them at "
+                             "low CPU/IO priority ('nice')")
+    parser.add_argument('--max-load', type=float, default=ADMISSION_MAX_LOAD,
+                        help="with --throttle, 1-minute load average per core (default: %(default)s)")
+    parser.add_argument('--max-steal', type=float, default=ADMISSION_MAX_STEAL,
+                        help="with --throttle, CPU steal fraction (default: %(default)s)")
+    parser.add_argument('--min-free-mem', type=parse_size, default=ADMISSION_MIN_FREE_MB * 1024 * 1024,
+                        help="with --throttle, minimum available memory (default: 1G)")
+    parser.add_argument('--max-disk-write', type=float, metavar='MB_PER_S',
+                        help="with --throttle, disk write throughput in MB/s (default: no limit)")
+    parser.add_argument('--budget', type=parse_duration, metavar='TIME',
+                        help="finish within this time (e.g. 2h, 90m, 1:30:00): sample-encode the inputs and pick "
+                             "the slowest preset that fits, overriding --preset")
+    parser.add_argument('--budget-per-file', action='store_true',
+                        help="with --budget, choose a preset per file instead of one for the whole batch")
+    parser.add_argument('--budget-presets',
+                        help="comma-separated presets --budget may choose from (default: ultrafast..slow)")
+    parser.add_argument('--segments', type=int, nargs='?', const=0,
+                        help="segment-parallel encoding; optional segment count (default: auto)")
+    parser.add_argument('--ladder', type=lambda value: parse_ladder(value, converter),
+                        help="comma-separated resolution presets to write from one decode, e.g. 720p,1080p")
+    parser.add_argument('--dedup', nargs='?', const='sampled', choices=('sampled', 'full'),
+                        help="encode identical inputs once and hard-link/copy the result to the other outputs; "
+                             "'sampled' (default) hashes size + head/middle/tail, 'full' the whole file")
+    parser.add_argument('--predict', action='store_true',
+                        help="encode a few short samples per file, print the predicted output size and encode "
+                             "time and exit without converting")
+    parser.add_argument('--predict-windows', type=int, default=PREVIEW_WINDOWS,
+                        help="sample windows per file for --predict (default: %(default)s)")
+    parser.add_argument('--predict-seconds', type=float, default=PREVIEW_SECONDS,
+                        help="length of each --predict sample in seconds (default: %(default)s)")
+    parser.add_argument('--thumbnails', type=int, nargs='?', const=THUMB_COUNT, metavar='N',
+                        help="also extract a keyframe thumbnail strip of N frames per input (default: %(const)s) "
+                             "at low priority; paths are listed in the --json report")
+    parser.add_argument('--queue', metavar='DIR',
+                        help="add the jobs to a shared queue directory and work on it; other hosts join with "
+                             "shared_queue.py DIR")
+    parser.add_argument('--enqueue-only', action='store_true', help="with --queue, only add the jobs")
+    parser.add_argument('--no-cache', action='store_true', help="do not use the on-disk probe cache")
+    parser.add_argument('--resume', metavar='MANIFEST',
+                        help="JSON Lines conversion manifest; re-runs convert only missing, failed or stale outputs")
+    parser.add_argument('--json', action='store_true', help="print a JSON report of the results on stdout")
+    parser.add_argument('--quiet', action='store_true', help="no progress output on stderr")
+    return parser
+
+def main(argv=None):
+    """CLI entry point; returns the process exit code"""
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    if not args.inputs and not args.manifest:
+        parser.print_usage(sys.stderr)
+        print("error: no inputs given", file=sys.stderr)
+        return EXIT_USAGE
+
+    converter = VideoConverter(None if args.no_cache else ProbeCache())
+    manifest = ConversionManifest(args.resume) if args.resume else None
+    printer = ProgressPrinter(quiet=args.quiet)
+    admission = None
+    if args.throttle:
+        admission = AdmissionControl(args.max_load, args.max_steal, args.min_free_mem // (1024 * 1024),
+                                     args.max_disk_write, args.throttle, on_change=printer.throttle_changed)
+    batch = BatchConverter(converter, args.jobs, manifest, args.threads, args.dedup, admission)
+    if admission:
+        printer.batch = batch
+    try:
+        jobs = build_jobs(args, converter, batch)
+    except (argparse.ArgumentTypeError, OSError, ValueError, KeyError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return EXIT_USAGE
+    budget_presets = [name.strip() for name in args.budget_presets.split(',')] if args.budget_presets else None
+    if budget_presets and not set(budget_presets) <= set(converter.encoding_presets):
+        print(f"error: invalid --budget-presets: {args.budget_presets}", file=sys.stderr)
+        return EXIT_USAGE
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    if args.queue:
+        shared = SharedQueue(args.queue)
+        try:
+            added = shared.enqueue(jobs)
+        except (argparse.ArgumentTypeError, OSError, ValueError, KeyError) as e:
+            print(f"error: {e}", file=sys.stderr)
+            return EXIT_USAGE
+        print(f"Queued {added} job(s) in {shared.root}", file=sys.stderr)
+        return EXIT_OK if args.enqueue_only else run_queue(shared, batch)
+    thumbs, thumbnails = None, {}
+    if args.thumbnails and not args.predict:
+        thumbs = ThumbnailStrip(converter, count=args.thumbnails)
+        jobs = with_thumbnails(jobs, thumbs, thumbnails)
+
+    started = time.monotonic()
+    install_signal_handlers(batch.control)
+    budget = None
+    try:
+        if args.predict:
+            if args.budget:
+                planned = plan_with_budget(args, batch, list(jobs), budget_presets)[0]
+            else:
+                planned = batch.plan_batch(list(jobs))[0]
+            return predict(args, batch, planned)
+        if args.budget:
+            # 时间预算需要先看到全部文件
+            planned, skipped, estimate, budget = plan_with_budget(args, batch, list(jobs), budget_presets)
+            results = batch.run(planned, on_file_done=printer.file_done, on_file_progress=printer.file_progress)
+        else:
+            # 边扫描边转换：首个文件探测完即开始编码，不在内存中保存完整文件列表
+            results, skipped, estimate = batch.run_stream(jobs, on_file_done=printer.file_done,
+                                                          on_file_progress=printer.file_progress)
+    except (argparse.ArgumentTypeError, OSError, ValueError, KeyError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return EXIT_USAGE
+    finally:
+        if thumbs:
+            thumbs.shutdown()
+    thumbnails = {path: future.result() for path, future in thumbnails.items()}
+    if not estimate['files']:
+        print("error: no video files found", file=sys.stderr)
+        return EXIT_USAGE
+    estimate['workers'], estimate['threads'] = batch.max_workers, batch.threads
+    failed = sum(1 for _, ok, _ in results if not ok)
+
+    if args.json:
+        report = {
+            'succeeded': len(results) - failed,
+            'failed': failed,
+            'skipped': len(skipped),
+            'elapsed': round(time.monotonic() - started, 3),
+            'estimate': estimate,
+            'throughput': batch.stats,
+            'budget': budget,
+            'results': [
+                {'input': job['input'], 'output': job['output'], 'status': 'ok' if ok else 'failed', 'error': err or None,
+                 'duplicate_of': job.get('duplicate_of'), 'thumbnail': thumbnails.get(job['input'])}
+                for job, ok, err in results
+            ] + [
+                {'input': job['input'], 'output': job['output'], 'status': 'skipped',
+                 'reason': job.get('skip_reason'), 'error': None, 'thumbnail': thumbnails.get(job['input'])}
+                for job in skipped
+            ],
+        }
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write("\n")
+    elif not args.quiet:
+        rate = f", {batch.stats['files_per_hour']:.0f} files/hour" if results else ""
+        if estimate['duplicates']:
+            rate += (f", {estimate['duplicates']} duplicate(s) linked instead of encoded"
+                     f" ({estimate['duplicate_duration'] / 60:.1f} min of media)")
+        print(f"Done: {len(results) - failed} succeeded, {failed} failed, {len(skipped)} skipped{rate}", file=sys.stderr)
+        if thumbs:
+            print(f"Thumbnails: {sum(1 for path in thumbnails.values() if path)} in {thumbs.cache_dir}", file=sys.stderr)
+
+    if batch.control.cancelled:
+        return EXIT_CANCELLED
+    return EXIT_FAILED if failed else EXIT_OK
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Converter Benchmark - reproducible speed/size numbers for VideoConverter
+Builds synthetic lavfi sources (testsrc2 + sine) and runs convert_video over
+the quality x encoding preset x resolution matrix
+
+Usage:
+  python converter_bench.py --sources 720p:10,1080p:10 --report bench.json --csv bench.csv
+  python converter_bench.py --presets fast,medium --qualities Medium --compare baseline.json
+
+Exit codes:
+  0  benchmark finished (and no regressions against the baseline)
+  1  a cell failed, or --compare found regressions beyond --tolerance
+  2  invalid arguments
+"""
+
+import sys
+import os
+import csv
+import json
+import time
+import shutil
+import signal
+import argparse
+import platform
+import tempfile
+import multiprocessing
+from queue import Empty
+from datetime import datetime
+
+from converter_core import VideoConverter, JobControl, ffmpeg
+from convert_cli import parse_resolution
+
+try:
+    import resource
+except ImportError:  # Windows: 没有 getrusage，CPU时间/峰值内存记为 None
+    resource = None
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+
+SOURCE_FPS = 30
+# 比较基线时检查的指标：方向 +1 表示越大越好，-1 表示越小越好
+COMPARE_METRICS = (('encode_fps', 1), ('wall_time', -1), ('cpu_time', -1), ('peak_rss_kb', -1), ('output_bytes', -1))
+CSV_FIELDS = ('source', 'quality', 'crf', 'preset', 'resolution', 'ok', 'wall_time', 'encode_fps',
+              'realtime', 'cpu_time', 'peak_rss_kb', 'output_bytes', 'frames', 'error')
+
+def parse_sources(value, converter):
+    """Parse "720p:10,1920x1080:30" into (label, width, height, seconds) tuples"""
+    sources = []
+    for item in value.split(','):
+        name, _, seconds = item.strip().partition(':')
+        width, height = parse_resolution(name, converter)
+        sources.append((f"{width}x{height}_{seconds or 10}s", width, height, float(seconds or 10)))
+    return sources
+
+def pick(names, available, what):
+    """Filter a comma-separated selection against the available names"""
+    if not names:
+        return list(available)
+    lookup = {name.lower(): name for name in available}
+    chosen = []
+    for name in names.split(','):
+        if name.strip().lower() not in lookup:
+            raise argparse.ArgumentTypeError(f"unknown {what}: {name}")
+        chosen.append(lookup[name.strip().lower()])
+    return chosen
+
+def make_source(path, width, height, seconds):
+    """Render a deterministic test clip (testsrc2 video + sine audio)"""
+    if os.path.exists(path):
+        return path
+    video = ffmpeg.input(f"testsrc2=size={width}x{height}:rate={SOURCE_FPS}:duration={seconds}", f='lavfi')
+    audio = ffmpeg.input(f"sine=frequency=1000:sample_rate=48000:duration={seconds}", f='lavfi')
+    # 源文件本身是 H.264/AAC，与真实素材一样需要解码
+    (ffmpeg
+        .output(video, audio, path, vcodec='libx264', preset='ultrafast', crf=18, pix_fmt='yuv420p', acodec='aac')
+        .global_args('-hide_banner')
+        .run(quiet=True, overwrite_output=True))
+    return path
+
+def run_cell(cell, queue):
+    """Encode one matrix cell in a fresh process so its rusage covers only this ffmpeg"""
+    frames = {}
+    def on_progress(info):
+        frames['frame'] = info.get('frame') or frames.get('frame')
+
+    # measure() 中断时 terminate() 本进程；ffmpeg 在独立进程组里，需要显式取消
+    control = JobControl()
+    signal.signal(signal.SIGTERM, lambda signum, frame: control.cancel(grace=0))
+    converter = VideoConverter()
+    started = time.monotonic()
+    ok, err = converter.convert_video(cell['input'], cell['output'], cell['scale'], cell['crf'], cell['preset'],
+                                      progress_callback=on_progress, remux=False, threads=cell.get('threads'),
+                                      control=control)
+    wall = time.monotonic() - started
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN) if resource else None
+    queue.put({
+        'ok': ok,
+        'error': err or None,
+        'wall_time': round(wall, 3),
+        'frames': frames.get('frame'),
+        'cpu_time': round(usage.ru_utime + usage.ru_stime, 3) if usage else None,
+        # Linux 上 ru_maxrss 单位是 KB，macOS 是字节
+        'peak_rss_kb': (usage.ru_maxrss // 1024 if sys.platform == 'darwin' else usage.ru_maxrss) if usage else None,
+    })
+
+def measure(cell, poll=1.0):
+    """Run one cell in a child process and return its metrics
+
+    A child that dies without reporting (crash, OOM kill) is recorded as a
+    failed cell instead of blocking the benchmark forever.
+    """
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=run_cell, args=(cell, queue))
+    started = time.monotonic()
+    process.start()
+    try:
+        while True:
+            try:
+                result = queue.get(timeout=poll)
+                break
+            except Empty:
+                if process.is_alive():
+                    continue
+            # 子进程已退出：结果可能仍在管道中，再取一次
+            try:
+                result = queue.get(timeout=poll)
+            except Empty:
+                process.join()
+                result = {
+                    'ok': False,
+                    'error': f"benchmark process exited with code {process.exitcode} without a result",
+                    'wall_time': round(time.monotonic() - started, 3),
+                    'frames': None, 'cpu_time': None, 'peak_rss_kb': None,
+                }
+            break
+    except KeyboardInterrupt:
+        process.terminate()
+        raise
+    process.join()
+    return result
+
+def run_matrix(converter, sources, qualities, presets, resolutions, work_dir, threads=None, log=None):
+    """Benchmark every source x quality x preset x resolution cell"""
+    quality_crf = dict(converter.quality_presets)
+    resolution_size = {name: (w, h) for name, w, h in converter.resolution_presets}
+    results = []
+    total = len(sources) * len(qualities) * len(presets) * len(resolutions)
+    for label, width, height, seconds in sources:
+        source = make_source(os.path.join(work_dir, f"src_{label}.mp4"), width, height, seconds)
+        for quality in qualities:
+            for preset in presets:
+                for resolution in resolutions:
+                    output = os.path.join(work_dir, 'out.mp4')
+                    cell = {
+                        'input': source, 'output': output, 'scale': resolution_size[resolution],
+                        'crf': quality_crf[quality], 'preset': preset, 'threads': threads,
+                    }
+                    metrics = measure(cell)
+                    wall = metrics['wall_time']
+                    frames = metrics['frames'] or int(seconds * SOURCE_FPS)
+                    row = {
+                        'source': label, 'quality': quality, 'crf': quality_crf[quality], 'preset': preset,
+                        'resolution': resolution, 'ok': metrics['ok'], 'wall_time': wall,
+                        'encode_fps': round(frames / wall, 2) if wall > 0 else None,
+                        'realtime': round(seconds / wall, 3) if wall > 0 else None,
+                        'cpu_time': metrics['cpu_time'], 'peak_rss_kb': metrics['peak_rss_kb'],
+                        'output_bytes': os.path.getsize(output) if metrics['ok'] and os.path.exists(output) else None,
+                        'frames': frames, 'error': metrics['error'],
+                    }
+                    if os.path.exists(output):
+                        os.remove(output)
+                    results.append(row)
+                    if log:
+                        log(len(results), total, row)
+    return results
+
+def cell_key(row):
+    return (row['source'], row['quality'], row['preset'], row['resolution'])
+
+def compare(results, baseline, tolerance):
+    """Compare results with a baseline report; returns (rows, regressions)"""
+    previous = {cell_key(row): row for row in baseline.get('results', [])}
+    rows, regressions = [], []
+    for row in results:
+        base = previous.get(cell_key(row))
+        if not base or not row['ok'] or not base.get('ok'):
+            continue
+        changes = {}
+        for metric, direction in COMPARE_METRICS:
+            old, new = base.get(metric), row.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            changes[metric] = round(change, 4)
+            if change * direction < -tolerance:
+                regressions.append((row, metric, old, new))
+        rows.append((row, changes))
+    return rows, regressions
+
+def environment():
+    """Host details stored with every report so numbers stay comparable"""
+    return {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'host': platform.node(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+    }
+
+def write_csv(path, results):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        for row in results:
+            writer.writerow({field: row.get(field) for field in CSV_FIELDS})
+
+def main(argv=None):
+    converter = VideoConverter()
+    parser = argparse.ArgumentParser(prog='converter_bench', description="Benchmark VideoConverter on synthetic sources")
+    parser.add_argument('--sources', default='720p:10,1080p:10',
+                        help="comma-separated RESOLUTION:SECONDS test clips (default: %(default)s)")
+    parser.add_argument('--qualities', help="quality presets to run (default: all but Custom)")
+    parser.add_argument('--presets', help="x264 presets to run (default: all)")
+    parser.add_argument('--resolutions', help="output resolution presets to run (default: all but Custom)")
+    parser.add_argument('--threads', type=int, help="threads per encode (default: ffmpeg decides)")
+    parser.add_argument('--work-dir', help="keep generated sources here and reuse them across runs")
+    parser.add_argument('--report', help="write the JSON report here")
+    parser.add_argument('--csv', help="write a CSV table here")
+    parser.add_argument('--compare', metavar='BASELINE', help="JSON report of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help="relative change counted as a regression in compare mode (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    try:
+        sources = parse_sources(args.sources, converter)
+        qualities = pick(args.qualities, [name for name, _ in converter.quality_presets if name != 'Custom'], 'quality')
+        presets = pick(args.presets, converter.encoding_presets, 'preset')
+        resolutions = pick(args.resolutions,
+                           [name for name, _, _ in converter.resolution_presets if name != 'Custom'], 'resolution')
+        baseline = None
+        if args.compare:
+            with open(args.compare, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+    except (argparse.ArgumentTypeError, OSError, ValueError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return EXIT_USAGE
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='converter_bench_')
+    os.makedirs(work_dir, exist_ok=True)
+
+    def log(done, total, row):
+        status = "✅" if row['ok'] else "❌"
+        print(f"{status} [{done}/{total}] {row['source']} {row['quality']} {row['preset']} -> {row['resolution']}: "
+              f"{row['wall_time']:.2f}s, {row['encode_fps'] or 0:.1f} fps, {row['realtime'] or 0:.2f}x realtime, "
+              f"{(row['output_bytes'] or 0) / 1024:.0f} KB", file=sys.stderr, flush=True)
+
+    try:
+        results = run_matrix(converter, sources, qualities, presets, resolutions, work_dir, args.threads, log)
+    except ffmpeg.Error as e:
+        print(f"error: could not generate test sources: {e.stderr.decode(errors='replace') if e.stderr else e}",
+              file=sys.stderr)
+        return EXIT_FAILED
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {'environment': environment(), 'threads': args.threads, 'results': results}
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"📄 Report: {args.report}", file=sys.stderr)
+    if args.csv:
+        write_csv(args.csv, results)
+        print(f"📄 CSV: {args.csv}", file=sys.stderr)
+
+    failed = sum(1 for row in results if not row['ok'])
+    regressions = []
+    if baseline is not None:
+        rows, regressions = compare(results, baseline, args.tolerance)
+        print(f"📊 Compared {len(rows)} cell(s) with {args.compare} "
+              f"({baseline.get('environment', {}).get('date', 'unknown date')})", file=sys.stderr)
+        for row, metric, old, new in regressions:
+            print(f"⚠️ {row['source']} {row['quality']} {row['preset']} -> {row['resolution']}: "
+                  f"{metric} {old} -> {new} ({(new - old) / old * 100:+.1f}%)", file=sys.stderr)
+        if not regressions:
+            print(f"✅ No regressions beyond {args.tolerance * 100:.0f}%", file=sys.stderr)
+    if not args.report and not args.csv:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write("\n")
+    return EXIT_FAILED if failed or regressions else EXIT_OK
+
+if __name__ == "__main__":
+    sys.exit(main())
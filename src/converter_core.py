@@ -0,0 +1,2326 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Video Converter Core - conversion engine shared by the GUI and the CLI
+Importable without PyQt5 so it can run on headless render servers
+"""
+
+import sys
+import os
+import json
+import time
+import queue
+import atexit
+import signal
+import fnmatch
+import hashlib
+import itertools
+import shutil
+import tempfile
+import threading
+import subprocess
+from collections import deque
+from datetime import datetime
+
+class _LazyFFmpeg:
+    """Import ffmpeg-python on first attribute access to keep start-up cheap"""
+    
+    _module = None
+    
+    def __getattr__(self, attr):
+        if _LazyFFmpeg._module is None:
+            # 普通 import 语句（而非 importlib），PyInstaller 打包时才能分析到依赖
+            import ffmpeg as module
+            _LazyFFmpeg._module = module
+        return getattr(_LazyFFmpeg._module, attr)
+
+# ffmpeg-python 导入较慢（约40ms），大量短任务的CLI只在真正调用时才加载
+ffmpeg = _LazyFFmpeg()
+
+class VideoConverter:
+    """Core video conversion functionality"""
+    
+    def __init__(self, probe_cache=None):
+        self.probe_cache = probe_cache
+        self.supported_formats = ['mp4', 'avi', 'mov', 'mkv', 'wmv', 'flv']
+        self.resolution_presets = [
+            ('720p', 1280, 720),
+            ('1080p', 1920, 1080),
+            ('4K', 3840, 2160),
+            ('Custom', 0, 0)
+        ]
+        self.quality_presets = [
+            ('High', 18),
+            ('Medium', 23),
+            ('Low', 28),
+            ('Custom', 23)
+        ]
+        self.encoding_presets = ['ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow', 'slower', 'veryslow']
+    
+    def convert_video(self, input_path, output_path, resolution=None, quality=None, preset='fast',
+                      progress_callback=None, remux='auto', threads=None, fit='pad', scaler=None, control=None):
+        """Convert video with specified parameters
+        
+        progress_callback, if given, receives a progress dict (see
+        FFmpegProgress.snapshot) every time ffmpeg reports progress.
+        remux='auto' stream-copies video and/or audio when the source already
+        fits the target (see plan_conversion); remux=False always re-encodes.
+        threads caps decoder and x264 threads (None lets ffmpeg use every core).
+        fit and scaler control how the video reaches the target resolution
+        (see plan_scale); scaler is an swscale algorithm such as 'lanczos'.
+        control is a JobControl that can pause or cancel the running ffmpeg;
+        a cancelled conversion removes its output and returns (False, CANCELLED).
+        """
+        try:
+            media = self.probe_media(input_path)
+            plan = self.plan_conversion(media, output_path, resolution, quality, remux, fit)
+            
+            # Build ffmpeg command
+            stream = ffmpeg.input(input_path, **({'threads': threads} if threads else {}))
+            streams = []
+            output_args = {}
+            
+            # 按探测到的流索引精确映射，避免封面图等附加流混入
+            if plan['video']:
+                video = stream[str(media['video']['index'])] if media else stream['v:0']
+                if plan['video'] == 'copy':
+                    output_args['c:v'] = 'copy'
+                else:
+                    # Apply resolution filters if needed
+                    video = apply_scale(video, plan['filters'], scaler)
+                    output_args['c:v'] = 'libx264'
+                    output_args['preset'] = preset
+                    output_args.update(x264_thread_args(threads))
+                    # Apply quality setting
+                    if quality:
+                        output_args['crf'] = quality
+                streams.append(video)
+            
+            if plan['audio']:
+                streams.append(stream[str(media['audio']['index'])] if media else stream['a:0?'])
+                output_args['c:a'] = 'copy' if plan['audio'] == 'copy' else 'aac'
+            
+            # Run conversion
+            duration = media['duration'] if media else None
+            total_frames = media['total_frames'] if media else None
+            self.run_ffmpeg(ffmpeg.output(*streams, output_path, **output_args), duration, total_frames, progress_callback,
+                            control)
+            
+            return True, ""
+            
+        except JobCancelled:
+            remove_partial(output_path)
+            return False, CANCELLED
+        except ffmpeg.Error as e:
+            return False, f"FFmpeg error: {e.stderr.decode(errors='replace') if e.stderr else str(e)}"
+        except Exception as e:
+            return False, f"Conversion error: {str(e)}"
+    
+    def convert_video_segmented(self, input_path, output_path, resolution=None, quality=None, preset='fast',
+                                progress_callback=None, remux='auto', segments=None, fit='pad', scaler=None,
+                                control=None, threads=None):
+        """Encode one long input as keyframe-aligned segments in parallel ffmpeg processes
+        
+        The source video is first split with stream copy by the segment muxer,
+        which cuts only on keyframes, so every chunk decodes independently. The
+        chunks are encoded concurrently (each output starts with an IDR frame),
+        then joined with the concat demuxer without re-encoding while the
+        audio is copied or encoded once from the original file, so there are no
+        audio seams. Falls back to convert_video when splitting would not help.
+        threads is the job's whole thread budget (see plan_concurrency): it
+        caps how many segments encode at once and is shared among them, so a
+        segmented job in a multi-worker batch stays within its share of cores.
+        """
+        media = self.probe_media(input_path)
+        plan = self.plan_conversion(media, output_path, resolution, quality, remux, fit)
+        duration = (media or {}).get('duration') or 0
+        segments = segments or default_segment_count(duration, threads)
+        if threads:
+            segments = min(segments, threads)  # 每段至少一个线程
+        if media and plan['video'] == 'encode' and segments >= 2:
+            segments, segment_time = plan_segments(duration, segments, self.keyframe_interval(input_path, media))
+        if not media or plan['video'] != 'encode' or segments < 2:
+            return self.convert_video(input_path, output_path, resolution, quality, preset, progress_callback, remux,
+                                      threads=threads, fit=fit, scaler=scaler, control=control)
+        
+        work_dir = tempfile.mkdtemp(prefix='.segments_', dir=os.path.dirname(os.path.abspath(output_path)))
+        try:
+            # 1) 按关键帧无损切分视频流
+            chunk_pattern = os.path.join(work_dir, 'chunk_%04d.nut')
+            split = ffmpeg.input(input_path)[str(media['video']['index'])].output(
+                chunk_pattern, f='segment', segment_time=f"{segment_time:.3f}",
+                segment_format='nut', reset_timestamps=1, **{'c:v': 'copy'}
+            )
+            self.run_ffmpeg(split, control=control)
+            chunks = sorted(os.path.join(work_dir, name) for name in os.listdir(work_dir) if name.startswith('chunk_'))
+            
+            # 2) 并行编码各段：同时运行的段数和每段线程数都在本任务的线程预算内，避免过度抢占CPU
+            budget = threads or os.cpu_count() or 1
+            concurrent = max(1, min(len(chunks), budget))
+            segment_threads = max(1, budget // concurrent)
+            encoded = [os.path.join(work_dir, f"encoded_{i:04d}.mp4") for i in range(len(chunks))]
+            aggregate = SegmentProgress(duration, media['total_frames'], len(chunks), progress_callback)
+            
+            def encode(i):
+                video = apply_scale(ffmpeg.input(chunks[i])['v:0'], plan['filters'], scaler)
+                args = {'c:v': 'libx264', 'preset': preset}
+                args.update(x264_thread_args(segment_threads))
+                if quality:
+                    args['crf'] = quality
+                self.run_ffmpeg(video.output(encoded[i], **args),
+                                progress_callback=lambda info: aggregate.update(i, info), control=control)
+            
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=concurrent) as pool:
+                for future in [pool.submit(encode, i) for i in range(len(chunks))]:
+                    future.result()
+            
+            # 3) concat demuxer 拼接（不重新编码），音频从原文件整体处理
+            concat_list = os.path.join(work_dir, 'concat.txt')
+            with open(concat_list, 'w', encoding='utf-8') as f:
+                for path in encoded:
+                    f.write("file '{}'\n".format(path.replace("'", "'\\''")))
+            streams = [ffmpeg.input(concat_list, f='concat', safe=0)['v:0']]
+            output_args = {'c:v': 'copy'}
+            if plan['audio']:
+                streams.append(ffmpeg.input(input_path)[str(media['audio']['index'])])
+                output_args['c:a'] = 'copy' if plan['audio'] == 'copy' else 'aac'
+            self.run_ffmpeg(ffmpeg.output(*streams, output_path, **output_args), control=control)
+            
+            if progress_callback:
+                progress_callback(aggregate.finish())
+            return True, ""
+        
+        except JobCancelled:
+            remove_partial(output_path)
+            return False, CANCELLED
+        except ffmpeg.Error as e:
+            return False, f"FFmpeg error: {e.stderr.decode(errors='replace') if e.stderr else str(e)}"
+        except Exception as e:
+            return False, f"Conversion error: {str(e)}"
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    
+    def convert_ladder(self, input_path, renditions, quality=None, preset='fast', progress_callback=None, remux='auto',
+                       threads=None, fit='pad', scaler=None, control=None):
+        """Write several scaled renditions from one decode in a single ffmpeg invocation
+        
+        renditions is a list of (name, width, height, output_path). The decoded
+        video is fanned out with a split filter to one scale + libx264 chain
+        per rendition. Progress dicts gain a 'renditions' list with each
+        output's name, path, current quantizer and bytes written so far.
+        threads is the budget for the whole process, shared by the encoders.
+        """
+        try:
+            if not renditions:
+                return False, "No renditions selected"
+            media = self.probe_media(input_path)
+            source = ffmpeg.input(input_path, **({'threads': threads} if threads else {}))
+            video = source[str(media['video']['index'])] if media and media['video'] else source['v:0']
+            audio = None
+            if not media or media['audio']:
+                audio = source[str(media['audio']['index'])] if media else source['a:0?']
+            
+            split = video.filter_multi_output('split', len(renditions))
+            outputs = []
+            for i, (name, width, height, output_path) in enumerate(renditions):
+                # 每个输出单独判断音频能否直接复制（取决于容器）
+                plan = self.plan_conversion(media, output_path, (width, height), quality, remux, fit)
+                scaled = apply_scale(split.stream(i), plan['filters'], scaler)
+                args = {'c:v': 'libx264', 'preset': preset}
+                args.update(x264_thread_args(max(1, threads // len(renditions)) if threads else None))
+                if quality:
+                    args['crf'] = quality
+                streams = [scaled]
+                if audio is not None:
+                    streams.append(audio)
+                    args['c:a'] = 'copy' if plan['audio'] == 'copy' else 'aac'
+                outputs.append(ffmpeg.output(*streams, output_path, **args))
+            
+            def report(info):
+                info['renditions'] = [
+                    {
+                        'name': name,
+                        'output': output_path,
+                        'q': _to_float(info.get('stream_q', {}).get(f'stream_{i}_0_q')),
+                        'size': os.path.getsize(output_path) if os.path.exists(output_path) else 0,
+                    }
+                    for i, (name, _, _, output_path) in enumerate(renditions)
+                ]
+                progress_callback(info)
+            
+            duration = media['duration'] if media else None
+            total_frames = media['total_frames'] if media else None
+            self.run_ffmpeg(ffmpeg.merge_outputs(*outputs), duration, total_frames,
+                            report if progress_callback else None, control)
+            return True, ""
+        
+        except JobCancelled:
+            for rendition in renditions:
+                remove_partial(rendition[3])
+            return False, CANCELLED
+        except ffmpeg.Error as e:
+            return False, f"FFmpeg error: {e.stderr.decode(errors='replace') if e.stderr else str(e)}"
+        except Exception as e:
+            return False, f"Conversion error: {str(e)}"
+    
+    def ladder_renditions(self, input_path, output_format, names, output_dir=None):
+        """Build (name, width, height, output_path) tuples for the named resolution presets"""
+        folder, filename = os.path.split(input_path)
+        base, _ = os.path.splitext(filename)
+        renditions = []
+        for name, width, height in self.resolution_presets:
+            if name in names and (width, height) != (0, 0):
+                output_path = os.path.join(output_dir or folder, f"{base}_{name}.{output_format}")
+                renditions.append((name, width, height, output_path))
+        return renditions
+    
+    def sample_encode(self, input_path, media, plan=None, quality=None, preset='fast', threads=None,
+                      points=3, seconds=4.0, scaler=None, control=None):
+        """Encode short video-only samples from evenly spaced points of an input
+        
+        plan is the job's conversion plan (its scale filters are applied).
+        Returns {'seconds', 'wall', 'speed', 'fps', 'bpp', 'bytes'} measured
+        over all samples (speed is media seconds encoded per wall second), or
+        None if the input is too short or a sample fails.
+        """
+        duration = (media or {}).get('duration') or 0
+        video = (media or {}).get('video')
+        if not video or duration <= 0:
+            return None
+        points = max(1, min(points, int(duration // seconds) or 1))
+        length = min(seconds, duration / points)
+        width, height = (plan or {}).get('scale') or (video['width'], video['height'])
+        
+        work_dir = tempfile.mkdtemp(prefix='vidtools_sample_')
+        totals = {'seconds': 0.0, 'wall': 0.0, 'frames': 0, 'bytes': 0}
+        try:
+            for k in range(points):
+                # 采样点取各等分区间的中部，避开片头片尾的黑场/字幕
+                start = max(0.0, min(duration - length, duration * (k + 0.5) / points - length / 2))
+                output = os.path.join(work_dir, f"sample_{k}.mp4")
+                stream = ffmpeg.input(input_path, ss=f"{start:.3f}", t=f"{length:.3f}",
+                                      **({'threads': threads} if threads else {}))[str(video['index'])]
+                stream = apply_scale(stream, (plan or {}).get('filters'), scaler)
+                args = {'c:v': 'libx264', 'preset': preset}
+                args.update(x264_thread_args(threads))
+                if quality:
+                    args['crf'] = quality
+                last = {}
+                started = time.monotonic()
+                self.run_ffmpeg(stream.output(output, **args), progress_callback=last.update, control=control)
+                totals['wall'] += time.monotonic() - started
+                totals['seconds'] += length
+                totals['frames'] += last.get('frame') or int(length * (video['fps'] or 25))
+                totals['bytes'] += os.path.getsize(output)
+        except (ffmpeg.Error, JobCancelled):
+            return None
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        
+        wall = max(totals['wall'], 1e-6)
+        return {
+            'seconds': totals['seconds'],
+            'wall': totals['wall'],
+            'speed': totals['seconds'] / wall,
+            'fps': totals['frames'] / wall,
+            'bpp': totals['bytes'] * 8 / max(1, totals['frames'] * width * height),
+            'bytes': totals['bytes'],
+        }
+    
+    def predict_conversion(self, input_path, output_path, resolution=None, quality=None, preset='fast', remux='auto',
+                           fit='pad', scaler=None, threads=None, windows=None, seconds=None, media=None, plan=None,
+                           control=None):
+        """Predict output size and encode time of one conversion from a few sample windows
+        
+        Re-encoded video is measured with sample_encode (windows x seconds
+        with the real settings); copied streams are estimated from the source
+        bitrate. media/plan may be passed when the caller already has them.
+        Returns {'size', 'encode_time', 'video_bytes', 'audio_bytes', 'bpp',
+        'speed', 'sampled'} or None if the input cannot be probed or sampled.
+        """
+        media = media or self.probe_media(input_path)
+        if not media or not media.get('duration'):
+            return None
+        plan = plan or self.plan_conversion(media, output_path, resolution, quality, remux, fit)
+        prediction = {'video_bytes': 0, 'audio_bytes': 0, 'encode_time': 0.0, 'bpp': None, 'speed': None,
+                      'sampled': False}
+        duration = media['duration']
+        if plan['video'] == 'encode':
+            sample = self.sample_encode(input_path, media, plan, quality, preset, threads,
+                                        windows or PREVIEW_WINDOWS, seconds or PREVIEW_SECONDS, scaler, control)
+            if not sample:
+                return None
+            prediction.update(
+                video_bytes=int(sample['bytes'] / sample['seconds'] * duration),
+                encode_time=duration / sample['speed'],
+                bpp=sample['bpp'], speed=sample['speed'], sampled=True,
+            )
+        elif plan['video'] == 'copy':
+            prediction['video_bytes'] = int((media['video'].get('bit_rate') or 0) / 8 * duration)
+        prediction['audio_bytes'] = int(predict_audio_bitrate(media, plan) / 8 * duration)
+        prediction['size'] = int((prediction['video_bytes'] + prediction['audio_bytes']) * CONTAINER_OVERHEAD)
+        return prediction
+    
+    def probe_media(self, input_path):
+        """Probe an input with ffprobe and summarise it, or None if probing fails"""
+        if self.probe_cache is not None:
+            return self.probe_cache.probe(input_path)
+        try:
+            return summarize_probe(ffmpeg.probe(input_path))
+        except Exception:
+            return None
+    
+    def keyframe_interval(self, input_path, media=None):
+        """Average keyframe spacing in seconds (cached when there is a probe cache), or None"""
+        if self.probe_cache is not None:
+            return self.probe_cache.keyframe_interval(input_path)
+        if media is not None and not media['video']:
+            return None
+        return probe_keyframe_interval(input_path)
+    
+    def plan_conversion(self, media, output_path, resolution=None, quality=None, remux='auto', fit='pad'):
+        """Decide per stream whether to stream-copy or re-encode
+        
+        Returns {'video': 'copy'|'encode'|None, 'audio': 'copy'|'encode'|None,
+        'scale': (w, h) or None, 'filters': [...]}, where 'scale' is the output
+        frame size when it changes and 'filters' the steps from plan_scale. A
+        stream is copied only if it already uses the target codec (h264/aac),
+        the container can hold it, no rescale is needed and, for video, the
+        source is not heavier than the CRF target.
+        """
+        if not media:
+            # 探测失败时全部重新编码，保持宽高比的缩放交给ffmpeg在运行时计算
+            scaling = plan_scale(None, resolution, fit)
+            return {'video': 'encode', 'audio': 'encode', 'scale': scaling and scaling['size'],
+                    'filters': scaling['filters'] if scaling else []}
+        
+        container = os.path.splitext(output_path)[1].lower().lstrip('.')
+        can_copy = remux and container in STREAM_COPY_CONTAINERS
+        plan = {'video': None, 'audio': None, 'scale': None, 'filters': []}
+        
+        video = media['video']
+        if video:
+            scaling = plan_scale(video, resolution, fit)
+            copy_video = (
+                can_copy
+                and video['codec'] == 'h264'
+                and not scaling
+                and (not quality or not exceeds_crf_target(video, quality))
+            )
+            plan['video'] = 'copy' if copy_video else 'encode'
+            if not scaling and not copy_video:
+                scaling = even_crop(video)  # libx264 的 yuv420p 要求宽高为偶数
+            if scaling:
+                plan['scale'], plan['filters'] = scaling['size'], scaling['filters']
+        
+        audio = media['audio']
+        if audio:
+            plan['audio'] = 'copy' if can_copy and audio['codec'] == 'aac' else 'encode'
+        return plan
+    
+    def run_ffmpeg(self, output_stream, duration=None, total_frames=None, progress_callback=None, control=None):
+        """Run an ffmpeg output stream asynchronously, parsing its -progress output
+        
+        ffmpeg runs in its own process group so a JobControl can pause,
+        resume and kill it (and anything it spawns) as a unit. Raises
+        ffmpeg.Error with the tail of stderr if ffmpeg fails, JobCancelled if
+        control was cancelled.
+        """
+        if control is not None and control.cancelled:
+            raise JobCancelled()
+        args = (
+            output_stream
+            .global_args('-hide_banner', '-nostdin', '-progress', 'pipe:1', '-nostats')
+            .compile(overwrite_output=True)
+        )
+        nice = control.nice if control is not None else 0
+        process = subprocess.Popen(low_priority_command(args, nice), stdin=subprocess.DEVNULL,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, **_own_process_group(nice))
+        _track_process(process)
+        if control is not None:
+            control.attach(process)
+        
+        # stderr 必须持续读取，否则管道写满后ffmpeg会阻塞
+        stderr_tail = deque(maxlen=200)
+        drain = threading.Thread(target=lambda: stderr_tail.extend(process.stderr), daemon=True)
+        drain.start()
+        
+        progress = FFmpegProgress(duration, total_frames)
+        for raw in process.stdout:
+            if progress.feed(raw.decode('utf-8', errors='replace')) and progress_callback:
+                progress_callback(progress.snapshot())
+        
+        process.wait()
+        drain.join()
+        _track_process(process, running=False)
+        if control is not None:
+            control.detach(process)
+            if control.cancelled:
+                raise JobCancelled()
+        if process.returncode != 0:
+            raise ffmpeg.Error('ffmpeg', None, b''.join(stderr_tail))
+    
+    def is_supported(self, filename):
+        """Check whether a filename has a supported video extension"""
+        if PARTIAL_MARKER in os.path.basename(filename):
+            return False  # 未完成的临时输出
+        return os.path.splitext(filename)[1].lower().lstrip('.') in self.supported_formats
+    
+    def output_path_for(self, input_path, output_format, output_dir=None):
+        """Build the default output path (<name>_converted.<fmt>) for an input"""
+        folder, filename = os.path.split(input_path)
+        name, _ = os.path.splitext(filename)
+        return os.path.join(output_dir or folder, f"{name}_converted.{output_format}")
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _parse_rate(value):
+    """Parse an ffprobe rate such as '30000/1001'"""
+    try:
+        num, _, den = str(value).partition('/')
+        return float(num) / float(den or 1) if float(den or 1) else None
+    except (TypeError, ValueError):
+        return None
+
+# 可直接封装 h264/aac 流的目标容器（wmv/asf 不适合直接拷贝）
+STREAM_COPY_CONTAINERS = ('mp4', 'mov', 'mkv', 'avi', 'flv')
+
+# libx264 在 CRF 23 时的典型码率密度（bits per pixel per frame），CRF 每 +6 码率约减半
+CRF_REFERENCE = 23
+CRF_REFERENCE_BPP = 0.1
+
+def summarize_probe(info):
+    """Reduce raw ffprobe JSON to the fields the converter plans with"""
+    fmt = info.get('format', {})
+    duration = _to_float(fmt.get('duration'))
+    video = audio = None
+    for s in info.get('streams', []):
+        kind = s.get('codec_type')
+        if kind == 'video' and video is None and not s.get('disposition', {}).get('attached_pic'):
+            fps = _parse_rate(s.get('avg_frame_rate')) or _parse_rate(s.get('r_frame_rate'))
+            video = {
+                'index': s.get('index', 0),
+                'codec': s.get('codec_name'),
+                'width': _to_int(s.get('width')) or 0,
+                'height': _to_int(s.get('height')) or 0,
+                'pix_fmt': s.get('pix_fmt'),
+                'color_range': s.get('color_range'),  # 'tv'（限制范围）、'pc'（全范围）或未标注
+                'fps': fps,
+                'sar': _parse_rate(str(s.get('sample_aspect_ratio') or '').replace(':', '/')) or 1.0,
+                'bit_rate': _to_int(s.get('bit_rate')),
+                'nb_frames': _to_int(s.get('nb_frames')),
+            }
+        elif kind == 'audio' and audio is None:
+            audio = {
+                'index': s.get('index', 0),
+                'codec': s.get('codec_name'),
+                'channels': _to_int(s.get('channels')),
+                'sample_rate': _to_int(s.get('sample_rate')),
+                'bit_rate': _to_int(s.get('bit_rate')),
+            }
+    
+    total_frames = None
+    if video:
+        if not video['bit_rate'] and _to_int(fmt.get('bit_rate')):
+            # mkv 等容器不给出单流码率，用总码率减去音频码率估算
+            video['bit_rate'] = _to_int(fmt.get('bit_rate')) - ((audio or {}).get('bit_rate') or 0)
+        total_frames = video['nb_frames']
+        if not total_frames and duration and video['fps']:
+            total_frames = int(round(duration * video['fps']))
+    
+    return {
+        'duration': duration,
+        'total_frames': total_frames,
+        'bit_rate': _to_int(fmt.get('bit_rate')),
+        'format_name': fmt.get('format_name'),
+        'video': video,
+        'audio': audio,
+    }
+
+def exceeds_crf_target(video, crf):
+    """Whether a video stream is noticeably heavier than libx264 would make it at this CRF"""
+    if not (video.get('bit_rate') and video.get('width') and video.get('height') and video.get('fps')):
+        return True  # 信息不足时保守处理，重新编码
+    bpp = video['bit_rate'] / (video['width'] * video['height'] * video['fps'])
+    target = CRF_REFERENCE_BPP * 2 ** ((CRF_REFERENCE - crf) / 6)
+    return bpp > target * 1.25
+
+# 缩放时保持宽高比的方式：pad 加黑边、crop 裁掉多余部分、stretch 直接拉伸（旧行为）
+SCALE_FITS = ('pad', 'crop', 'stretch')
+# swscale 缩放算法，从快到慢
+SCALERS = ('fast_bilinear', 'bilinear', 'bicubic', 'lanczos')
+
+def _even(value):
+    return max(2, int(value) // 2 * 2)
+
+def plan_scale(video, resolution=None, fit='pad'):
+    """Filter steps that bring a video stream to a target resolution, or None if it already matches
+    
+    Returns {'size': (w, h), 'filters': [(name, args, kwargs), ...]}. With
+    fit='pad' or 'crop' the target follows the source's orientation (a
+    vertical clip converted to 1080p becomes 1080x1920), the aspect ratio is
+    kept by letterboxing or center-cropping, and every size is even.
+    Anamorphic sources are resampled to square pixels. Without probe data
+    (video=None) ffmpeg works out the aspect-preserving size at run time,
+    inside the target frame as given (no orientation swap).
+    """
+    target = tuple(resolution) if resolution and tuple(resolution) != (0, 0) else None
+    if not target:
+        return None
+    width, height = target
+    if video is None:
+        width, height = _even(width), _even(height)
+        if fit == 'stretch':
+            return {'size': (width, height), 'filters': [('scale', (width, height), {}), ('setsar', (1,), {})]}
+        mode = 'decrease' if fit == 'pad' else 'increase'
+        filters = [('scale', (width, height), {'force_original_aspect_ratio': mode, 'force_divisible_by': 2})]
+        if fit == 'pad':
+            filters.append(('pad', (width, height, '(ow-iw)/2', '(oh-ih)/2'), {}))
+        else:
+            filters.append(('crop', (width, height), {}))
+        filters.append(('setsar', (1,), {}))
+        return {'size': (width, height), 'filters': filters}
+    
+    src_w, src_h = video['width'], video['height']
+    if not src_w or not src_h:
+        return None
+    sar = video.get('sar') or 1.0
+    display_w = src_w * sar
+    if fit != 'stretch' and width != height and (display_w < src_h) != (width < height):
+        width, height = height, width
+    width, height = _even(width), _even(height)
+    if (src_w, src_h) == (width, height) and abs(sar - 1.0) < 1e-3:
+        return None  # 尺寸已一致，不做无意义的缩放
+    
+    if fit == 'stretch':
+        return {'size': (width, height), 'filters': [('scale', (width, height), {}), ('setsar', (1,), {})]}
+    factor = (min if fit == 'pad' else max)(width / display_w, height / src_h)
+    scaled_w, scaled_h = _even(round(display_w * factor)), _even(round(src_h * factor))
+    # 比例只差一两个像素时直接铺满，避免极细的黑边
+    if abs(scaled_w - width) <= 2 and abs(scaled_h - height) <= 2:
+        scaled_w, scaled_h = width, height
+    filters = [('scale', (scaled_w, scaled_h), {}), ('setsar', (1,), {})]
+    if (scaled_w, scaled_h) != (width, height):
+        if fit == 'pad':
+            filters.append(('pad', (width, height, (width - scaled_w) // 2, (height - scaled_h) // 2), {}))
+        else:
+            filters.append(('crop', (width, height), {}))
+    return {'size': (width, height), 'filters': filters}
+
+def even_crop(video):
+    """Crop off the last row/column of an odd-sized stream, or None if it is already even"""
+    width, height = video.get('width') or 0, video.get('height') or 0
+    if not width or not height or (width % 2 == 0 and height % 2 == 0):
+        return None
+    size = (_even(width), _even(height))
+    return {'size': size, 'filters': [('crop', size, {'x': 0, 'y': 0})]}
+
+# 预览采样：默认取三个5秒窗口
+PREVIEW_WINDOWS = 3
+PREVIEW_SECONDS = 5.0
+# ffmpeg 内置 aac 编码器的默认码率，以及封装开销（索引、时间戳等）的经验比例
+AAC_DEFAULT_BITRATE = 128000
+CONTAINER_OVERHEAD = 1.01
+
+def predict_audio_bitrate(media, plan):
+    """Audio bitrate the output will carry: the source's when copied, the aac default when re-encoded"""
+    if not plan.get('audio') or not media.get('audio'):
+        return 0
+    if plan['audio'] == 'copy':
+        return media['audio'].get('bit_rate') or AAC_DEFAULT_BITRATE
+    return AAC_DEFAULT_BITRATE
+
+def apply_scale(stream, filters, scaler=None):
+    """Apply plan_scale filter steps to an ffmpeg-python stream"""
+    for name, args, kwargs in filters or []:
+        if name == 'scale' and scaler:
+            kwargs = dict(kwargs, flags=scaler)
+        stream = stream.filter(name, *args, **kwargs)
+    return stream
+
+def probe_keyframe_interval(input_path, window=60):
+    """Average keyframe spacing in seconds over the first `window` seconds, or None"""
+    cmd = [
+        'ffprobe', '-v', 'error', '-select_streams', 'v:0', '-read_intervals', f'%+{window}',
+        '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', input_path
+    ]
+    try:
+        out = subprocess.run(cmd, capture_output=True, text=True, timeout=120).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    times = []
+    for line in out.splitlines():
+        pts, _, flags = line.partition(',')
+        if 'K' in flags and _to_float(pts) is not None:
+            times.append(float(pts))
+    times.sort()
+    if len(times) < 2:
+        return None
+    return (times[-1] - times[0]) / (len(times) - 1)
+
+# 输出先写入临时名，成功后原子重命名，半成品永远不会被当成已完成
+CANCELLED = "Cancelled"
+# 取消时先 SIGTERM，之后 SIGKILL；输出反正要删除，不必等编码器把缓冲帧全部刷完
+CANCEL_GRACE_SECONDS = 2.0
+# Windows 没有 SIGSTOP/SIGCONT，不支持暂停
+PAUSE_SUPPORTED = hasattr(signal, 'SIGSTOP')
+
+class JobCancelled(Exception):
+    """Raised by run_ffmpeg when its JobControl has been cancelled"""
+
+def _own_process_group(nice=0):
+    """Popen kwargs that start a child in a new process group (below normal priority on Windows if nice)"""
+    if sys.platform == 'win32':
+        flags = subprocess.CREATE_NEW_PROCESS_GROUP
+        return {'creationflags': flags | subprocess.BELOW_NORMAL_PRIORITY_CLASS if nice else flags}
+    return {'start_new_session': True}
+
+def _signal_group(process, sig):
+    """Send a signal to a child's whole process group; on Windows only kill is possible"""
+    if process.poll() is not None:
+        return
+    try:
+        if sys.platform == 'win32':
+            process.kill()
+        else:
+            os.killpg(process.pid, sig)
+    except OSError:
+        pass  # 进程已退出
+
+# 运行中的 ffmpeg 进程：它们在独立进程组里收不到终端的 Ctrl+C，解释器退出时统一清理
+_running_processes = set()
+_running_lock = threading.Lock()
+
+def _track_process(process, running=True):
+    with _running_lock:
+        if running:
+            _running_processes.add(process)
+        else:
+            _running_processes.discard(process)
+
+@atexit.register
+def _kill_running_processes():
+    with _running_lock:
+        processes = list(_running_processes)
+    for process in processes:
+        _signal_group(process, getattr(signal, 'SIGKILL', signal.SIGTERM))
+
+class JobControl:
+    """Cancel, pause and resume handle for running conversions
+    
+    Pass one to the VideoConverter methods (or let BatchConverter create one
+    per job); every ffmpeg they start is attached and signalled as a process
+    group: SIGSTOP/SIGCONT to pause and resume, SIGTERM and then SIGKILL
+    after a grace period to cancel. A control with a parent (the batch's
+    control) is also paused or cancelled through it.
+    """
+    
+    def __init__(self, parent=None, nice=0):
+        self.parent = parent
+        # >0：以 nice/ionice 降低优先级启动 ffmpeg（见 AdmissionControl）
+        self.nice = nice
+        self._cancelled = False
+        self._paused = False
+        self._processes = set()
+        self._lock = threading.Lock()
+    
+    @property
+    def cancelled(self):
+        return self._cancelled or (self.parent is not None and self.parent.cancelled)
+    
+    @property
+    def paused(self):
+        return self._paused or (self.parent is not None and self.parent.paused)
+    
+    def attach(self, process):
+        """Register a running ffmpeg; it is stopped at once if the control is paused
+        
+        A process attached after cancel() took its snapshot (cancelled while
+        ffmpeg was starting) is terminated here, so it never runs to the end.
+        """
+        with self._lock:
+            self._processes.add(process)
+        if self.parent is not None:
+            self.parent.attach(process)
+        with self._lock:
+            # 在锁内检查：cancel() 要么已在快照中看到此进程，要么已置位标志
+            cancelled = self.cancelled
+        if cancelled:
+            self._terminate([process])
+        elif self.paused and PAUSE_SUPPORTED:
+            _signal_group(process, signal.SIGSTOP)
+    
+    def detach(self, process):
+        with self._lock:
+            self._processes.discard(process)
+        if self.parent is not None:
+            self.parent.detach(process)
+    
+    def _snapshot(self):
+        with self._lock:
+            return list(self._processes)
+    
+    def pause(self):
+        """Stop every attached ffmpeg; returns False where pausing is not supported"""
+        if not PAUSE_SUPPORTED:
+            return False
+        self._paused = True
+        for process in self._snapshot():
+            _signal_group(process, signal.SIGSTOP)
+        return True
+    
+    def resume(self):
+        """Continue the attached ffmpeg processes (unless a parent is still paused)"""
+        self._paused = False
+        if PAUSE_SUPPORTED and not self.paused:
+            for process in self._snapshot():
+                _signal_group(process, signal.SIGCONT)
+    
+    def cancel(self, grace=CANCEL_GRACE_SECONDS):
+        """Terminate the attached ffmpeg processes, killing any still alive after grace seconds"""
+        with self._lock:
+            self._cancelled = True
+            self._paused = False
+            processes = list(self._processes)
+        self._terminate(processes, grace)
+    
+    @staticmethod
+    def _terminate(processes, grace=CANCEL_GRACE_SECONDS):
+        for process in processes:
+            if PAUSE_SUPPORTED:
+                _signal_group(process, signal.SIGCONT)  # 已暂停的进程要先恢复才能处理 SIGTERM
+            _signal_group(process, signal.SIGTERM)
+        if processes:
+            timer = threading.Timer(grace, lambda: [_signal_group(p, getattr(signal, 'SIGKILL', signal.SIGTERM))
+                                                    for p in processes])
+            timer.daemon = True
+            timer.start()
+    
+    def wait_if_paused(self, interval=0.2):
+        """Block while paused; returns False if cancelled"""
+        while self.paused and not self.cancelled:
+            time.sleep(interval)
+        return not self.cancelled
+
+PARTIAL_MARKER = '.partial'
+
+def partial_path(output_path):
+    """Temporary name an output is written to before the atomic rename"""
+    folder, filename = os.path.split(output_path)
+    name, ext = os.path.splitext(filename)
+    # 保留扩展名，ffmpeg 依赖它判断封装格式
+    return os.path.join(folder, f".{name}{PARTIAL_MARKER}-{os.getpid()}-{threading.get_ident()}{ext}")
+
+def remove_partial(path):
+    """Delete an unfinished output if it exists"""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def file_fingerprint(path):
+    """(size, mtime_ns) of a file, or None if it does not exist"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+def job_params_key(job):
+    """Stable hash of the parameters that determine a job's output"""
+    params = {
+        'output': os.path.abspath(job['output']),
+        'resolution': list(job['resolution']) if job.get('resolution') else None,
+        'quality': job.get('quality'),
+        'preset': job.get('preset', 'fast'),
+        'remux': job.get('remux', 'auto'),
+        'segments': job.get('segments'),
+        'renditions': [[r[0], r[1], r[2], os.path.abspath(r[3])] for r in job.get('renditions') or []],
+    }
+    # 仅在偏离默认值时计入，旧清单中的记录保持有效
+    for key, default in (('fit', 'pad'), ('scaler', None)):
+        if job.get(key, default) != default:
+            params[key] = job[key]
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+# 抽样哈希时头/中/尾各读取的字节数
+CONTENT_SAMPLE_BYTES = 1024 * 1024
+
+def content_fingerprint(path, full=False, sample_bytes=CONTENT_SAMPLE_BYTES):
+    """Cheap content identity of a file: size plus a sha1 of its head, middle and tail
+    
+    full=True hashes the whole file instead. Returns a hex string, or None if
+    the file cannot be read.
+    """
+    digest = hashlib.sha1()
+    try:
+        size = os.path.getsize(path)
+        digest.update(str(size).encode('ascii'))
+        with open(path, 'rb') as f:
+            if full or size <= 3 * sample_bytes:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(block)
+            else:
+                for offset in (0, size // 2 - sample_bytes // 2, size - sample_bytes):
+                    f.seek(offset)
+                    digest.update(f.read(sample_bytes))
+    except OSError:
+        return None
+    return f"{'full' if full else 'sampled'}:{size}:{digest.hexdigest()}"
+
+def dedup_key(job, fingerprint):
+    """Key under which two jobs produce identical outputs: same content and same conversion parameters"""
+    params = {
+        'content': fingerprint,
+        'containers': [os.path.splitext(path)[1].lower() for path in job_outputs(job)],
+        'resolution': list(job['resolution']) if job.get('resolution') else None,
+        'quality': job.get('quality'),
+        'preset': job.get('preset', 'fast'),
+        'remux': job.get('remux', 'auto'),
+        'segments': job.get('segments'),
+        'fit': job.get('fit', 'pad'),
+        'scaler': job.get('scaler'),
+        'renditions': [[r[0], r[1], r[2]] for r in job.get('renditions') or []],
+    }
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+
+def link_or_copy(source, target):
+    """Materialise source at target via a hard link, or a copy across filesystems"""
+    if os.path.abspath(source) == os.path.abspath(target):
+        return
+    tmp = partial_path(target)
+    try:
+        try:
+            os.link(source, tmp)
+        except OSError:
+            shutil.copy2(source, tmp)
+        os.replace(tmp, target)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+class DedupIndex:
+    """Encode identical inputs once and hand the result to every duplicate
+    
+    The first job seen with a given dedup_key becomes the leader; later jobs
+    with the same key are attached to it and, once the leader has converted,
+    receive its outputs as hard links (or copies).
+    """
+    
+    def __init__(self, full_hash=False, probe_cache=None):
+        self.full_hash = full_hash
+        self.probe_cache = probe_cache
+        self.leaders = {}
+        self.saved_seconds = 0.0
+        self._lock = threading.Lock()
+    
+    def fingerprint(self, path):
+        if self.probe_cache is not None:
+            return self.probe_cache.content_hash(path, self.full_hash)
+        return content_fingerprint(path, self.full_hash)
+    
+    def claim(self, job):
+        """Register a job; returns (leader, result) for a duplicate or (None, None) for a new leader
+        
+        result is the leader's (ok, err) if it has already finished (the
+        caller must then call materialize), or None if the job was attached
+        and will be handled by finish().
+        """
+        fingerprint = self.fingerprint(job['input'])
+        if not fingerprint:
+            return None, None
+        key = dedup_key(job, fingerprint)
+        with self._lock:
+            leader = self.leaders.get(key)
+            if leader is None:
+                self.leaders[key] = job
+                job['duplicates'] = []
+                return None, None
+            self.saved_seconds += (job.get('media') or {}).get('duration') or 0
+            job['duplicate_of'] = leader['input']
+            if 'dedup_result' in leader:
+                return leader, leader['dedup_result']
+            leader['duplicates'].append(job)
+            return leader, None
+    
+    def finish(self, leader, ok, err):
+        """Record a leader's result and materialise its attached duplicates; returns [(job, ok, err)]"""
+        with self._lock:
+            leader['dedup_result'] = (ok, err)
+            duplicates = list(leader.get('duplicates') or [])
+        return [(job,) + self.materialize(leader, job, ok, err) for job in duplicates]
+    
+    def materialize(self, leader, job, ok, err):
+        """Give one duplicate the leader's outputs; returns (ok, err)"""
+        if not ok:
+            return False, err
+        try:
+            for source, target in zip(job_outputs(leader), job_outputs(job)):
+                os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+                link_or_copy(source, target)
+        except OSError as e:
+            return False, f"Duplicate link error: {str(e)}"
+        return True, ""
+
+def job_outputs(job):
+    """All output paths a job writes"""
+    if job.get('renditions'):
+        return [r[3] for r in job['renditions']]
+    return [job['output']]
+
+class ConversionManifest:
+    """Append-only JSON Lines record of batch results, used to resume interrupted batches
+    
+    Each line holds an input's fingerprint, a hash of the conversion
+    parameters, the fingerprints of its outputs and the status. The last
+    line for an input wins. A job is current only if it finished, neither
+    the input nor the parameters changed, and its outputs are untouched.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        self.load()
+    
+    def load(self):
+        """Read the manifest, ignoring a torn last line from a crash"""
+        self.entries = {}
+        lines = 0
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if isinstance(entry, dict) and entry.get('input'):
+                        self.entries[entry['input']] = entry
+        except OSError:
+            return
+        if lines > 2 * len(self.entries) + 100:
+            self.compact()
+    
+    def compact(self):
+        """Rewrite the manifest with only the latest line per input"""
+        with self._lock:
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    for entry in self.entries.values():
+                        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                os.replace(tmp, self.path)
+            except OSError as e:
+                print(f"⚠️ 清单压缩失败: {e}", file=sys.stderr)
+    
+    def is_current(self, job):
+        """Whether a job's recorded output is complete and still valid"""
+        entry = self.entries.get(os.path.abspath(job['input']))
+        if not entry or entry.get('status') != 'done':
+            return False
+        if entry.get('fingerprint') != file_fingerprint(job['input']):
+            return False
+        if entry.get('params') != job_params_key(job):
+            return False
+        outputs = entry.get('outputs') or {}
+        return all(outputs.get(os.path.abspath(path)) == file_fingerprint(path) for path in job_outputs(job))
+    
+    def has_handled(self, job):
+        """Whether this exact input was already processed with these parameters, whatever the outcome"""
+        entry = self.entries.get(os.path.abspath(job['input']))
+        return bool(entry) and entry.get('fingerprint') == file_fingerprint(job['input']) \
+            and entry.get('params') == job_params_key(job)
+    
+    def record(self, job, ok, err=""):
+        """Append the outcome of one job and flush it to disk"""
+        entry = {
+            'input': os.path.abspath(job['input']),
+            'fingerprint': file_fingerprint(job['input']),
+            'params': job_params_key(job),
+            'status': 'done' if ok else 'failed',
+            'outputs': {os.path.abspath(path): file_fingerprint(path) for path in job_outputs(job)} if ok else {},
+            'error': None if ok else (err or "")[-2000:],
+            'time': datetime.now().isoformat(timespec='seconds'),
+        }
+        with self._lock:
+            self.entries[entry['input']] = entry
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+            except OSError as e:
+                print(f"⚠️ 清单写入失败: {e}", file=sys.stderr)
+
+def default_cache_dir():
+    """Directory for on-disk caches (VIDTOOLS_CACHE_DIR overrides)"""
+    env = os.getenv('VIDTOOLS_CACHE_DIR')
+    if env:
+        return env
+    if sys.platform == 'win32' and os.getenv('LOCALAPPDATA'):
+        return os.path.join(os.getenv('LOCALAPPDATA'), 'vidtools', 'cache')
+    return os.path.join(os.path.expanduser('~'), '.cache', 'vidtools')
+
+class ProbeCache:
+    """On-disk cache of summarised ffprobe results keyed by path, size and mtime"""
+    
+    def __init__(self, cache_file=None):
+        self.cache_file = cache_file or os.path.join(default_cache_dir(), 'probe_cache.json')
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self._dirty = False
+        self._lock = threading.Lock()
+        self.load()
+    
+    def load(self):
+        """Load cache entries from disk; a missing or corrupt file starts empty"""
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.entries = data.get('entries', {}) if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            self.entries = {}
+    
+    def save(self):
+        """Write the cache atomically if anything changed"""
+        with self._lock:
+            if not self._dirty:
+                return
+            snapshot = {'version': 1, 'entries': dict(self.entries)}
+            self._dirty = False
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            tmp = f"{self.cache_file}.{os.getpid()}.tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(tmp, self.cache_file)
+        except OSError as e:
+            print(f"⚠️ 探测缓存保存失败: {e}", file=sys.stderr)
+    
+    def probe(self, input_path):
+        """Return the cached summary for a file, probing it on a miss"""
+        key = os.path.abspath(input_path)
+        try:
+            st = os.stat(key)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry and entry.get('size') == st.st_size and entry.get('mtime_ns') == st.st_mtime_ns:
+                self.hits += 1
+                return entry['media']
+            self.misses += 1
+        
+        try:
+            media = summarize_probe(ffmpeg.probe(key))
+        except Exception:
+            return None  # 探测失败不缓存，下次重试
+        
+        with self._lock:
+            self.entries[key] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'media': media}
+            self._dirty = True
+        return media
+    
+    def keyframe_interval(self, input_path):
+        """Average keyframe spacing of a file, probed on first request and cached with its summary
+        
+        Reading packets costs a second ffprobe, so only segment planning asks
+        for it; probe() alone never pays for it.
+        """
+        media = self.probe(input_path)
+        if not media or not media['video']:
+            return None
+        if 'keyframe_interval' not in media:
+            interval = probe_keyframe_interval(os.path.abspath(input_path))
+            with self._lock:
+                media['keyframe_interval'] = interval
+                self._dirty = True
+        return media['keyframe_interval']
+    
+    def content_hash(self, input_path, full=False):
+        """content_fingerprint() of a file, remembered alongside its probe entry"""
+        key = os.path.abspath(input_path)
+        kind = 'full' if full else 'sampled'
+        try:
+            st = os.stat(key)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self.entries.get(key)
+            valid = entry and entry.get('size') == st.st_size and entry.get('mtime_ns') == st.st_mtime_ns
+            if valid and kind in entry.get('hashes', {}):
+                return entry['hashes'][kind]
+        digest = content_fingerprint(key, full)
+        if digest and valid:
+            with self._lock:
+                entry.setdefault('hashes', {})[kind] = digest
+                self._dirty = True
+        return digest
+
+# 缩略图条：默认8个关键帧，每帧高90像素
+THUMB_COUNT = 8
+THUMB_HEIGHT = 90
+THUMB_NICE = 10
+
+def low_priority_command(args, nice):
+    """Prefix a command with nice and ionice (idle I/O class) where those tools exist
+    
+    Wrapping the command instead of calling os.nice() in preexec_fn keeps
+    Popen thread-safe, and every ffmpeg thread inherits the priority.
+    """
+    if not nice or sys.platform == 'win32':
+        return args
+    prefix = []
+    if shutil.which('nice'):
+        prefix += ['nice', '-n', str(nice)]
+    if shutil.which('ionice'):
+        prefix += ['ionice', '-c', '3']
+    return prefix + list(args)
+
+class ThumbnailStrip:
+    """Keyframe thumbnail strips for batch listings, cached on disk by file fingerprint
+    
+    Each strip is one JPEG of count keyframes from evenly spaced positions,
+    decoded with -skip_frame nokey (only keyframes reach the decoder) and
+    scaled to height pixels. Extraction runs on its own small thread pool
+    with ffmpeg at nice +THUMB_NICE and one thread, so it never competes with
+    the main encodes.
+    """
+    
+    def __init__(self, converter, cache_dir=None, count=THUMB_COUNT, height=THUMB_HEIGHT, workers=1, nice=THUMB_NICE):
+        from concurrent.futures import ThreadPoolExecutor
+        self.converter = converter
+        self.cache_dir = cache_dir or os.path.join(default_cache_dir(), 'thumbnails')
+        self.count = max(1, count)
+        self.height = _even(height)
+        self.nice = nice
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbnails')
+    
+    def cache_path(self, input_path):
+        """Strip location for a file's current (path, size, mtime); None if it does not exist"""
+        fingerprint = file_fingerprint(input_path)
+        if fingerprint is None:
+            return None
+        key = json.dumps([os.path.abspath(input_path), fingerprint, self.count, self.height])
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.jpg')
+    
+    def cached(self, input_path):
+        """Cached strip path, or None if it still has to be extracted"""
+        path = self.cache_path(input_path)
+        return path if path and os.path.exists(path) else None
+    
+    def submit(self, input_path):
+        """Queue extraction on the low-priority pool; returns a Future of the strip path (or None)"""
+        return self.pool.submit(self.extract, input_path)
+    
+    def extract(self, input_path):
+        """Build (or reuse) the strip for one file; returns its path, or None on failure"""
+        path = self.cache_path(input_path)
+        if path is None or os.path.exists(path):
+            return path
+        media = self.converter.probe_media(input_path)
+        if not media or not media.get('video') or not media.get('duration'):
+            return None
+        
+        # 每个位置单独输入：输入端定位跳到该点之前的关键帧，只解码关键帧
+        frames = []
+        for k in range(self.count):
+            position = media['duration'] * (k + 0.5) / self.count
+            stream = ffmpeg.input(input_path, ss=f"{position:.3f}", skip_frame='nokey', noaccurate_seek=None,
+                                  threads=1)[str(media['video']['index'])]
+            # 定位后时间戳可能为负，先归零再截取第一帧，hstack 才能对齐各路
+            frames.append(stream.setpts('PTS-STARTPTS').trim(end_frame=1)
+                          .filter('scale', -2, self.height).filter('setsar', 1))
+        strip = ffmpeg.filter(frames, 'hstack', inputs=len(frames)) if len(frames) > 1 else frames[0]
+        
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}{PARTIAL_MARKER}.jpg"
+        args = strip.output(tmp, vframes=1, **{'q:v': 5}).global_args('-hide_banner', '-loglevel', 'error').compile()
+        try:
+            result = subprocess.run(low_priority_command(args, self.nice), stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.PIPE, **_own_process_group(self.nice))
+            if result.returncode != 0 or not os.path.exists(tmp):
+                return None
+            os.replace(tmp, path)
+        except OSError:
+            return None
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return path
+    
+    def shutdown(self, wait=True):
+        self.pool.shutdown(wait=wait)
+
+class FFmpegProgress:
+    """Accumulate ffmpeg -progress key/value blocks into progress snapshots"""
+    
+    def __init__(self, duration=None, total_frames=None):
+        self.duration = duration
+        self.total_frames = total_frames
+        self.started = time.monotonic()
+        self.values = {}
+        self.finished = False
+    
+    def feed(self, line):
+        """Feed one line; returns True when a complete block has been read"""
+        key, sep, value = line.strip().partition('=')
+        if not sep:
+            return False
+        self.values[key] = value.strip()
+        if key == 'progress':
+            self.finished = value.strip() == 'end'
+            return True
+        return False
+    
+    def snapshot(self):
+        """Return the latest progress as a plain dict"""
+        v = self.values
+        frame = _to_int(v.get('frame')) or 0
+        fps = _to_float(v.get('fps')) or 0.0
+        speed = _to_float(v.get('speed', '').rstrip('x')) or 0.0
+        # out_time_ms 实际单位是微秒，新版ffmpeg另外提供 out_time_us
+        out_us = _to_int(v.get('out_time_us')) or _to_int(v.get('out_time_ms')) or 0
+        out_time = max(0.0, out_us / 1_000_000)
+        elapsed = time.monotonic() - self.started
+        
+        if self.finished:
+            fraction = 1.0
+        elif self.total_frames:
+            fraction = min(1.0, frame / self.total_frames)
+        elif self.duration:
+            fraction = min(1.0, out_time / self.duration)
+        else:
+            fraction = None
+        
+        eta = None
+        if self.finished:
+            eta = 0.0
+        elif self.duration and speed > 0:
+            eta = max(0.0, (self.duration - out_time) / speed)
+        elif fraction:
+            eta = elapsed * (1 - fraction) / fraction
+        
+        return {
+            'frame': frame,
+            'total_frames': self.total_frames,
+            'fps': fps,
+            'speed': speed,
+            'out_time': out_time,
+            'duration': self.duration,
+            'fraction': fraction,
+            'elapsed': elapsed,
+            'eta': eta,
+            'bitrate': v.get('bitrate'),
+            'total_size': _to_int(v.get('total_size')),
+            'finished': self.finished,
+            # 每个输出流的量化参数，如 stream_0_0_q / stream_1_0_q
+            'stream_q': {k: val for k, val in v.items() if k.startswith('stream_') and k.endswith('_q')},
+        }
+
+def format_duration(seconds):
+    """Format seconds as H:MM:SS"""
+    seconds = int(seconds)
+    return f"{seconds // 3600:d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+def format_progress(info):
+    """Format a progress dict as a short status line"""
+    parts = []
+    if info.get('total_frames'):
+        parts.append(f"{info['frame']}/{info['total_frames']} frames")
+    else:
+        parts.append(f"{info['frame']} frames")
+    parts.append(f"{info['fps']:.1f} fps")
+    if info.get('speed'):
+        parts.append(f"{info['speed']:.2f}x")
+    if info.get('eta') is not None:
+        parts.append(f"ETA {format_duration(info['eta'])}")
+    return " · ".join(parts)
+
+def estimate_job_cost(media, plan):
+    """Relative cost of a job: encoded pixels for re-encodes, a small share for copies"""
+    if not media or not media.get('duration'):
+        return 0.0
+    video = media.get('video') or {}
+    pixels = (video.get('width') or 1920) * (video.get('height') or 1080)
+    if plan.get('scale'):
+        pixels = max(pixels, plan['scale'][0] * plan['scale'][1])
+    if plan.get('video') == 'encode':
+        return media['duration'] * pixels
+    # 纯封装/音频转码只受IO限制，按极小比例计入
+    return media['duration'] * pixels * 0.01
+
+def source_matches_output(input_path, output_path, plan):
+    """Whether converting would only copy every stream into the same container"""
+    same_container = os.path.splitext(input_path)[1].lower() == os.path.splitext(output_path)[1].lower()
+    return same_container and plan.get('video') in ('copy', None) and plan.get('audio') in ('copy', None)
+
+# 分段并行编码：每段不短于该时长，否则进程启动与切分开销得不偿失
+MIN_SEGMENT_SECONDS = 60
+
+def default_segment_count(duration, cores=None):
+    """Number of parallel segments for a file of this duration on `cores` cores (default: all)"""
+    if not duration:
+        return 1
+    by_cores = max(1, (cores or os.cpu_count() or 1) // 4)
+    by_length = int(duration // MIN_SEGMENT_SECONDS)
+    return max(1, min(by_cores, by_length))
+
+def plan_segments(duration, segments, keyframe_interval=None):
+    """(count, segment_time) for splitting a file into at most `segments` chunks
+    
+    The segment muxer can only cut on keyframes, so with a known keyframe
+    interval the length is rounded up to a whole number of GOPs and the
+    count is capped at the number of GOPs; otherwise sparse keyframes would
+    leave some chunks empty and others twice as long.
+    """
+    if not duration or segments < 2:
+        return 1, duration
+    if keyframe_interval and keyframe_interval > 0:
+        gops = max(1, int(duration // keyframe_interval))
+        segments = min(segments, gops)
+        per_chunk = -(-gops // segments)  # 向上取整
+        segment_time = per_chunk * keyframe_interval
+        return max(1, min(segments, -(-gops // per_chunk))), segment_time
+    return segments, duration / segments
+
+class SegmentProgress:
+    """Fold per-segment progress snapshots into one progress dict for the whole file"""
+    
+    def __init__(self, duration, total_frames, count, callback=None):
+        self.duration = duration
+        self.total_frames = total_frames
+        self.callback = callback
+        self.started = time.monotonic()
+        self.latest = [None] * count
+        self._lock = threading.Lock()
+    
+    def update(self, index, info):
+        """Record one segment's snapshot and report the combined progress"""
+        with self._lock:
+            self.latest[index] = info
+            combined = self._combine()
+        if self.callback:
+            self.callback(combined)
+    
+    def finish(self):
+        """Combined progress with the whole file marked as done"""
+        with self._lock:
+            combined = self._combine()
+        combined.update(fraction=1.0, eta=0.0, finished=True)
+        return combined
+    
+    def _combine(self):
+        infos = [info for info in self.latest if info]
+        out_time = sum(info['out_time'] for info in infos)
+        speed = sum(info['speed'] for info in infos if not info['finished'])
+        fraction = min(1.0, out_time / self.duration) if self.duration else None
+        eta = max(0.0, (self.duration - out_time) / speed) if self.duration and speed > 0 else None
+        return {
+            'frame': sum(info['frame'] for info in infos),
+            'total_frames': self.total_frames,
+            'fps': sum(info['fps'] for info in infos if not info['finished']),
+            'speed': speed,
+            'out_time': out_time,
+            'duration': self.duration,
+            'fraction': fraction,
+            'elapsed': time.monotonic() - self.started,
+            'eta': eta,
+            'bitrate': None,
+            'total_size': sum(info['total_size'] or 0 for info in infos),
+            'finished': False,
+            'segments': len(self.latest),
+        }
+
+def default_batch_workers():
+    """Default number of concurrent ffmpeg processes for batch mode"""
+    # libx264 本身是多线程的，并发数过高反而互相抢占CPU
+    return max(1, min(4, (os.cpu_count() or 2) // 2))
+
+# libx264 单个进程能有效利用的线程数（经验值）：随分辨率增长（行级/帧级并行空间更大），
+# 更慢的预设每帧计算量更大、线程开销占比更低，因此能吃下更多线程
+X264_USEFUL_THREADS = ((480, 4), (720, 6), (1080, 8), (1440, 12), (2160, 16))
+X264_PRESET_THREAD_FACTOR = {
+    'ultrafast': 0.5, 'superfast': 0.6, 'veryfast': 0.75, 'faster': 0.85, 'fast': 1.0,
+    'medium': 1.0, 'slow': 1.25, 'slower': 1.5, 'veryslow': 1.5,
+}
+
+def x264_thread_args(threads):
+    """Output args capping libx264 frame threads and lookahead threads"""
+    if not threads:
+        return {}
+    return {'threads': threads, 'x264-params': f"lookahead-threads={max(1, threads // 4)}"}
+
+def plan_concurrency(cores=None, height=None, preset='fast', workers=None, threads=None):
+    """Choose (concurrent jobs, threads per job) for a batch
+    
+    Each job gets about as many threads as libx264 can use efficiently at
+    this resolution and preset; the cores are then filled with jobs. Either
+    value can be overridden; the other is derived from it.
+    """
+    cores = max(1, cores or os.cpu_count() or 1)
+    if workers and threads:
+        return max(1, int(workers)), max(1, int(threads))
+    if workers:
+        workers = max(1, int(workers))
+        return workers, max(1, cores // workers)
+    if not threads:
+        useful = X264_USEFUL_THREADS[-1][1]
+        for max_height, count in X264_USEFUL_THREADS:
+            if (height or 1080) <= max_height:
+                useful = count
+                break
+        threads = round(useful * X264_PRESET_THREAD_FACTOR.get(preset, 1.0))
+    threads = max(1, min(cores, int(threads)))
+    return max(1, cores // threads), threads
+
+def parse_duration(value):
+    """Parse a duration such as '2h', '90m', '45s', '1h30m', '2d', '1:30:00' or plain seconds"""
+    text = str(value).strip().lower()
+    if ':' in text:
+        seconds = 0.0
+        for part in text.split(':'):
+            seconds = seconds * 60 + float(part)
+        return seconds
+    seconds, number = 0.0, ''
+    for char in text:
+        if char.isdigit() or char == '.':
+            number += char
+        elif char in 'dhms' and number:
+            seconds += float(number) * {'d': 86400, 'h': 3600, 'm': 60, 's': 1}[char]
+            number = ''
+        elif not char.isspace():
+            raise ValueError(f"invalid duration: {value}")
+    return seconds + float(number or 0)
+
+# 时间预算模式默认考察的预设（从快到慢）；更慢的 slower/veryslow 收益很小，采样代价却很高
+BUDGET_PRESETS = ('ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow')
+# 批量模式下参与采样的代表性文件数（按成本取最大的几个）
+BUDGET_SAMPLE_FILES = 3
+
+# 准入控制的默认阈值：每核1分钟负载、CPU steal 比例、可用内存
+ADMISSION_MAX_LOAD = 1.5
+ADMISSION_MAX_STEAL = 0.10
+ADMISSION_MIN_FREE_MB = 1024
+ADMISSION_NICE = 10
+ADMISSION_ACTIONS = ('delay', 'nice')
+
+class LoadMonitor:
+    """Samples host load for admission control
+    
+    On Linux reads /proc (load average, CPU steal, MemAvailable and sectors
+    written to whole disks); elsewhere only the load average is available
+    and the other fields are None. Steal and write throughput are rates
+    between consecutive samples, so the first sample reports them as None.
+    """
+    
+    def __init__(self):
+        self.cores = os.cpu_count() or 1
+        self._last_cpu = None
+        self._last_disk = None
+    
+    def sample(self):
+        """Return {'load', 'steal', 'free_mb', 'write_mbps'}; load is the 1-minute average per core"""
+        now = time.monotonic()
+        load = os.getloadavg()[0] / self.cores if hasattr(os, 'getloadavg') else None
+        return {
+            'load': round(load, 2) if load is not None else None,
+            'steal': self._steal(),
+            'free_mb': self._free_mb(),
+            'write_mbps': self._write_mbps(now),
+        }
+    
+    def _steal(self):
+        try:
+            with open('/proc/stat', 'r') as f:
+                fields = [int(v) for v in f.readline().split()[1:]]
+        except (OSError, ValueError):
+            return None
+        total, steal = sum(fields[:8]), fields[7] if len(fields) > 7 else 0
+        last, self._last_cpu = self._last_cpu, (total, steal)
+        if last is None or total <= last[0]:
+            return None
+        return round((steal - last[1]) / (total - last[0]), 3)
+    
+    def _free_mb(self):
+        try:
+            with open('/proc/meminfo', 'r') as f:
+                for line in f:
+                    if line.startswith('MemAvailable:'):
+                        return int(line.split()[1]) // 1024
+        except (OSError, ValueError):
+            pass
+        return None
+    
+    def _write_mbps(self, now):
+        try:
+            # 只统计整块磁盘；分区、loop、device-mapper、md 会重复计数
+            disks = {name for name in os.listdir('/sys/block')
+                     if not name.startswith(('loop', 'ram', 'zram', 'dm-', 'md'))}
+            sectors = 0
+            with open('/proc/diskstats', 'r') as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) > 9 and fields[2] in disks:
+                        sectors += int(fields[9])
+        except (OSError, ValueError):
+            return None
+        last, self._last_disk = self._last_disk, (now, sectors)
+        if last is None or now <= last[0]:
+            return None
+        return round((sectors - last[1]) * 512 / (now - last[0]) / (1024 * 1024), 1)
+
+class AdmissionControl:
+    """Hold back or de-prioritise new ffmpeg jobs while the host is busy
+    
+    BatchConverter calls admit() before each job starts. While a limit is
+    exceeded the job waits (action='delay') or starts at nice
+    +ADMISSION_NICE with idle I/O priority (action='nice'); work is admitted
+    normally again once load drops. With 'delay' one job is always admitted
+    when no other job of the batch is running, so a busy host slows a batch
+    down but never stalls it. on_change(status) is called whenever the
+    throttle state changes.
+    """
+    
+    def __init__(self, max_load=ADMISSION_MAX_LOAD, max_steal=ADMISSION_MAX_STEAL, min_free_mb=ADMISSION_MIN_FREE_MB,
+                 max_write_mbps=None, action='delay', interval=2.0, monitor=None, on_change=None):
+        self.max_load = max_load
+        self.max_steal = max_steal
+        self.min_free_mb = min_free_mb
+        self.max_write_mbps = max_write_mbps
+        self.action = action
+        self.interval = interval
+        self.monitor = monitor or LoadMonitor()
+        self.on_change = on_change
+        self.waiting = 0
+        self._status = {'state': 'ok', 'reasons': [], 'sample': {}}
+        self._sampled_at = None
+        self._lock = threading.Lock()
+    
+    def reasons(self, sample):
+        """Human-readable list of the limits a sample exceeds"""
+        reasons = []
+        if self.max_load and sample['load'] is not None and sample['load'] > self.max_load:
+            reasons.append(f"load {sample['load']:.2f}/core > {self.max_load}")
+        if self.max_steal and sample['steal'] is not None and sample['steal'] > self.max_steal:
+            reasons.append(f"steal {sample['steal'] * 100:.0f}% > {self.max_steal * 100:.0f}%")
+        if self.min_free_mb and sample['free_mb'] is not None and sample['free_mb'] < self.min_free_mb:
+            reasons.append(f"free memory {sample['free_mb']} MB < {self.min_free_mb} MB")
+        if self.max_write_mbps and sample['write_mbps'] is not None and sample['write_mbps'] > self.max_write_mbps:
+            reasons.append(f"disk writes {sample['write_mbps']:.0f} MB/s > {self.max_write_mbps} MB/s")
+        return reasons
+    
+    def check(self):
+        """Current throttle status, re-sampling at most once per interval"""
+        changed = None
+        with self._lock:
+            now = time.monotonic()
+            if self._sampled_at is None or now - self._sampled_at >= self.interval:
+                self._sampled_at = now
+                sample = self.monitor.sample()
+                reasons = self.reasons(sample)
+                state = self.action if reasons else 'ok'
+                if state != self._status['state']:
+                    changed = True
+                self._status = {'state': state, 'reasons': reasons, 'sample': sample}
+            status = dict(self._status, waiting=self.waiting)
+        if changed and self.on_change:
+            self.on_change(status)
+        return status
+    
+    def admit(self, control, running):
+        """Block until a job may start; running() is the number of batch jobs already encoding
+        
+        Sets control.nice when the job has to start de-prioritised. Returns
+        False if the control was cancelled while waiting.
+        """
+        with self._lock:
+            self.waiting += 1
+        try:
+            while not control.cancelled:
+                status = self.check()
+                if status['state'] == 'ok':
+                    return True
+                if status['state'] == 'nice':
+                    control.nice = ADMISSION_NICE
+                    return True
+                if running() == 0:
+                    return True
+                time.sleep(self.interval)
+            return False
+        finally:
+            with self._lock:
+                self.waiting -= 1
+
+class BudgetPlanner:
+    """Pick the slowest x264 preset that still finishes a batch within a time budget
+    
+    Short samples of the inputs are encoded under each candidate preset, from
+    fastest to slowest, to measure real throughput and bits per pixel on this
+    machine. Sampling stops at the first preset that no longer fits, since
+    slower presets only get slower. per_file=True picks a preset per input,
+    giving each file a share of the budget proportional to its duration.
+    """
+    
+    def __init__(self, batch, budget, per_file=False, presets=None, points=3, seconds=4.0, log=None):
+        self.batch = batch
+        self.converter = batch.converter
+        self.budget = budget
+        self.per_file = per_file
+        order = self.converter.encoding_presets
+        self.presets = sorted(presets or BUDGET_PRESETS, key=order.index)
+        self.points = points
+        self.seconds = seconds
+        self.log = log or (lambda message: None)
+    
+    def measure(self, job, preset):
+        """Sample one job under one preset (with the batch's per-job thread count)"""
+        return self.converter.sample_encode(
+            job['input'], job.get('media'), job['plan'], job.get('quality'), preset,
+            self.batch.threads, self.points, self.seconds, job.get('scaler'), self.batch.control
+        )
+    
+    def plan(self, jobs):
+        """Set job['preset'] on the re-encode jobs in place and return a report dict
+        
+        The report has the chosen 'preset' (or per-file 'presets'), the
+        predicted encode 'wall' time, whether it 'fits', the per-preset
+        'samples' and the time spent sampling.
+        """
+        started = time.monotonic()
+        encodes = [job for job in jobs
+                   if (job.get('plan') or {}).get('video') == 'encode' and (job.get('media') or {}).get('duration')
+                   and not job.get('renditions')]
+        report = {'budget': self.budget, 'per_file': self.per_file, 'samples': {}, 'fits': True}
+        if not encodes:
+            report['sampling'] = 0.0
+            return report
+        if self.per_file:
+            self._plan_per_file(encodes, report, started)
+        else:
+            self._plan_batch(encodes, report, started)
+        report['sampling'] = round(time.monotonic() - started, 2)
+        # 预设变化会影响每个任务能有效利用的线程数
+        self.batch.schedule(jobs)
+        return report
+    
+    def _remaining(self, started):
+        return max(0.0, self.budget - (time.monotonic() - started))
+    
+    def _plan_batch(self, encodes, report, started):
+        total = sum(job['media']['duration'] for job in encodes)
+        sampled = sorted(encodes, key=lambda job: job.get('cost') or 0, reverse=True)[:BUDGET_SAMPLE_FILES]
+        sampled_duration = sum(job['media']['duration'] for job in sampled)
+        chosen, chosen_wall = self.presets[0], None
+        for preset in self.presets:
+            results = [self.measure(job, preset) for job in sampled]
+            if any(result is None for result in results):
+                break
+            # 采样文件的加权平均速度外推到整批，并行任务数摊薄总耗时
+            speed = sampled_duration / sum(job['media']['duration'] / r['speed'] for job, r in zip(sampled, results))
+            wall = total / speed / self.batch.max_workers
+            bpp = sum(r['bpp'] for r in results) / len(results)
+            report['samples'][preset] = {'speed': round(speed, 3), 'bpp': round(bpp, 4), 'wall': round(wall, 1)}
+            self.log(f"⏱️ {preset}: {speed:.2f}x realtime, {bpp:.3f} bpp, ~{wall / 60:.1f} min")
+            if chosen_wall is not None and wall > self._remaining(started):
+                break
+            chosen, chosen_wall = preset, wall
+            if wall > self._remaining(started):
+                break  # 最快的预设也超出预算，不必再试更慢的
+        for job in encodes:
+            job['preset'] = chosen
+        report['preset'] = chosen
+        report['wall'] = round(chosen_wall or 0.0, 1)
+        report['fits'] = chosen_wall is not None and chosen_wall <= self._remaining(started)
+    
+    def _plan_per_file(self, encodes, report, started):
+        left = sum(job['media']['duration'] for job in encodes)
+        report['presets'], report['wall'] = {}, 0.0
+        for job in encodes:
+            # 每个文件按时长分得剩余预算（扣除已用的采样时间和已选文件的预计耗时）；
+            # 任务并行执行，所以份额乘以并发数
+            capacity = max(0.0, self._remaining(started) - report['wall']) * self.batch.max_workers
+            share = capacity * job['media']['duration'] / left
+            left -= job['media']['duration']
+            chosen, chosen_wall = self.presets[0], None
+            samples = report['samples'][job['input']] = {}
+            for preset in self.presets:
+                result = self.measure(job, preset)
+                if result is None:
+                    break
+                wall = job['media']['duration'] / result['speed']
+                samples[preset] = {'speed': round(result['speed'], 3), 'bpp': round(result['bpp'], 4),
+                                   'wall': round(wall, 1)}
+                if chosen_wall is not None and wall > share:
+                    break
+                chosen, chosen_wall = preset, wall
+                if wall > share:
+                    break
+            job['preset'] = chosen
+            report['presets'][job['input']] = chosen
+            report['wall'] += (chosen_wall or 0.0) / self.batch.max_workers
+            self.log(f"⏱️ {os.path.basename(job['input'])}: {chosen}")
+        report['wall'] = round(report['wall'], 1)
+        report['fits'] = report['wall'] <= self._remaining(started)
+
+def scan_videos(roots, extensions, recursive=True, include=None, exclude=None, min_size=None, max_size=None,
+                newer_than=None, older_than=None, skip_dirs=None, on_error=None):
+    """Yield video file paths under roots lazily, built on os.scandir
+    
+    Directories are walked depth-first with an explicit stack, one directory
+    listing in memory at a time, so the first path is yielded immediately even
+    on huge trees. include/exclude are glob lists matched against the file
+    name and the path relative to its root ('*/raw/*' also prunes whole
+    folders). Size filters are in bytes and mtime filters are epoch seconds;
+    stat() is only called when one of them is set. Files whose names carry
+    PARTIAL_MARKER are never yielded. on_error(path, exc) is told about
+    unreadable directories, which are skipped.
+    """
+    extensions = {'.' + ext.lower().lstrip('.') for ext in extensions}
+    skip_dirs = {os.path.abspath(path) for path in skip_dirs or ()}
+    needs_stat = any(value is not None for value in (min_size, max_size, newer_than, older_than))
+    
+    def matches(patterns, name, rel):
+        return any(fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(rel, pattern) for pattern in patterns)
+    
+    for root in [roots] if isinstance(roots, str) else roots:
+        if os.path.isfile(root):
+            yield root
+            continue
+        stack = [root]
+        while stack:
+            folder = stack.pop()
+            try:
+                with os.scandir(folder) as entries:
+                    subdirs = []
+                    for entry in entries:
+                        rel = os.path.relpath(entry.path, root).replace(os.sep, '/')
+                        try:
+                            if entry.is_dir():
+                                if (recursive and os.path.abspath(entry.path) not in skip_dirs
+                                        and not (exclude and matches(exclude, entry.name, rel + '/'))):
+                                    subdirs.append(entry.path)
+                                continue
+                            if not entry.is_file():
+                                continue
+                        except OSError:
+                            continue
+                        # 扩展名判断用集合查找，比逐个格式比较快
+                        if os.path.splitext(entry.name)[1].lower() not in extensions or PARTIAL_MARKER in entry.name:
+                            continue
+                        if include and not matches(include, entry.name, rel):
+                            continue
+                        if exclude and matches(exclude, entry.name, rel):
+                            continue
+                        if needs_stat:
+                            try:
+                                st = entry.stat()
+                            except OSError:
+                                continue
+                            if ((min_size is not None and st.st_size < min_size)
+                                    or (max_size is not None and st.st_size > max_size)
+                                    or (newer_than is not None and st.st_mtime < newer_than)
+                                    or (older_than is not None and st.st_mtime > older_than)):
+                                continue
+                        yield entry.path
+            except OSError as e:
+                if on_error:
+                    on_error(folder, e)
+                continue
+            # 逆序入栈，保证按目录项原顺序深度优先
+            stack.extend(reversed(subdirs))
+
+def new_estimate():
+    """Empty batch work estimate, filled in by BatchConverter.plan_job"""
+    return {'files': 0, 'skipped': 0, 'unknown': 0, 'duplicates': 0,
+            'total_duration': 0.0, 'encode_duration': 0.0, 'copy_duration': 0.0, 'duplicate_duration': 0.0}
+
+class BatchConverter:
+    """Run VideoConverter jobs from a bounded worker pool"""
+    
+    def __init__(self, converter, max_workers=None, manifest=None, threads=None, dedup=None, admission=None):
+        self.converter = converter
+        # AdmissionControl：主机繁忙时暂缓或降低新任务的优先级
+        self.admission = admission
+        self.manifest = manifest
+        # dedup: None/False 关闭，'sampled' 抽样哈希，'full' 全文件哈希
+        self.dedup = DedupIndex(dedup == 'full', converter.probe_cache) if dedup else None
+        # None 表示由 schedule() 按核数、分辨率和预设自动决定
+        self.requested_workers = max_workers
+        self.requested_threads = threads
+        self.max_workers = max(1, int(max_workers or default_batch_workers()))
+        self.threads = threads
+        self.stats = {}
+        # 整个批次的暂停/取消；每个运行中的任务另有一个子 JobControl
+        self.control = JobControl()
+        self._controls = {}
+        self._controls_lock = threading.Lock()
+        self._started = None
+        self._done = 0
+        self._submitted = 0
+        self._running = 0
+    
+    def build_jobs(self, input_paths, output_format, resolution=None, quality=None, preset='fast', output_dir=None,
+                   remux='auto', fit='pad', scaler=None):
+        """Create one job dict per input file"""
+        return [
+            {
+                'input': path,
+                'output': self.converter.output_path_for(path, output_format, output_dir),
+                'resolution': resolution,
+                'quality': quality,
+                'preset': preset,
+                'remux': remux,
+                'fit': fit,
+                'scaler': scaler,
+            }
+            for path in input_paths
+        ]
+    
+    def plan_batch(self, jobs, order='longest'):
+        """Probe every job, drop ones whose source already matches the output, and order the rest
+        
+        Returns (jobs_to_run, skipped_jobs, estimate). order='longest' runs the
+        most expensive jobs first so the pool finishes evenly; order=None keeps
+        the given order. Each job gains 'media', 'plan' and 'cost' keys;
+        skipped jobs also get a 'skip_reason' ('done' when the manifest shows a
+        valid earlier result, 'matches' when the source already fits).
+        """
+        planned, skipped = [], []
+        estimate = new_estimate()
+        for job in jobs:
+            reason = self.plan_job(job, estimate)
+            if reason == 'duplicate':
+                continue  # 由首个相同内容的任务转换后链接输出
+            if reason:
+                skipped.append(job)
+            else:
+                planned.append(job)
+        
+        if order == 'longest':
+            planned.sort(key=lambda job: job['cost'], reverse=True)
+        
+        cache = self.converter.probe_cache
+        if cache is not None:
+            cache.save()
+        self.schedule(planned)
+        estimate['workers'], estimate['threads'] = self.max_workers, self.threads
+        return planned, skipped, estimate
+    
+    def plan_job(self, job, estimate=None):
+        """Probe and plan one job in place; returns its skip reason ('done', 'matches', 'duplicate') or None
+        
+        estimate, if given, is a new_estimate() dict updated with this job.
+        'duplicate' jobs (dedup enabled) are completed together with the job
+        holding the same content; if that one already finished, (leader, ok,
+        err) is left in job['dedup_ready'].
+        """
+        estimate = estimate if estimate is not None else new_estimate()
+        estimate['files'] += 1
+        if self.manifest is not None and self.manifest.is_current(job):
+            job['skip_reason'] = 'done'
+            estimate['skipped'] += 1
+            return job['skip_reason']
+        media = self.converter.probe_media(job['input'])
+        plan = self.converter.plan_conversion(
+            media, job['output'], job.get('resolution'), job.get('quality'), job.get('remux', 'auto'),
+            job.get('fit', 'pad')
+        )
+        job['media'], job['plan'] = media, plan
+        job['cost'] = estimate_job_cost(media, plan)
+        
+        if media and not job.get('renditions') and source_matches_output(job['input'], job['output'], plan):
+            job['skip_reason'] = 'matches'
+            estimate['skipped'] += 1
+            return job['skip_reason']
+        
+        duration = (media or {}).get('duration')
+        if self.dedup is not None:
+            leader, result = self.dedup.claim(job)
+            if leader is not None:
+                if result is not None:
+                    job['dedup_ready'] = (leader,) + tuple(result)
+                estimate['duplicates'] += 1
+                estimate['duplicate_duration'] += duration or 0.0
+                return 'duplicate'
+        
+        if not duration:
+            estimate['unknown'] += 1
+        else:
+            estimate['total_duration'] += duration
+            if plan['video'] == 'encode':
+                estimate['encode_duration'] += duration
+            else:
+                estimate['copy_duration'] += duration
+        return None
+    
+    def predict(self, jobs, max_samples=3, windows=PREVIEW_WINDOWS, seconds=PREVIEW_SECONDS):
+        """Predict total output size and wall time of planned jobs (see plan_batch)
+        
+        The max_samples most expensive jobs are sample-encoded with
+        predict_conversion; every other job is extrapolated from their bytes
+        and encode time per unit of job cost (duration x pixels). Returns
+        {'files', 'sampled', 'size', 'encode_time', 'wall', 'jobs': [...]}
+        with wall spread over the worker pool, or None if nothing could be
+        sampled.
+        """
+        ranked = sorted(jobs, key=lambda job: job.get('cost') or 0, reverse=True)
+        sampled, rest = [], []
+        for job in ranked:
+            prediction = None
+            if len(sampled) < max_samples and (job.get('plan') or {}).get('video') == 'encode':
+                prediction = self.converter.predict_conversion(
+                    job['input'], job['output'], job.get('resolution'), job.get('quality'), job.get('preset', 'fast'),
+                    job.get('remux', 'auto'), job.get('fit', 'pad'), job.get('scaler'), self.threads, windows, seconds,
+                    job.get('media'), job.get('plan'), self.control
+                )
+            if prediction:
+                sampled.append((job, prediction))
+            else:
+                rest.append(job)
+        if not sampled:
+            return None
+        
+        cost = sum(job.get('cost') or 0 for job, _ in sampled) or 1.0
+        bytes_per_cost = sum(p['video_bytes'] for _, p in sampled) / cost
+        time_per_cost = sum(p['encode_time'] for _, p in sampled) / cost
+        predictions = list(sampled)
+        for job in rest:
+            media, plan = job.get('media') or {}, job.get('plan') or {}
+            duration = media.get('duration') or 0
+            if plan.get('video') == 'copy':
+                video_bytes = int(((media.get('video') or {}).get('bit_rate') or 0) / 8 * duration)
+            else:
+                video_bytes = int(bytes_per_cost * (job.get('cost') or 0))
+            audio_bytes = int(predict_audio_bitrate(media, plan) / 8 * duration) if media else 0
+            predictions.append((job, {
+                'video_bytes': video_bytes, 'audio_bytes': audio_bytes,
+                'encode_time': time_per_cost * (job.get('cost') or 0), 'sampled': False,
+                'size': int((video_bytes + audio_bytes) * CONTAINER_OVERHEAD),
+            }))
+        
+        encode_time = sum(p['encode_time'] for _, p in predictions)
+        return {
+            'files': len(predictions),
+            'sampled': len(sampled),
+            'size': sum(p['size'] for _, p in predictions),
+            'encode_time': encode_time,
+            'wall': encode_time / self.max_workers,
+            'jobs': [dict(p, input=job['input'], output=job['output']) for job, p in predictions],
+        }
+    
+    def schedule(self, jobs):
+        """Pick the pool size and per-job threads for these jobs
+        
+        The most expensive re-encode (resolution and preset) drives the choice,
+        since it dominates the batch's CPU time. Explicit max_workers/threads
+        passed to the constructor always win.
+        """
+        encodes = [job for job in jobs if (job.get('plan') or {}).get('video') == 'encode']
+        height, preset = None, 'fast'
+        if encodes:
+            heaviest = max(encodes, key=lambda job: job.get('cost') or 0)
+            scale = heaviest['plan'].get('scale')
+            video = (heaviest.get('media') or {}).get('video') or {}
+            height = scale[1] if scale else video.get('height')
+            preset = heaviest.get('preset', 'fast')
+        self.max_workers, self.threads = plan_concurrency(
+            None, height, preset, self.requested_workers, self.requested_threads
+        )
+        return self.max_workers, self.threads
+    
+    def schedule_for(self, resolutions, presets):
+        """Like schedule(), but from target resolutions and presets alone, before any file is probed
+        
+        Long-running pools (watch folders, shared queues) start their workers
+        before they see the files, so the tallest target resolution (None
+        means the source size, treated as 1080p) and the slowest preset stand
+        in for the heaviest job.
+        """
+        heights = [size[1] for size in resolutions if size]
+        preset = max(presets or ['fast'], key=lambda name: X264_PRESET_THREAD_FACTOR.get(name, 1.0))
+        self.max_workers, self.threads = plan_concurrency(
+            None, max(heights) if heights else None, preset, self.requested_workers, self.requested_threads
+        )
+        return self.max_workers, self.threads
+    
+    def throughput(self):
+        """Files per hour reached so far in the current (or last) run"""
+        if not self._started:
+            return 0.0
+        elapsed = time.monotonic() - self._started
+        return self._done / elapsed * 3600 if elapsed > 0 else 0.0
+    
+    def convert_job(self, job, progress_callback=None):
+        """Run one job, writing every output under a temporary name and renaming it on success
+        
+        Jobs with 'renditions' use convert_ladder; jobs with 'segments' (an
+        int, or 'auto') use convert_video_segmented; all others convert_video.
+        The job gets its own JobControl under the batch control (see
+        job_controls); it waits while the batch is paused and returns
+        (False, CANCELLED) without starting if the batch was cancelled.
+        """
+        control = JobControl(self.control)
+        with self._controls_lock:
+            self._controls[job['input']] = control
+        finals = job_outputs(job)
+        temps = [partial_path(path) for path in finals]
+        work = dict(job, output=temps[0])
+        if job.get('renditions'):
+            work['renditions'] = [(r[0], r[1], r[2], tmp) for r, tmp in zip(job['renditions'], temps)]
+        admitted = False
+        try:
+            if not control.wait_if_paused():
+                return False, CANCELLED
+            if self.admission is not None and not self.admission.admit(control, lambda: self._running):
+                return False, CANCELLED
+            with self._controls_lock:
+                self._running += 1
+                admitted = True
+            ok, err = self._dispatch(work, progress_callback, control)
+            if ok:
+                for tmp, final in zip(temps, finals):
+                    os.replace(tmp, final)
+            return ok, err
+        finally:
+            with self._controls_lock:
+                self._controls.pop(job['input'], None)
+                if admitted:
+                    self._running -= 1
+            for tmp in temps:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+    
+    def queue_status(self):
+        """Queue depth and throttle state: {'running', 'waiting', 'pending', 'state', 'reasons', 'sample'}
+        
+        running jobs are encoding, waiting ones are held by admission control
+        and pending ones are queued behind the worker pool.
+        """
+        throttle = self.admission.check() if self.admission is not None else {'state': 'ok', 'reasons': [], 'sample': {}}
+        waiting = self.admission.waiting if self.admission is not None else 0
+        running = self._running
+        return {
+            'running': running,
+            'waiting': waiting,
+            'pending': max(0, self._submitted - self._done - running - waiting),
+            'state': throttle['state'],
+            'reasons': throttle['reasons'],
+            'sample': throttle['sample'],
+        }
+    
+    def job_controls(self):
+        """JobControls of the jobs running right now, keyed by input path"""
+        with self._controls_lock:
+            return dict(self._controls)
+    
+    def _dispatch(self, job, progress_callback=None, control=None):
+        threads = job.get('threads') or self.threads
+        if job.get('renditions'):
+            return self.converter.convert_ladder(
+                job['input'], job['renditions'], job.get('quality'), job.get('preset', 'fast'),
+                progress_callback=progress_callback, remux=job.get('remux', 'auto'), threads=threads,
+                fit=job.get('fit', 'pad'), scaler=job.get('scaler'), control=control
+            )
+        if job.get('segments'):
+            return self.converter.convert_video_segmented(
+                job['input'], job['output'], job.get('resolution'), job.get('quality'), job.get('preset', 'fast'),
+                progress_callback=progress_callback, remux=job.get('remux', 'auto'),
+                segments=None if job['segments'] == 'auto' else int(job['segments']),
+                fit=job.get('fit', 'pad'), scaler=job.get('scaler'), control=control, threads=threads
+            )
+        return self.converter.convert_video(
+            job['input'], job['output'], job.get('resolution'), job.get('quality'), job.get('preset', 'fast'),
+            progress_callback=progress_callback, remux=job.get('remux', 'auto'), threads=threads,
+            fit=job.get('fit', 'pad'), scaler=job.get('scaler'), control=control
+        )
+    
+    def run(self, jobs, on_file_start=None, on_file_done=None, on_batch_progress=None, on_file_progress=None):
+        """Run all jobs and return a list of (job, ok, err) in completion order
+        
+        on_file_start(index, job) and on_file_progress(index, job, info) are
+        invoked from the worker threads; on_file_done(index, job, ok, err) and
+        on_batch_progress(done, total) are invoked from the calling thread as
+        jobs complete. Duplicates attached to a job (dedup) are reported with
+        their own indices, numbered on from len(jobs).
+        """
+        total = len(jobs)
+        next_duplicate = itertools.count(total)
+        results = []
+        done = 0
+        self._started, self._done, self._submitted = time.monotonic(), 0, total
+        if on_batch_progress:
+            on_batch_progress(0, total)
+        
+        def worker(index, job):
+            if on_file_start:
+                on_file_start(index, job)
+            callback = (lambda info: on_file_progress(index, job, info)) if on_file_progress else None
+            ok, err = self.convert_job(job, callback)
+            return index, job, ok, err
+        
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [pool.submit(worker, i, job) for i, job in enumerate(jobs)]
+            for future in as_completed(futures):
+                try:
+                    index, job, ok, err = future.result()
+                except Exception as e:
+                    # convert_video 已捕获ffmpeg错误，这里只兜底回调异常
+                    index = futures.index(future)
+                    job, ok, err = jobs[index], False, f"Batch worker error: {str(e)}"
+                done += 1
+                self._done = done
+                items = [(index, job, ok, err)]
+                items += [(next(next_duplicate),) + item for item in self._finish_duplicates(job, ok, err)]
+                for item_index, item_job, item_ok, item_err in items:
+                    results.append((item_job, item_ok, item_err))
+                    if self.manifest is not None:
+                        self.manifest.record(item_job, item_ok, item_err)
+                    if on_file_done:
+                        on_file_done(item_index, item_job, item_ok, item_err)
+                if on_batch_progress:
+                    on_batch_progress(done, total)
+        
+        self._record_stats(results)
+        return results
+    
+    def run_stream(self, jobs, on_file_start=None, on_file_done=None, on_batch_progress=None, on_file_progress=None,
+                   on_skip=None):
+        """Plan and run jobs from an iterable as they arrive, e.g. straight from scan_videos
+        
+        Nothing waits for the whole input: each job is probed when it is
+        pulled and submitted at once, and at most two jobs per worker are held
+        ahead of the pool, so the first encode starts while a large tree is
+        still being scanned and memory stays flat. Jobs run in arrival order
+        (no longest-first sorting). Callbacks are as for run(), except that
+        on_batch_progress(done, queued) reports the jobs queued so far, a
+        duplicate takes the next index in arrival order when its result is
+        known, and on_skip(job) is called for each skipped job. Returns
+        (results, skipped, estimate).
+        """
+        results, skipped = [], []
+        estimate = new_estimate()
+        completed = queue.Queue()
+        pending = iter(jobs)
+        counts = {'queued': 0, 'done': 0}
+        self._started, self._done, self._submitted = time.monotonic(), 0, 0
+        cache = self.converter.probe_cache
+        
+        def next_job():
+            for job in pending:
+                if self.control.cancelled:
+                    return None  # 批次已取消：不再扫描/入队
+                if estimate['files'] % 500 == 499 and cache is not None:
+                    cache.save()  # 大目录扫描中途也落盘，崩溃后不必全部重新探测
+                reason = self.plan_job(job, estimate)
+                if reason == 'duplicate':
+                    if 'dedup_ready' in job:
+                        # 相同内容的任务已完成，直接链接其输出
+                        leader, ok, err = job.pop('dedup_ready')
+                        record_duplicate(job, *self.dedup.materialize(leader, job, ok, err))
+                    continue
+                if reason:
+                    skipped.append(job)
+                    if on_skip:
+                        on_skip(job)
+                    continue
+                return job
+            return None
+        
+        def worker(index, job):
+            try:
+                if on_file_start:
+                    on_file_start(index, job)
+                callback = (lambda info: on_file_progress(index, job, info)) if on_file_progress else None
+                ok, err = self.convert_job(job, callback)
+            except Exception as e:
+                ok, err = False, f"Batch worker error: {str(e)}"
+            completed.put((index, job, ok, err))
+        
+        def record(index, job, ok, err):
+            results.append((job, ok, err))
+            if self.manifest is not None:
+                self.manifest.record(job, ok, err)
+            if on_file_done:
+                on_file_done(index, job, ok, err)
+        
+        def record_duplicate(job, ok, err):
+            # 重复文件在到达顺序中占一个自己的序号，不复用首个任务的序号
+            index = counts['queued']
+            counts['queued'] += 1
+            counts['done'] += 1
+            self._submitted, self._done = counts['queued'], counts['done']
+            record(index, job, ok, err)
+        
+        def finish(item):
+            index, job, ok, err = item
+            slots.release()
+            counts['done'] += 1
+            self._done = counts['done']
+            record(index, job, ok, err)
+            for duplicate in self._finish_duplicates(job, ok, err):
+                record_duplicate(*duplicate)
+            if on_batch_progress:
+                on_batch_progress(counts['done'], counts['queued'])
+        
+        job = next_job()
+        if job is not None:
+            self.schedule([job])  # 只能按第一个任务估计线程分配
+        slots = threading.BoundedSemaphore(self.max_workers * 2)
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while job is not None:
+                while not slots.acquire(blocking=False):
+                    finish(completed.get())
+                pool.submit(worker, counts['queued'], job)
+                counts['queued'] += 1
+                self._submitted = counts['queued']
+                if on_batch_progress:
+                    on_batch_progress(counts['done'], counts['queued'])
+                while True:
+                    try:
+                        finish(completed.get_nowait())
+                    except queue.Empty:
+                        break
+                job = next_job()
+            while counts['done'] < counts['queued']:
+                finish(completed.get())
+        
+        if cache is not None:
+            cache.save()
+        self._record_stats(results)
+        return results, skipped, estimate
+    
+    def _finish_duplicates(self, job, ok, err):
+        if self.dedup is None or 'duplicates' not in job:
+            return []
+        return self.dedup.finish(job, ok, err)
+    
+    def _record_stats(self, results):
+        total = len(results)
+        elapsed = time.monotonic() - self._started
+        media_seconds = sum((job.get('media') or {}).get('duration') or 0 for job, ok, _ in results if ok)
+        self.stats = {
+            'files': total,
+            'succeeded': sum(1 for _, ok, _ in results if ok),
+            'elapsed': round(elapsed, 3),
+            'files_per_hour': round(total / elapsed * 3600, 1) if elapsed > 0 else 0.0,
+            'media_hours_per_hour': round(media_seconds / elapsed, 2) if elapsed > 0 else 0.0,
+            'workers': self.max_workers,
+            'threads': self.threads,
+        }
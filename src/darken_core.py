@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cinematic Darken Core - darkening engines used by the Cinematic Darken Tool
+Importable without PyQt5; moviepy is only loaded when the fallback engine runs
+"""
+
+import os
+import time
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+from converter_core import (
+    VideoConverter, JobControl, JobCancelled, CANCELLED, partial_path, remove_partial, default_batch_workers,
+    x264_thread_args, ffmpeg
+)
+
+DARKEN_ENGINES = ('auto', 'ffmpeg', 'moviepy')
+# moviepy write_videofile 的默认编码参数，两个引擎输出保持一致
+DARKEN_PRESET = 'medium'
+DARKEN_PIX_FMT = 'yuv420p'
+DARKEN_EXTENSIONS = ('mp4', 'avi', 'mov', 'mkv')
+DARKEN_SUFFIX = '_darkened'
+
+# 各输出容器可直接封装的音频编码（ffprobe codec_name）；None 表示任意编码
+AUDIO_COPY_CODECS = {
+    'mp4': ('aac', 'mp3', 'ac3', 'eac3', 'alac', 'opus'),
+    'm4v': ('aac', 'mp3', 'ac3', 'eac3', 'alac'),
+    'mov': ('aac', 'mp3', 'ac3', 'eac3', 'alac', 'pcm_s16le', 'pcm_s16be', 'pcm_s24le', 'pcm_s24be'),
+    'mkv': None,
+    'avi': ('mp3', 'ac3', 'aac', 'pcm_s16le', 'pcm_u8'),
+}
+
+def audio_codec_for(audio, output_path):
+    """'copy' when the output container can hold the source audio codec as is, else 'aac'"""
+    container = os.path.splitext(output_path)[1].lower().lstrip('.')
+    if container not in AUDIO_COPY_CODECS:
+        return 'aac'
+    codecs = AUDIO_COPY_CODECS[container]
+    return 'copy' if audio and (codecs is None or audio['codec'] in codecs) else 'aac'
+
+# 全范围（JPEG）YUV 的 color_range 标记
+FULL_RANGE = ('pc', 'jpeg')
+
+def darken_filter(brightness, pix_fmt=None, color_range=None):
+    """ffmpeg (filter, options) that scales R, G and B by brightness, clipped at white like moviepy's colorx
+
+    lut filters clip every result to the format's legal range, so no
+    explicit clamp is needed. For brightness <= 1 nothing can overflow and,
+    YCbCr being a linear transform of RGB, scaling luma and chroma around
+    black and the chroma midpoint gives the same picture without converting
+    each frame to RGB and back. lutyuv assumes limited range, so full-range
+    sources (yuvj* formats or color_range 'pc') go through lutrgb, as do
+    brighter grades; lutrgb clips per channel exactly as colorx does.
+    """
+    factor = f"{brightness:g}"
+    full_range = bool(pix_fmt and pix_fmt.startswith('yuvj')) or color_range in FULL_RANGE
+    if brightness <= 1 and pix_fmt and pix_fmt.startswith('yuv') and not full_range:
+        # lutyuv 的 minval/maxval 是限制范围（8位下 Y 16-235，UV 16-240），对任意位深都成立
+        center = '(minval+maxval)/2'
+        chroma = f"(val-{center})*{factor}+{center}"
+        return 'lutyuv', {'y': f"(val-minval)*{factor}+minval", 'u': chroma, 'v': chroma}
+    return 'lutrgb', {'r': f"val*{factor}", 'g': f"val*{factor}", 'b': f"val*{factor}"}
+
+def darken_ffmpeg(input_path, output_path, brightness, converter=None, progress_callback=None, control=None,
+                  threads=None):
+    """Darken a video in one ffmpeg process (decode, lut filter, x264 encode)
+
+    Darkening never touches the soundtrack, so the audio stream is copied
+    bit for bit unless the output container cannot hold its codec (see
+    audio_codec_for); unprobed inputs get AAC. progress_callback receives
+    FFmpegProgress snapshots; control is a JobControl that can pause or
+    cancel ffmpeg. threads caps decoder and x264 threads (None lets ffmpeg
+    use every core). Returns (ok, error).
+    """
+    converter = converter or VideoConverter()
+    try:
+        media = converter.probe_media(input_path)
+        video_info = media['video'] if media else None
+        stream = ffmpeg.input(input_path, **({'threads': threads} if threads else {}))
+        name, options = darken_filter(brightness, video_info and video_info.get('pix_fmt'),
+                                      video_info and video_info.get('color_range'))
+        video = stream[str(video_info['index'])] if video_info else stream['v:0']
+        streams = [video.filter(name, **options)]
+        output_args = {'c:v': 'libx264', 'preset': DARKEN_PRESET, 'pix_fmt': DARKEN_PIX_FMT}
+        output_args.update(x264_thread_args(threads))
+        if not media or media['audio']:
+            streams.append(stream[str(media['audio']['index'])] if media else stream['a:0?'])
+            output_args['c:a'] = audio_codec_for(media['audio'] if media else None, output_path)
+
+        converter.run_ffmpeg(ffmpeg.output(*streams, output_path, **output_args),
+                             media['duration'] if media else None, media['total_frames'] if media else None,
+                             progress_callback, control)
+        return True, ""
+
+    except JobCancelled:
+        remove_partial(output_path)
+        return False, CANCELLED
+    except ffmpeg.Error as e:
+        return False, f"FFmpeg error: {e.stderr.decode(errors='replace') if e.stderr else str(e)}"
+    except Exception as e:
+        return False, f"Darken error: {str(e)}"
+
+def darken_lut(brightness=1.0, gamma=1.0, contrast=1.0):
+    """Build a (3, 256) uint8 lookup table, one row per RGB channel
+
+    Each parameter is a number or an (r, g, b) triple. The curve is gamma
+    (x ** (1 / gamma)), then contrast around mid grey, then the brightness
+    gain; values are clipped to 0-255 and truncated like moviepy's colorx,
+    so brightness alone gives exactly colorx's frames.
+    """
+    level = np.arange(256, dtype=np.float64)
+    params = [np.reshape(np.asarray(value, dtype=np.float64), (-1, 1)) for value in (brightness, gamma, contrast)]
+    brightness, gamma, contrast = (np.broadcast_to(value, (3, 1)) for value in params)
+    # gamma 为 1 时跳过幂运算，避免 x/255*255 的舍入误差让结果与 colorx 差一级
+    curve = np.where(gamma == 1, level, 255 * (level / 255) ** (1 / gamma))
+    curve = ((curve - 127.5) * contrast + 127.5) * brightness
+    return np.clip(curve, 0, 255).astype(np.uint8)
+
+class FrameLUT:
+    """Apply a darken_lut table to uint8 RGB frames without float temporaries
+
+    The result is written with np.take into one output buffer that is
+    reused for every frame of the same shape, so a caller must consume
+    (or copy) each frame before asking for the next, as moviepy's writer
+    does.
+    """
+
+    def __init__(self, brightness=1.0, gamma=1.0, contrast=1.0):
+        self.table = darken_lut(brightness, gamma, contrast)
+        # 三个通道曲线相同时整帧一次查表
+        self.shared = bool((self.table == self.table[0]).all())
+        self._out = None
+
+    def __call__(self, frame):
+        if self._out is None or self._out.shape != frame.shape:
+            self._out = np.empty(frame.shape, dtype=np.uint8)
+        out = self._out
+        # uint8 索引不会越界，mode='clip' 让 np.take 直接写入 out 而不经过中间缓冲
+        if self.shared:
+            np.take(self.table[0], frame, out=out, mode='clip')
+            return out
+        for channel in range(3):
+            np.take(self.table[channel], frame[..., channel], out=out[..., channel], mode='clip')
+        if frame.shape[-1] > 3:
+            out[..., 3:] = frame[..., 3:]  # alpha 通道原样保留
+        return out
+
+class FrameProgress:
+    """Frame function wrapper that counts frames for progress and stops a cancelled job
+
+    moviepy pulls every output frame through it, so the count drives a
+    progress dict with the same keys as FFmpegProgress.snapshot. Cancelling
+    the control raises JobCancelled out of write_videofile.
+    """
+
+    def __init__(self, func, duration, fps, progress_callback=None, control=None, interval=0.5):
+        self.func = func
+        self.duration = duration or 0.0
+        self.fps = fps or 0.0
+        self.total_frames = int(self.duration * self.fps) or None
+        self.progress_callback = progress_callback
+        self.control = control
+        self.interval = interval
+        self.frame = 0
+        self.started = time.monotonic()
+        self._last = 0.0
+
+    def __call__(self, frame):
+        if self.control is not None and not self.control.wait_if_paused():
+            raise JobCancelled()
+        self.frame += 1
+        now = time.monotonic()
+        if self.progress_callback and now - self._last >= self.interval:
+            self._last = now
+            self.progress_callback(self.snapshot())
+        return self.func(frame)
+
+    def snapshot(self, finished=False):
+        elapsed = time.monotonic() - self.started
+        fps = self.frame / elapsed if elapsed > 0 else 0.0
+        out_time = self.frame / self.fps if self.fps else 0.0
+        if finished:
+            fraction = 1.0
+        else:
+            fraction = min(1.0, self.frame / self.total_frames) if self.total_frames else None
+        eta = 0.0 if finished else (elapsed * (1 - fraction) / fraction if fraction else None)
+        return {
+            'frame': self.frame, 'total_frames': self.total_frames, 'fps': fps,
+            'speed': out_time / elapsed if elapsed > 0 else 0.0, 'out_time': out_time,
+            'duration': self.duration or None, 'fraction': fraction, 'elapsed': elapsed, 'eta': eta,
+            'bitrate': None, 'total_size': None, 'finished': finished, 'stream_q': None,
+        }
+
+def mux_source_audio(video_path, input_path, output_path, media=None, ffmpeg_binary='ffmpeg'):
+    """Stream-copy a video-only file and the source's audio into output_path; returns (ok, error)
+
+    The audio is copied bit for bit when the output container can hold its
+    codec (see audio_codec_for) and encoded to AAC otherwise. A source
+    probed as silent just has its video renamed into place.
+    """
+    if media and not media['audio']:
+        os.replace(video_path, output_path)
+        return True, ""
+    audio = media['audio'] if media else None
+    cmd = [
+        ffmpeg_binary, '-hide_banner', '-nostdin', '-v', 'error', '-y', '-i', video_path, '-i', input_path,
+        '-map', '0:v:0', '-map', f"1:{audio['index']}" if audio else '1:a:0?',
+        '-c:v', 'copy', '-c:a', audio_codec_for(audio, output_path), output_path
+    ]
+    try:
+        result = subprocess.run(cmd, stdin=subprocess.DEVNULL, capture_output=True)
+    except OSError as e:
+        return False, f"Audio mux error: {e}"
+    if result.returncode != 0:
+        remove_partial(output_path)
+        return False, f"FFmpeg error: {result.stderr.decode(errors='replace')}"
+    return True, ""
+
+def darken_moviepy(input_path, output_path, brightness, gamma=1.0, contrast=1.0, progress_callback=None,
+                   control=None, threads=None, converter=None):
+    """Darken a video frame by frame with moviepy (slow fallback engine)
+
+    Frames go through a FrameLUT, so custom gamma and contrast curves cost
+    the same single lookup as plain brightness. moviepy writes the video
+    only; the source audio is then muxed in with mux_source_audio, so, as
+    with darken_ffmpeg, it is copied rather than re-encoded.
+    progress_callback, control and threads behave as in darken_ffmpeg; a
+    cancelled job leaves no output behind. Returns (ok, error).
+    """
+    try:
+        import moviepy.editor as mp
+        from moviepy.config import get_setting
+    except ImportError as e:
+        return False, f"moviepy is not available: {e}"
+
+    converter = converter or VideoConverter()
+    video_only = partial_path(output_path)
+    clip = darker_clip = None
+    try:
+        clip = mp.VideoFileClip(input_path, audio=False)
+        frames = FrameProgress(FrameLUT(brightness, gamma, contrast), clip.duration, clip.fps,
+                               progress_callback, control)
+        darker_clip = clip.fl_image(frames)
+        darker_clip.write_videofile(video_only, codec="libx264", audio=False, preset=DARKEN_PRESET,
+                                    threads=threads)
+        if control is not None and control.cancelled:
+            raise JobCancelled()
+        # 用 moviepy 自带的 ffmpeg 封装音频：走到回退引擎时系统 ffmpeg 往往不可用
+        ok, err = mux_source_audio(video_only, input_path, output_path, converter.probe_media(input_path),
+                                   get_setting("FFMPEG_BINARY"))
+        if ok and progress_callback:
+            progress_callback(frames.snapshot(finished=True))
+        return ok, err
+    except JobCancelled:
+        remove_partial(output_path)
+        return False, CANCELLED
+    except Exception as e:
+        return False, f"Darken error: {str(e)}"
+    finally:
+        remove_partial(video_only)
+        for item in (darker_clip, clip):
+            if item is not None:
+                item.close()
+
+def darken_video(input_path, output_path, brightness, engine='auto', converter=None, progress_callback=None,
+                 control=None, threads=None, log=None):
+    """Darken a video with the chosen engine; 'auto' tries ffmpeg first and falls back to moviepy
+
+    Returns (ok, error). A cancelled job is not retried with the fallback;
+    the fallback gets the same progress_callback, control and threads, and
+    log(message) is told why it was needed.
+    """
+    log = log or (lambda message: None)
+    if engine not in DARKEN_ENGINES:
+        return False, f"Unknown darken engine: {engine}"
+    if not os.path.isfile(input_path):
+        return False, f"File not found: {input_path}"
+    if engine != 'moviepy':
+        ok, err = darken_ffmpeg(input_path, output_path, brightness, converter, progress_callback, control, threads)
+        if ok or err == CANCELLED or engine == 'ffmpeg':
+            return ok, err
+        reason = err.strip().splitlines()[-1] if err.strip() else 'failed'
+        log(f"⚠️ ffmpeg darkening failed, falling back to moviepy: {reason}")
+    return darken_moviepy(input_path, output_path, brightness, progress_callback=progress_callback, control=control,
+                          threads=threads, converter=converter)
+
+def darken_output_path(input_path, output_dir=None):
+    """Default output path (<name>_darkened.mp4) for an input"""
+    folder, filename = os.path.split(input_path)
+    return os.path.join(output_dir or folder, f"{os.path.splitext(filename)[0]}{DARKEN_SUFFIX}.mp4")
+
+def build_darken_jobs(items, output_dir):
+    """Turn (input, brightness) pairs into job dicts writing to output_dir
+
+    Inputs from different folders with the same name get numbered outputs
+    (clip_darkened_2.mp4) instead of overwriting each other.
+    """
+    jobs, used = [], set()
+    for input_path, brightness in items:
+        output_path = darken_output_path(input_path, output_dir)
+        base, ext = os.path.splitext(output_path)
+        count = 1
+        while os.path.normcase(output_path) in used:
+            count += 1
+            output_path = f"{base}_{count}{ext}"
+        used.add(os.path.normcase(output_path))
+        jobs.append({'input': input_path, 'output': output_path, 'brightness': brightness})
+    return jobs
+
+class DarkenBatch:
+    """Darken many files with a pool of concurrent ffmpeg jobs"""
+
+    def __init__(self, max_workers=None, threads=None, engine='auto', converter=None, log=None):
+        self.max_workers = max(1, max_workers or default_batch_workers())
+        # 每个任务分到一部分核心，避免多个 x264 互相抢占
+        self.threads = threads or max(1, (os.cpu_count() or 1) // self.max_workers)
+        self.engine = engine
+        self.converter = converter or VideoConverter()
+        self.log = log
+        # 取消/暂停整个批次；每个任务用它的子控制
+        self.control = JobControl()
+
+    def run_job(self, job, progress_callback=None):
+        """Darken one job dict ({'input', 'output', 'brightness'}); returns (ok, error)"""
+        if not self.control.wait_if_paused():
+            return False, CANCELLED
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(job['output'])), exist_ok=True)
+        except OSError as e:
+            return False, f"Darken error: {str(e)}"
+        return darken_video(job['input'], job['output'], job['brightness'], self.engine, self.converter,
+                            progress_callback, JobControl(parent=self.control), self.threads, self.log)
+
+    def run(self, jobs, on_start=None, on_progress=None, on_finish=None):
+        """Darken every job, max_workers at a time; returns (succeeded, failed)
+
+        Callbacks take the job's index: on_start(i), on_progress(i, info)
+        and on_finish(i, ok, error). They are called from worker threads.
+        """
+        def work(index, job):
+            if self.control.cancelled:
+                return False, CANCELLED
+            if on_start:
+                on_start(index)
+            progress = (lambda info: on_progress(index, info)) if on_progress else None
+            return self.run_job(job, progress)
+
+        succeeded = failed = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {pool.submit(work, index, job): index for index, job in enumerate(jobs)}
+            for future in as_completed(futures):
+                try:
+                    ok, err = future.result()
+                except Exception as e:
+                    # 单个任务出错只标记该行失败，不中断整个批次
+                    ok, err = False, f"Darken error: {str(e)}"
+                if ok:
+                    succeeded += 1
+                else:
+                    failed += 1
+                if on_finish:
+                    on_finish(futures[future], ok, err)
+        return succeeded, failed
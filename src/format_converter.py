@@ -8,9 +8,14 @@ Supports multiple languages, configuration management, and modern UI
 import sys
 import os
 import json
-import ffmpeg
 from datetime import datetime
 
+from converter_core import (
+    VideoConverter, BatchConverter, BudgetPlanner, ProbeCache, ConversionManifest, JobControl, AdmissionControl,
+    format_progress,
+    format_duration, SCALE_FITS, SCALERS, PREVIEW_WINDOWS, PREVIEW_SECONDS, CANCELLED, scan_videos
+)
+
 # Import PyQt5 components
 try:
     from PyQt5.QtWidgets import *
@@ -23,6 +28,9 @@ except ImportError as e:
     input("按回车键退出...")
     sys.exit(1)
 
+# 批量模式在输入文件夹中保存的转换清单
+MANIFEST_NAME = '.convert_manifest.jsonl'
+
 class LanguageManager:
     """Language management system integrated with website"""
     
@@ -187,57 +195,6 @@ class ConfigManager:
             "description": "专业的视频格式转换工具，支持多种格式和参数调节"
         }
 
-class VideoConverter:
-    """Core video conversion functionality"""
-    
-    def __init__(self):
-        self.supported_formats = ['mp4', 'avi', 'mov', 'mkv', 'wmv', 'flv']
-        self.resolution_presets = [
-            ('720p', 1280, 720),
-            ('1080p', 1920, 1080),
-            ('4K', 3840, 2160),
-            ('Custom', 0, 0)
-        ]
-        self.quality_presets = [
-            ('High', 18),
-            ('Medium', 23),
-            ('Low', 28),
-            ('Custom', 23)
-        ]
-        self.encoding_presets = ['ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow', 'slower', 'veryslow']
-    
-    def convert_video(self, input_path, output_path, resolution=None, quality=None, preset='fast'):
-        """Convert video with specified parameters"""
-        try:
-            # Build ffmpeg command
-            stream = ffmpeg.input(input_path)
-            
-            # Apply resolution filter if specified
-            if resolution and resolution != (0, 0):
-                stream = stream.filter('scale', resolution[0], resolution[1])
-            
-            # Set output parameters
-            output_args = {
-                'vcodec': 'libx264',
-                'acodec': 'aac',
-                'preset': preset,
-                'overwrite_output': True
-            }
-            
-            # Apply quality setting
-            if quality:
-                output_args['crf'] = quality
-            
-            # Run conversion
-            stream.output(output_path, **output_args).run(overwrite_output=True)
-            
-            return True, ""
-            
-        except ffmpeg.Error as e:
-            return False, f"FFmpeg error: {e.stderr.decode() if e.stderr else str(e)}"
-        except Exception as e:
-            return False, f"Conversion error: {str(e)}"
-
 class FormatConverterUI(QMainWindow):
     """Main application window"""
     
@@ -245,8 +202,10 @@ class FormatConverterUI(QMainWindow):
         super().__init__()
         self.lang_manager = LanguageManager()
         self.config_manager = ConfigManager()
-        self.video_converter = VideoConverter()
+        self.probe_cache = ProbeCache()
+        self.video_converter = VideoConverter(self.probe_cache)
         self.conversion_thread = None
+        self.closing = False  # 关闭窗口时等后台线程取消完成后再关闭
         
         self.init_ui()
         self.load_config()
@@ -361,6 +320,13 @@ class FormatConverterUI(QMainWindow):
         self.batch_checkbox = QCheckBox(self.lang_manager.get_text("batch_convert", "批量转换"))
         self.batch_checkbox.stateChanged.connect(self.toggle_batch_mode)
         layout.addWidget(self.batch_checkbox)
+        self.recursive_checkbox = QCheckBox(self._t("include_subfolders", "包含子文件夹", "Include sub-folders"))
+        self.recursive_checkbox.setEnabled(False)
+        layout.addWidget(self.recursive_checkbox)
+        self.dedup_checkbox = QCheckBox(self._t("dedup_inputs", "相同内容的文件只转换一次", "Convert identical files only once"))
+        self.dedup_checkbox.setChecked(True)
+        self.dedup_checkbox.setEnabled(False)
+        layout.addWidget(self.dedup_checkbox)
         
         parent_layout.addWidget(self.file_group)
     
@@ -399,8 +365,99 @@ class FormatConverterUI(QMainWindow):
         self.preset_combo.setCurrentText('fast')
         layout.addWidget(self.preset_combo, 3, 1)
         
+        # Concurrent jobs (batch mode)
+        self.workers_label = QLabel(self._t("concurrent_jobs", "并发任务数", "Concurrent jobs"))
+        layout.addWidget(self.workers_label, 4, 0)
+        workers_layout = QHBoxLayout()
+        # 0 = 自动：按CPU核数、分辨率和预设决定并发数与每个任务的线程数
+        self.workers_spin = QSpinBox()
+        self.workers_spin.setRange(0, max(1, os.cpu_count() or 1))
+        self.workers_spin.setSpecialValueText(self._t("auto", "自动", "Auto"))
+        self.workers_spin.setValue(0)
+        workers_layout.addWidget(self.workers_spin)
+        self.threads_label = QLabel(self._t("threads_per_job", "每任务线程数", "Threads per job"))
+        workers_layout.addWidget(self.threads_label)
+        self.threads_spin = QSpinBox()
+        self.threads_spin.setRange(0, max(1, os.cpu_count() or 1))
+        self.threads_spin.setSpecialValueText(self._t("auto", "自动", "Auto"))
+        self.threads_spin.setValue(0)
+        workers_layout.addWidget(self.threads_spin)
+        layout.addLayout(workers_layout, 4, 1)
+        
+        # Stream copy fast path
+        self.remux_checkbox = QCheckBox(self._t("stream_copy", "源文件已符合目标时直接复制流（不重新编码）", "Stream-copy when the source already fits (no re-encode)"))
+        self.remux_checkbox.setChecked(True)
+        layout.addWidget(self.remux_checkbox, 5, 0, 1, 2)
+        
+        # Segment-parallel encoding (single file mode)
+        self.segment_checkbox = QCheckBox(self._t("segment_parallel", "长视频按关键帧分段并行编码", "Split long videos at keyframes and encode segments in parallel"))
+        layout.addWidget(self.segment_checkbox, 6, 0, 1, 2)
+        
+        # Rendition ladder (single decode, several resolutions)
+        self.ladder_checkbox = QCheckBox(self._t("ladder_mode", "一次解码输出多个分辨率", "Write several resolutions from one decode"))
+        layout.addWidget(self.ladder_checkbox, 7, 0)
+        ladder_layout = QHBoxLayout()
+        self.ladder_boxes = {}
+        for name, w, h in self.video_converter.resolution_presets:
+            if name == 'Custom':
+                continue
+            box = QCheckBox(name)
+            box.setChecked(name in ('720p', '1080p'))
+            box.setEnabled(False)
+            self.ladder_boxes[name] = box
+            ladder_layout.addWidget(box)
+        layout.addLayout(ladder_layout, 7, 1)
+        self.ladder_checkbox.stateChanged.connect(
+            lambda state: [box.setEnabled(state == Qt.Checked) for box in self.ladder_boxes.values()]
+        )
+        
+        # Time budget (batch mode): sample-encode and pick the slowest preset that fits
+        self.budget_checkbox = QCheckBox(self._t("time_budget", "按时间预算自动选择预设（分钟）", "Pick the preset to finish within (minutes)"))
+        layout.addWidget(self.budget_checkbox, 8, 0)
+        self.budget_spin = QSpinBox()
+        self.budget_spin.setRange(1, 24 * 60)
+        self.budget_spin.setValue(120)
+        self.budget_spin.setEnabled(False)
+        layout.addWidget(self.budget_spin, 8, 1)
+        self.budget_checkbox.stateChanged.connect(lambda state: self.budget_spin.setEnabled(state == Qt.Checked))
+        
+        # Aspect ratio handling and scaler algorithm
+        self.fit_label = QLabel(self._t("aspect_fit", "宽高比", "Aspect ratio"))
+        layout.addWidget(self.fit_label, 9, 0)
+        fit_layout = QHBoxLayout()
+        self.fit_combo = QComboBox()
+        self._fill_fit_combo()
+        fit_layout.addWidget(self.fit_combo)
+        self.scaler_label = QLabel(self._t("scaler", "缩放算法", "Scaler"))
+        fit_layout.addWidget(self.scaler_label)
+        self.scaler_combo = QComboBox()
+        self.scaler_combo.addItems(SCALERS)
+        self.scaler_combo.setCurrentText('bicubic')
+        fit_layout.addWidget(self.scaler_combo)
+        layout.addLayout(fit_layout, 9, 1)
+        
+        # Admission control (batch mode): hold new jobs back while the host is busy
+        self.throttle_checkbox = QCheckBox(self._t("throttle", "主机繁忙时暂缓新任务", "Hold new jobs while the host is busy"))
+        self.throttle_checkbox.setToolTip(self._t("throttle_tip", "监测负载、CPU steal、可用内存和磁盘写入，超过阈值时暂缓启动新的转换",
+                                                  "Watches load, CPU steal, free memory and disk writes and delays new conversions above the limits"))
+        self.throttle_checkbox.setEnabled(False)
+        layout.addWidget(self.throttle_checkbox, 10, 0, 1, 2)
+        
         parent_layout.addWidget(self.settings_group)
     
+    def _fill_fit_combo(self):
+        """(Re)fill the aspect-ratio combo in the current language, keeping the selection"""
+        current = self.fit_combo.currentIndex()
+        labels = {
+            'pad': self._t("fit_pad", "保持比例，补黑边", "Keep, pad with black bars"),
+            'crop': self._t("fit_crop", "保持比例，裁切填满", "Keep, crop to fill"),
+            'stretch': self._t("fit_stretch", "拉伸填满", "Stretch"),
+        }
+        self.fit_combo.clear()
+        for fit in SCALE_FITS:
+            self.fit_combo.addItem(labels[fit], fit)
+        self.fit_combo.setCurrentIndex(max(0, current))
+    
     def create_conversion_section(self, parent_layout):
         """Create conversion control section"""
         self.control_group = QGroupBox(self.lang_manager.get_text("conversion_control", "转换控制"))
@@ -428,6 +485,29 @@ class FormatConverterUI(QMainWindow):
         self.convert_btn.clicked.connect(self.start_conversion)
         layout.addWidget(self.convert_btn)
         
+        # Preview estimate: 先编码几个短片段，预估输出大小与耗时
+        self.preview_btn = QPushButton(self._t("preview_estimate", "预估大小/耗时", "Preview estimate"))
+        self.preview_btn.setToolTip(self._t("preview_tip", f"用当前设置编码 {PREVIEW_WINDOWS} 段 {PREVIEW_SECONDS:.0f} 秒的样本，预估整个文件/文件夹的输出大小和编码时间",
+                                            f"Encode {PREVIEW_WINDOWS} samples of {PREVIEW_SECONDS:.0f}s with the current settings to predict output size and encode time"))
+        self.preview_btn.clicked.connect(self.start_preview)
+        layout.addWidget(self.preview_btn)
+        
+        # Pause / cancel: 直接控制 ffmpeg 进程组
+        self.pause_btn = QPushButton(self._t("pause", "暂停", "Pause"))
+        self.pause_btn.setEnabled(False)
+        self.pause_btn.clicked.connect(self.toggle_pause)
+        layout.addWidget(self.pause_btn)
+        
+        self.cancel_btn = QPushButton(self._t("cancel", "取消", "Cancel"))
+        self.cancel_btn.setEnabled(False)
+        self.cancel_btn.clicked.connect(self.cancel_conversion)
+        layout.addWidget(self.cancel_btn)
+        
+        self.skip_btn = QPushButton(self._t("skip_current", "跳过当前文件", "Skip current file"))
+        self.skip_btn.setEnabled(False)
+        self.skip_btn.clicked.connect(self.skip_current)
+        layout.addWidget(self.skip_btn)
+        
         # Language switch
         lang_layout = QHBoxLayout()
         self.lang_label = QLabel(self.lang_manager.get_text("language_label", "语言:"))
@@ -455,6 +535,19 @@ class FormatConverterUI(QMainWindow):
         self.progress_bar.setVisible(False)
         layout.addWidget(self.progress_bar)
         
+        # Throttle state and queue depth (batch mode)
+        self.throttle_label = QLabel("")
+        self.throttle_label.setVisible(False)
+        layout.addWidget(self.throttle_label)
+        self.throttle_timer = QTimer(self)
+        self.throttle_timer.timeout.connect(self.update_throttle_status)
+        
+        # Prediction from the sample encode
+        self.prediction_label = QLabel("")
+        self.prediction_label.setStyleSheet("color: #2563eb;")
+        self.prediction_label.setVisible(False)
+        layout.addWidget(self.prediction_label)
+        
         # Status label
         self.status_label = QLabel(self.lang_manager.get_text("ready", "准备就绪"))
         layout.addWidget(self.status_label)
@@ -498,6 +591,9 @@ class FormatConverterUI(QMainWindow):
     def toggle_batch_mode(self, state):
         """Toggle between single file and batch mode"""
         self.file_path_edit.setPlaceholderText(self._ph_select_folder() if state == Qt.Checked else self._ph_select_file())
+        self.recursive_checkbox.setEnabled(state == Qt.Checked)
+        self.dedup_checkbox.setEnabled(state == Qt.Checked)
+        self.throttle_checkbox.setEnabled(state == Qt.Checked)
     
     def start_conversion(self):
         """Start video conversion"""
@@ -507,14 +603,7 @@ class FormatConverterUI(QMainWindow):
                                self._t("no_file_selected", "请先选择要转换的文件或文件夹", "Please select a file or folder to convert"))
             return
         
-        # Get conversion parameters
-        resolution_idx = self.resolution_combo.currentIndex()
-        quality_idx = self.quality_combo.currentIndex()
-        preset = self.preset_combo.currentText()
-        
-        # Parse parameters
-        resolution = self.video_converter.resolution_presets[resolution_idx][1:]
-        quality = self.video_converter.quality_presets[quality_idx][1]
+        resolution, quality, preset = self._selected_settings()
         
         # Start conversion
         if self.batch_checkbox.isChecked():
@@ -522,51 +611,282 @@ class FormatConverterUI(QMainWindow):
         else:
             self.start_single_conversion(file_path, resolution, quality, preset)
     
-    def start_single_conversion(self, input_path, resolution, quality, preset):
-        """Start single file conversion"""
-        # Generate output path
+    def _selected_settings(self):
+        """Return (resolution, quality, preset) from the settings controls"""
+        resolution = self.video_converter.resolution_presets[self.resolution_combo.currentIndex()][1:]
+        quality = self.video_converter.quality_presets[self.quality_combo.currentIndex()][1]
+        return resolution, quality, self.preset_combo.currentText()
+    
+    def _single_output_path(self, input_path):
         folder, filename = os.path.split(input_path)
         name, ext = os.path.splitext(filename)
+        return os.path.join(folder, f"{name}_converted.{self.format_combo.currentText().lower()}")
+    
+    def start_preview(self):
+        """Sample-encode the selected file or folder and predict output size and encode time"""
+        file_path = self.file_path_edit.text().strip()
+        if not file_path:
+            QMessageBox.warning(self, self.lang_manager.get_text("warning", "警告"), 
+                               self._t("no_file_selected", "请先选择要转换的文件或文件夹", "Please select a file or folder to convert"))
+            return
+        resolution, quality, preset = self._selected_settings()
+        remux = 'auto' if self.remux_checkbox.isChecked() else False
+        fit, scaler = self.fit_combo.currentData(), self.scaler_combo.currentText()
+        
+        if self.batch_checkbox.isChecked():
+            batch = BatchConverter(self.video_converter, self.workers_spin.value() or None, None,
+                                   self.threads_spin.value() or None,
+                                   dedup='sampled' if self.dedup_checkbox.isChecked() else None)
+            video_files = scan_videos(file_path, self.video_converter.supported_formats,
+                                      recursive=self.recursive_checkbox.isChecked(), exclude=['*_converted.*'])
+            jobs = (batch.build_jobs([path], self.format_combo.currentText().lower(), resolution, quality, preset,
+                                     remux=remux, fit=fit, scaler=scaler)[0]
+                    for path in video_files)
+            self.preview_thread = PreviewThread(batch=batch, jobs=jobs)
+        else:
+            self.preview_thread = PreviewThread(
+                converter=self.video_converter,
+                job=dict(input=file_path, output=self._single_output_path(file_path), resolution=resolution,
+                         quality=quality, preset=preset, remux=remux, fit=fit, scaler=scaler,
+                         threads=self.threads_spin.value() or None)
+            )
+        
+        self.preview_btn.setEnabled(False)
+        self.prediction_label.setVisible(True)
+        self.prediction_label.setText(self._t("sampling", "正在采样编码...", "Encoding samples..."))
+        self.preview_thread.result.connect(self.preview_finished)
+        self.preview_thread.start()
+    
+    def preview_finished(self, prediction):
+        """Show the predicted output size and encode time next to the progress area"""
+        self.probe_cache.save()
+        if self.closing:
+            return
+        self.preview_btn.setEnabled(True)
+        if not prediction:
+            self.prediction_label.setText(self._t("preview_failed", "无法预估：输入无法探测或采样失败",
+                                                  "No estimate: the input could not be probed or sampled"))
+            return
+        text = (f"🔮 {self._t('predicted', '预估', 'Predicted')}: "
+                f"~{prediction['size'] / (1024 * 1024):.1f} MB, "
+                f"~{format_duration(prediction.get('wall', prediction['encode_time']))}")
+        if prediction.get('speed'):
+            text += f" ({prediction['speed']:.2f}x)"
+        if prediction.get('files'):
+            text += (f" · {prediction['files']} {self._t('video_files', '个视频文件', 'video files')}, "
+                     f"{self._t('sampled_files', '已采样', 'sampled')} {prediction['sampled']}")
+        self.prediction_label.setText(text)
+        self.log_text.append(text)
+    
+    def start_single_conversion(self, input_path, resolution, quality, preset):
+        """Start single file conversion"""
+        filename = os.path.basename(input_path)
         output_format = self.format_combo.currentText().lower()
-        output_path = os.path.join(folder, f"{name}_converted.{output_format}")
+        output_path = self._single_output_path(input_path)
         
         # Update UI
-        self.convert_btn.setEnabled(False)
+        self._set_running(True)
         self.progress_bar.setVisible(True)
         self.progress_bar.setRange(0, 0)  # Indeterminate progress
         self.status_label.setText(self.lang_manager.get_text("converting", "正在转换..."))
         self.log_text.append(f"🔄 {self._t('start_converting', '开始转换', 'Start converting')}: {filename}")
         
+        renditions = None
+        if self.ladder_checkbox.isChecked():
+            names = [name for name, box in self.ladder_boxes.items() if box.isChecked()]
+            renditions = self.video_converter.ladder_renditions(input_path, output_format, names)
+            if not renditions:
+                QMessageBox.warning(self, self.lang_manager.get_text("warning", "警告"),
+                                    self._t("no_renditions", "请至少选择一个输出分辨率", "Please select at least one rendition"))
+                self._set_running(False)
+                self.progress_bar.setVisible(False)
+                return
+        
         # Run conversion in thread
         self.conversion_thread = ConversionThread(
-            self.video_converter, input_path, output_path, resolution, quality, preset
+            self.video_converter, input_path, output_path, resolution, quality, preset,
+            remux='auto' if self.remux_checkbox.isChecked() else False,
+            segmented=self.segment_checkbox.isChecked(),
+            renditions=renditions,
+            fit=self.fit_combo.currentData(),
+            scaler=self.scaler_combo.currentText(),
+            threads=self.threads_spin.value() or None
         )
         self.conversion_thread.result.connect(self.conversion_finished)  # ✅ 改连 result
+        self.conversion_thread.progress.connect(self.conversion_progress)
         self.conversion_thread.start()
     
+    def conversion_progress(self, info):
+        """Show live ffmpeg progress for a single conversion"""
+        if info.get('fraction') is not None:
+            self.progress_bar.setRange(0, 1000)
+            self.progress_bar.setValue(int(info['fraction'] * 1000))
+        self.status_label.setText(f"{self.lang_manager.get_text('converting', '正在转换...')} {format_progress(info)}")
+        if info.get('renditions'):
+            self.statusBar().showMessage("  ·  ".join(
+                f"{r['name']}: {r['size'] / (1024 * 1024):.1f} MB" + (f" (q={r['q']:.0f})" if r['q'] is not None else "")
+                for r in info['renditions']
+            ))
+    
     def start_batch_conversion(self, folder_path, resolution, quality, preset):
         """Start batch conversion"""
-        # Find video files in folder
-        video_files = []
-        for file in os.listdir(folder_path):
-            if any(file.lower().endswith(ext) for ext in self.video_converter.supported_formats):
-                video_files.append(os.path.join(folder_path, file))
+        output_format = self.format_combo.currentText().lower()
+        # 清单记录每个文件的转换结果，中断后重新运行只处理缺失/失败/过期的输出
+        manifest = ConversionManifest(os.path.join(folder_path, MANIFEST_NAME))
+        batch = BatchConverter(self.video_converter, self.workers_spin.value() or None, manifest,
+                               self.threads_spin.value() or None,
+                               dedup='sampled' if self.dedup_checkbox.isChecked() else None,
+                               admission=AdmissionControl() if self.throttle_checkbox.isChecked() else None)
+        
+        # 边扫描边入队：不先列出整个目录，首个文件探测完即开始编码
+        # 输出与输入同目录，排除之前生成的 *_converted 文件
+        video_files = scan_videos(folder_path, self.video_converter.supported_formats,
+                                  recursive=self.recursive_checkbox.isChecked(), exclude=['*_converted.*'],
+                                  on_error=lambda path, e: print(f"⚠️ Cannot read {path}: {e}"))
+        remux = 'auto' if self.remux_checkbox.isChecked() else False
+        fit, scaler = self.fit_combo.currentData(), self.scaler_combo.currentText()
+        jobs = (batch.build_jobs([path], output_format, resolution, quality, preset, remux=remux, fit=fit,
+                                 scaler=scaler)[0]
+                for path in video_files)
         
-        if not video_files:
+        # Update UI
+        self._set_running(True, batch=True)
+        self.progress_bar.setVisible(True)
+        self.progress_bar.setRange(0, 0)
+        self.progress_bar.setValue(0)
+        self.batch_done = 0
+        self.batch_partial = {}
+        self.status_label.setText(self.lang_manager.get_text("converting", "正在转换..."))
+        
+        self.batch_found = 0
+        budget = self.budget_spin.value() * 60 if self.budget_checkbox.isChecked() else None
+        self.conversion_thread = BatchConversionThread(batch, jobs, budget)
+        self.conversion_thread.log.connect(self.log_text.append)
+        self.conversion_thread.planned.connect(self.batch_planned)
+        self.conversion_thread.scanned.connect(self.batch_scanned)
+        self.conversion_thread.file_started.connect(self.batch_file_started)
+        self.conversion_thread.file_finished.connect(self.batch_file_finished)
+        self.conversion_thread.file_progress.connect(self.batch_file_progress)
+        self.conversion_thread.batch_progress.connect(self.batch_progress)
+        self.conversion_thread.result.connect(self.batch_finished)
+        self.conversion_thread.start()
+        if batch.admission is not None:
+            self.throttle_label.setVisible(True)
+            self.throttle_timer.start(1000)
+    
+    def batch_planned(self, total, skipped, estimate):
+        """Show the batch plan once every input has been probed"""
+        self.batch_found = estimate.get('files', total + skipped)
+        self.log_text.append(f"📁 {self._t('found_videos', '找到', 'Found')} {self.batch_found} {self._t('video_files', '个视频文件', 'video files')}")
+        self.progress_bar.setRange(0, max(1, total) * 100)
+        self._log_skipped(skipped, estimate)
+        minutes = estimate.get('encode_duration', 0) / 60
+        self.log_text.append(f"📊 {self._t('work_estimate', '需要重新编码的时长', 'Media to re-encode')}: {minutes:.1f} min")
+        self.log_text.append(f"⚙️ {self._t('schedule', '调度', 'Schedule')}: "
+                             f"{estimate.get('workers')} × {estimate.get('threads')} "
+                             f"({self._t('jobs_x_threads', '并发任务 × 线程', 'jobs × threads')})")
+    
+    def batch_scanned(self, ran, skipped, estimate):
+        """Summarise a streamed batch once the scan and every conversion have finished"""
+        self.batch_found = estimate.get('files', ran + skipped)
+        self.log_text.append(f"📁 {self._t('scanned_videos', '共扫描', 'Scanned')} {self.batch_found} {self._t('video_files', '个视频文件', 'video files')}")
+        self._log_skipped(skipped, estimate)
+    
+    def _log_skipped(self, skipped, estimate):
+        if skipped:
+            self.log_text.append(f"⏭️ {self._t('skipped_done', '跳过已完成或已符合目标的文件', 'Skipped files already converted or matching the output')}: {skipped}")
+        if estimate.get('duplicates'):
+            self.log_text.append(f"🔗 {self._t('duplicates_linked', '相同内容的文件（已链接输出）', 'Identical files (outputs linked)')}: {estimate['duplicates']}")
+    
+    def batch_file_started(self, input_path):
+        """Log a batch file that started converting"""
+        self.log_text.append(f"🔄 {self._t('start_converting', '开始转换', 'Start converting')}: {os.path.basename(input_path)}")
+    
+    def batch_file_finished(self, input_path, success, err):
+        """Log the result of one batch file"""
+        name = os.path.basename(input_path)
+        self.batch_partial.pop(input_path, None)
+        if success:
+            self.log_text.append(f"✅ {name}")
+        else:
+            self.log_text.append(f"❌ {name}: {err.strip().splitlines()[-1] if err.strip() else ''}")
+    
+    def batch_file_progress(self, input_path, info):
+        """Track per-file progress and fold it into the overall batch bar"""
+        if info.get('fraction') is not None:
+            self.batch_partial[input_path] = info['fraction']
+        self._update_batch_bar()
+        self.statusBar().showMessage(f"{os.path.basename(input_path)}: {format_progress(info)}")
+    
+    def batch_progress(self, done, total):
+        """Update overall batch progress"""
+        self.batch_done = done
+        # 流式模式下总数随扫描增长
+        self.progress_bar.setRange(0, max(1, total) * 100)
+        self.status_label.setText(f"{self.lang_manager.get_text('converting', '正在转换...')} {done}/{total}")
+        self._update_batch_bar()
+    
+    def _update_batch_bar(self):
+        partial = sum(self.batch_partial.values())
+        self.progress_bar.setValue(int((self.batch_done + partial) * 100))
+    
+    def update_throttle_status(self):
+        """Show the admission-control state and queue depth of the running batch"""
+        thread = self.conversion_thread
+        if not isinstance(thread, BatchConversionThread):
+            return
+        status = thread.batch.queue_status()
+        queue = self._t("queue_depth", f"运行 {status['running']}，暂缓 {status['waiting']}，排队 {status['pending']}",
+                        f"{status['running']} running, {status['waiting']} held, {status['pending']} queued")
+        if status['state'] == 'ok':
+            self.throttle_label.setStyleSheet("color: #16a34a;")
+            self.throttle_label.setText(f"🟢 {queue}")
+        else:
+            self.throttle_label.setStyleSheet("color: #d97706;")
+            self.throttle_label.setText(f"🚦 {self._t('throttled', '主机繁忙，暂缓新任务', 'Host busy, holding new jobs')}: "
+                                        f"{'; '.join(status['reasons'])} · {queue}")
+    
+    def batch_finished(self, succeeded, failed):
+        """Handle batch conversion completion"""
+        self.probe_cache.save()
+        if self.closing:
+            return
+        self._set_running(False)
+        self.throttle_timer.stop()
+        self.throttle_label.setVisible(False)
+        self.progress_bar.setVisible(False)
+        if not self.batch_found:
+            self.status_label.setText("")
             QMessageBox.warning(self, self.lang_manager.get_text("warning", "警告"), 
                                self._t("no_video_files", "所选文件夹中没有找到视频文件", "No video files found in the selected folder"))
             return
-        
-        self.log_text.append(f"📁 {self._t('found_videos', '找到', 'Found')} {len(video_files)} {self._t('video_files', '个视频文件', 'video files')}")
-        # For now, just convert the first file as example
-        self.start_single_conversion(video_files[0], resolution, quality, preset)
+        summary = self._t("batch_summary", f"批量转换完成：成功 {succeeded}，失败 {failed}",
+                          f"Batch complete: {succeeded} succeeded, {failed} failed")
+        if self.conversion_thread.control.cancelled:
+            summary = self._t("batch_cancelled", f"批量转换已取消：成功 {succeeded}，未完成 {failed}",
+                              f"Batch cancelled: {succeeded} succeeded, {failed} not finished")
+        stats = self.conversion_thread.batch.stats
+        if stats.get('files'):
+            summary += f" ({stats['files_per_hour']:.0f} {self._t('files_per_hour', '个文件/小时', 'files/hour')})"
+        self.status_label.setText(summary)
+        self.log_text.append(f"{'✅' if failed == 0 else '⚠️'} {summary}")
+        if failed:
+            QMessageBox.warning(self, self.lang_manager.get_text("warning", "警告"), summary)
+        else:
+            QMessageBox.information(self, self.lang_manager.get_text("success", "成功"), summary)
     
     def conversion_finished(self, success, err):
         """Handle conversion completion"""
-        self.convert_btn.setEnabled(True)
+        self.probe_cache.save()
+        if self.closing:
+            return
+        self._set_running(False)
         self.progress_bar.setVisible(False)
         
-        if success:
+        if err == CANCELLED:
+            self.status_label.setText(self._t("cancelled", "已取消", "Cancelled"))
+            self.log_text.append(f"⏹️ {self._t('cancelled', '已取消', 'Cancelled')}")
+        elif success:
             self.status_label.setText(self.lang_manager.get_text("convert_success", "转换完成"))
             self.log_text.append(f"✅ {self._t('convert_complete', '转换完成', 'Conversion complete')}")
             QMessageBox.information(self, self.lang_manager.get_text("success", "成功"),
@@ -577,6 +897,77 @@ class FormatConverterUI(QMainWindow):
             QMessageBox.critical(self, self.lang_manager.get_text("error", "错误"),
                                  err or self.lang_manager.get_text("convert_failed", "转换失败"))
     
+    def _set_running(self, running, batch=False):
+        """Enable the start or the pause/cancel controls"""
+        self.convert_btn.setEnabled(not running)
+        self.pause_btn.setEnabled(running)
+        self.cancel_btn.setEnabled(running)
+        self.skip_btn.setEnabled(running and batch)
+        self.pause_btn.setText(self._t("pause", "暂停", "Pause"))
+    
+    def _active_control(self):
+        thread = self.conversion_thread
+        return thread.control if thread is not None and thread.isRunning() else None
+    
+    def toggle_pause(self):
+        """Pause or resume the running conversion (SIGSTOP/SIGCONT on ffmpeg)"""
+        control = self._active_control()
+        if control is None:
+            return
+        if control.paused:
+            control.resume()
+            self.pause_btn.setText(self._t("pause", "暂停", "Pause"))
+            self.log_text.append(f"▶️ {self._t('resumed', '已继续', 'Resumed')}")
+        elif control.pause():
+            self.pause_btn.setText(self._t("resume", "继续", "Resume"))
+            self.status_label.setText(self._t("paused", "已暂停", "Paused"))
+            self.log_text.append(f"⏸️ {self._t('paused', '已暂停', 'Paused')}")
+        else:
+            QMessageBox.information(self, self.lang_manager.get_text("warning", "警告"),
+                                    self._t("pause_unsupported", "当前系统不支持暂停", "Pausing is not supported on this system"))
+    
+    def cancel_conversion(self):
+        """Stop the running conversion or batch and delete its partial outputs"""
+        control = self._active_control()
+        if control is None:
+            return
+        control.cancel()
+        self.pause_btn.setEnabled(False)
+        self.cancel_btn.setEnabled(False)
+        self.skip_btn.setEnabled(False)
+        self.status_label.setText(self._t("cancelling", "正在取消...", "Cancelling..."))
+    
+    def skip_current(self):
+        """Cancel the files being converted right now; the batch goes on with the next ones"""
+        thread = self.conversion_thread
+        if isinstance(thread, BatchConversionThread) and thread.isRunning():
+            for input_path, control in thread.batch.job_controls().items():
+                control.cancel()
+                self.log_text.append(f"⏭️ {self._t('skipping', '跳过', 'Skipping')}: {os.path.basename(input_path)}")
+    
+    def closeEvent(self, event):
+        """Cancel running work and close once it has stopped, so no ffmpeg process outlives the window
+        
+        Waiting for the threads here would freeze the window until ffmpeg
+        exits, so the close is ignored while they wind down and repeated from
+        their finished signal.
+        """
+        running = [thread for thread in (self.conversion_thread, getattr(self, 'preview_thread', None))
+                   if thread is not None and thread.isRunning()]
+        if not running:
+            self.probe_cache.save()
+            event.accept()
+            return
+        if not self.closing:
+            self.closing = True
+            for thread in running:
+                thread.finished.connect(self.close)
+                thread.control.cancel()
+            self._set_running(False)
+            self.convert_btn.setEnabled(False)
+            self.status_label.setText(self._t("cancelling", "正在取消...", "Cancelling..."))
+        event.ignore()
+    
     def switch_language(self, lang):
         """Switch application language"""
         if self.lang_manager.current_lang == lang:
@@ -600,10 +991,30 @@ class FormatConverterUI(QMainWindow):
             self.resolution_label.setText(self.lang_manager.get_text("resolution", "分辨率"))
             self.quality_label.setText(self.lang_manager.get_text("quality", "质量"))
             self.preset_label.setText(self.lang_manager.get_text("preset", "预设"))
+            self.workers_label.setText(self._t("concurrent_jobs", "并发任务数", "Concurrent jobs"))
+            self.workers_spin.setSpecialValueText(self._t("auto", "自动", "Auto"))
+            self.threads_label.setText(self._t("threads_per_job", "每任务线程数", "Threads per job"))
+            self.threads_spin.setSpecialValueText(self._t("auto", "自动", "Auto"))
+            self.remux_checkbox.setText(self._t("stream_copy", "源文件已符合目标时直接复制流（不重新编码）", "Stream-copy when the source already fits (no re-encode)"))
+            self.segment_checkbox.setText(self._t("segment_parallel", "长视频按关键帧分段并行编码", "Split long videos at keyframes and encode segments in parallel"))
+            self.ladder_checkbox.setText(self._t("ladder_mode", "一次解码输出多个分辨率", "Write several resolutions from one decode"))
+            self.budget_checkbox.setText(self._t("time_budget", "按时间预算自动选择预设（分钟）", "Pick the preset to finish within (minutes)"))
+            self.fit_label.setText(self._t("aspect_fit", "宽高比", "Aspect ratio"))
+            self.scaler_label.setText(self._t("scaler", "缩放算法", "Scaler"))
+            self._fill_fit_combo()
             self.convert_btn.setText(self.lang_manager.get_text("convert", "开始转换"))
+            self.preview_btn.setText(self._t("preview_estimate", "预估大小/耗时", "Preview estimate"))
+            control = self._active_control()
+            self.pause_btn.setText(self._t("resume", "继续", "Resume") if control and control.paused
+                                   else self._t("pause", "暂停", "Pause"))
+            self.cancel_btn.setText(self._t("cancel", "取消", "Cancel"))
+            self.skip_btn.setText(self._t("skip_current", "跳过当前文件", "Skip current file"))
             self.lang_label.setText(self.lang_manager.get_text("language_label", "语言:"))
             self.browse_btn.setText(self.lang_manager.get_text("browse", "浏览..."))
             self.batch_checkbox.setText(self.lang_manager.get_text("batch_convert", "批量转换"))
+            self.recursive_checkbox.setText(self._t("include_subfolders", "包含子文件夹", "Include sub-folders"))
+            self.dedup_checkbox.setText(self._t("dedup_inputs", "相同内容的文件只转换一次", "Convert identical files only once"))
+            self.throttle_checkbox.setText(self._t("throttle", "主机繁忙时暂缓新任务", "Hold new jobs while the host is busy"))
             self.status_label.setText(self.lang_manager.get_text("ready", "准备就绪"))
             
             # 语言切换按钮
@@ -634,8 +1045,10 @@ class FormatConverterUI(QMainWindow):
 class ConversionThread(QThread):
     """Thread for video conversion to prevent UI freezing"""
     result = pyqtSignal(bool, str)  # ✅ 自定义信号
+    progress = pyqtSignal(dict)  # frame / fps / speed / eta
     
-    def __init__(self, converter, input_path, output_path, resolution, quality, preset):
+    def __init__(self, converter, input_path, output_path, resolution, quality, preset, remux='auto', segmented=False,
+                 renditions=None, fit='pad', scaler=None, threads=None):
         super().__init__()
         self.converter = converter
         self.input_path = input_path
@@ -643,14 +1056,104 @@ class ConversionThread(QThread):
         self.resolution = resolution
         self.quality = quality
         self.preset = preset
+        self.remux = remux
+        self.segmented = segmented
+        self.renditions = renditions
+        self.fit = fit
+        self.scaler = scaler
+        self.threads = threads
+        self.control = JobControl()
     
     def run(self):
         """Run conversion in thread"""
-        ok, err = self.converter.convert_video(
-            self.input_path, self.output_path, self.resolution, self.quality, self.preset
+        if self.renditions:
+            ok, err = self.converter.convert_ladder(
+                self.input_path, self.renditions, self.quality, self.preset,
+                progress_callback=self.progress.emit, remux=self.remux, threads=self.threads, fit=self.fit,
+                scaler=self.scaler, control=self.control
+            )
+            self.result.emit(ok, err or "")
+            return
+        convert = self.converter.convert_video_segmented if self.segmented else self.converter.convert_video
+        ok, err = convert(
+            self.input_path, self.output_path, self.resolution, self.quality, self.preset,
+            progress_callback=self.progress.emit, remux=self.remux, threads=self.threads, fit=self.fit,
+            scaler=self.scaler, control=self.control
         )
         self.result.emit(ok, err or "")
 
+class BatchConversionThread(QThread):
+    """Thread that drives a BatchConverter so the UI stays responsive"""
+    planned = pyqtSignal(int, int, dict)  # to_run, skipped, estimate
+    scanned = pyqtSignal(int, int, dict)  # ran, skipped, estimate（流式模式在扫描结束后汇总）
+    file_started = pyqtSignal(str)
+    file_finished = pyqtSignal(str, bool, str)
+    file_progress = pyqtSignal(str, dict)
+    batch_progress = pyqtSignal(int, int)
+    result = pyqtSignal(int, int)  # succeeded, failed
+    log = pyqtSignal(str)
+    
+    def __init__(self, batch, jobs, budget=None):
+        super().__init__()
+        self.batch = batch
+        self.jobs = jobs
+        self.budget = budget
+        self.control = batch.control
+    
+    def run(self):
+        """Run the batch in thread"""
+        callbacks = dict(
+            on_file_start=lambda i, job: self.file_started.emit(job['input']),
+            on_file_done=lambda i, job, ok, err: self.file_finished.emit(job['input'], ok, err or ""),
+            on_batch_progress=self.batch_progress.emit,
+            on_file_progress=lambda i, job, info: self.file_progress.emit(job['input'], info),
+        )
+        if not self.budget:
+            # 边扫描边转换，扫描结束后再汇总跳过数与工作量
+            results, skipped, estimate = self.batch.run_stream(self.jobs, **callbacks)
+            self.scanned.emit(len(results), len(skipped), estimate)
+            succeeded = sum(1 for _, ok, _ in results if ok)
+            self.result.emit(succeeded, len(results) - succeeded)
+            return
+        
+        # 时间预算需要先看到全部文件；探测/排序放在线程里，避免界面卡死
+        self.jobs, skipped, estimate = self.batch.plan_batch(list(self.jobs))
+        # 采样编码也在线程里进行，预设选定后再开始正式转换
+        report = BudgetPlanner(self.batch, self.budget, log=self.log.emit).plan(self.jobs)
+        estimate['workers'], estimate['threads'] = self.batch.max_workers, self.batch.threads
+        if report.get('preset'):
+            verdict = "✅" if report['fits'] else "⚠️"
+            self.log.emit(f"{verdict} preset {report['preset']}: ~{report['wall'] / 60:.1f} min")
+        self.planned.emit(len(self.jobs), len(skipped), estimate)
+        results = self.batch.run(self.jobs, **callbacks)
+        succeeded = sum(1 for _, ok, _ in results if ok)
+        self.result.emit(succeeded, len(results) - succeeded)
+
+class PreviewThread(QThread):
+    """Thread that sample-encodes a file or batch to predict size and encode time"""
+    result = pyqtSignal(dict)  # prediction, empty if unavailable
+    
+    def __init__(self, converter=None, job=None, batch=None, jobs=None):
+        super().__init__()
+        self.converter = converter
+        self.job = job
+        self.batch = batch
+        self.jobs = jobs
+        self.control = batch.control if batch else JobControl()
+    
+    def run(self):
+        """Run the sample encodes in thread"""
+        if self.batch:
+            planned, skipped, estimate = self.batch.plan_batch(list(self.jobs))
+            prediction = self.batch.predict(planned) if planned else None
+        else:
+            job = self.job
+            prediction = self.converter.predict_conversion(
+                job['input'], job['output'], job['resolution'], job['quality'], job['preset'], job['remux'],
+                job['fit'], job['scaler'], job['threads'], control=self.control
+            )
+        self.result.emit(prediction or {})
+
 def main():
     """Main application entry point"""
     app = QApplication(sys.argv)
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared Queue - split one batch across several machines through a shared directory
+Jobs, leases and results are plain files on a share (NFS/SMB) that every host
+mounts; no central service is needed
+
+Usage:
+  python convert_cli.py /mnt/share/in -R -o /mnt/share/out --queue /mnt/share/queue   # enqueue and work
+  python shared_queue.py /mnt/share/queue -j 2                                        # join from another host
+  python shared_queue.py /mnt/share/queue --status
+
+Queue directory layout:
+  jobs/<id>.json     job dicts as built by BatchConverter.build_jobs
+  leases/<id>.lease  claimed jobs; created with O_EXCL, renewed by touching
+  done/<id>.json     results ({"ok", "error", "worker", ...})
+
+A worker that dies stops renewing its lease; once the lease is older than
+--lease-seconds (by the share's clock) any other worker breaks it and
+runs the job again.
+"""
+
+import sys
+import os
+import json
+import time
+import uuid
+import signal
+import socket
+import hashlib
+import argparse
+import threading
+from datetime import datetime
+
+from converter_core import VideoConverter, BatchConverter, ProbeCache, CANCELLED
+
+LEASE_SECONDS = 120
+POLL_SECONDS = 5.0
+# 空闲时轮询间隔逐次翻倍，最长为租约时长的三分之一
+IDLE_BACKOFF = 2.0
+
+def log(message):
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] {message}", file=sys.stderr, flush=True)
+
+def _write_json(path, data):
+    """Write a JSON file atomically (temp file in the same directory, then rename)"""
+    tmp = f"{path}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+def _read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+class SharedQueue:
+    """A job queue kept in a shared directory with lease files"""
+
+    def __init__(self, root, lease_seconds=LEASE_SECONDS, worker=None):
+        self.root = os.path.abspath(root)
+        self.lease_seconds = lease_seconds
+        # 每个进程一个唯一的租约持有者标识
+        self.worker = worker or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.jobs_dir = os.path.join(self.root, 'jobs')
+        self.leases_dir = os.path.join(self.root, 'leases')
+        self.done_dir = os.path.join(self.root, 'done')
+        for path in (self.jobs_dir, self.leases_dir, self.done_dir):
+            os.makedirs(path, exist_ok=True)
+        # 成功的结果不会再被重新入队，记住后空闲轮询不必每次都去共享盘上检查
+        self._succeeded = set()
+
+    def job_id(self, job):
+        return hashlib.sha1(f"{job['input']}|{job['output']}".encode('utf-8')).hexdigest()[:20]
+
+    def lease_path(self, job_id):
+        return os.path.join(self.leases_dir, f"{job_id}.lease")
+
+    def done_path(self, job_id):
+        return os.path.join(self.done_dir, f"{job_id}.json")
+
+    def now(self):
+        """Current time on the share's clock, so hosts with skewed clocks agree on lease expiry"""
+        clock = os.path.join(self.root, '.clock')
+        try:
+            os.utime(clock, None)
+        except FileNotFoundError:
+            open(clock, 'a').close()
+        return os.stat(clock).st_mtime
+
+    def enqueue(self, jobs):
+        """Add jobs (paths made absolute); finished jobs are kept, failed ones are queued again
+
+        Returns the number of jobs added.
+        """
+        added = 0
+        for job in jobs:
+            job = dict(job, input=os.path.abspath(job['input']), output=os.path.abspath(job['output']))
+            job_id = self.job_id(job)
+            result = _read_json(self.done_path(job_id))
+            if result is not None:
+                if result.get('ok'):
+                    continue
+                os.remove(self.done_path(job_id))
+            _write_json(os.path.join(self.jobs_dir, f"{job_id}.json"), job)
+            added += 1
+        return added
+
+    def claim(self):
+        """Lease the next unfinished job; returns (job_id, job) or None if none is free"""
+        now = None
+        for name in sorted(os.listdir(self.jobs_dir)):
+            if not name.endswith('.json'):
+                continue
+            job_id = name[:-len('.json')]
+            if job_id in self._succeeded or self._finished(job_id):
+                continue
+            if not self._create_lease(job_id):
+                # 共享盘时钟每轮只读一次
+                now = now if now is not None else self.now()
+                if not self._break_expired(job_id, now) or not self._create_lease(job_id):
+                    continue
+            job = _read_json(os.path.join(self.jobs_dir, name))
+            # 拿到租约后再确认一次：可能刚被别的节点完成
+            if job is None or os.path.exists(self.done_path(job_id)):
+                self.release(job_id)
+                continue
+            return job_id, job
+        return None
+
+    def _finished(self, job_id):
+        """True if a job has a result; successful ones are remembered"""
+        if not os.path.exists(self.done_path(job_id)):
+            return False
+        if (_read_json(self.done_path(job_id)) or {}).get('ok'):
+            self._succeeded.add(job_id)
+        return True
+
+    def any_leased(self):
+        """True if some job is leased; one directory listing, no file reads"""
+        return any(name.endswith('.lease') for name in os.listdir(self.leases_dir))
+
+    def _create_lease(self, job_id):
+        try:
+            fd = os.open(self.lease_path(job_id), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'worker': self.worker, 'claimed': datetime.now().isoformat(timespec='seconds')}, f)
+        return True
+
+    def _expired(self, path, now=None):
+        try:
+            return os.stat(path).st_mtime + self.lease_seconds < (now if now is not None else self.now())
+        except FileNotFoundError:
+            return True
+
+    def _break_expired(self, job_id, now=None):
+        """Remove a lease whose holder stopped renewing it; True if the job is free now"""
+        lease = self.lease_path(job_id)
+        if not self._expired(lease, now):
+            return False
+        # 先改名再删除：只有一个节点能改名成功；改名后再检查一次，
+        # 若拿到的是别人刚创建的新租约则放回原处
+        stale = f"{lease}.{self.worker.replace(':', '_')}.stale"
+        try:
+            os.rename(lease, stale)
+        except FileNotFoundError:
+            return True
+        if not self._expired(stale):
+            try:
+                os.link(stale, lease)
+            except OSError:
+                pass
+            os.remove(stale)
+            return False
+        holder = (_read_json(stale) or {}).get('worker')
+        os.remove(stale)
+        log(f"♻️ lease of {job_id} expired (held by {holder}), re-queued")
+        return True
+
+    def holds(self, job_id):
+        return (_read_json(self.lease_path(job_id)) or {}).get('worker') == self.worker
+
+    def renew(self, job_id):
+        """Touch our lease; False if it was lost (expired and taken over)"""
+        if not self.holds(job_id):
+            return False
+        try:
+            os.utime(self.lease_path(job_id), None)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def release(self, job_id):
+        """Give a job back to the queue without a result"""
+        if self.holds(job_id):
+            try:
+                os.remove(self.lease_path(job_id))
+            except FileNotFoundError:
+                pass
+
+    def complete(self, job_id, ok, err=None, elapsed=None):
+        """Record a job's result and drop its lease"""
+        _write_json(self.done_path(job_id), {
+            'ok': ok,
+            'error': err or None,
+            'worker': self.worker,
+            'elapsed': round(elapsed, 3) if elapsed is not None else None,
+            'finished': datetime.now().isoformat(timespec='seconds'),
+        })
+        self.release(job_id)
+
+    def unfinished(self):
+        """Job dicts that have no result yet (pending or leased)"""
+        jobs = []
+        for name in sorted(os.listdir(self.jobs_dir)):
+            if name.endswith('.json') and not os.path.exists(self.done_path(name[:-len('.json')])):
+                job = _read_json(os.path.join(self.jobs_dir, name))
+                if job is not None:
+                    jobs.append(job)
+        return jobs
+
+    def status(self):
+        """Counts of pending, leased, succeeded and failed jobs"""
+        counts = {'pending': 0, 'leased': 0, 'succeeded': 0, 'failed': 0}
+        for name in os.listdir(self.jobs_dir):
+            if not name.endswith('.json'):
+                continue
+            job_id = name[:-len('.json')]
+            result = _read_json(self.done_path(job_id))
+            if result is not None:
+                counts['succeeded' if result.get('ok') else 'failed'] += 1
+            elif os.path.exists(self.lease_path(job_id)):
+                counts['leased'] += 1
+            else:
+                counts['pending'] += 1
+        return counts
+
+class QueueWorker:
+    """Claim jobs from a SharedQueue and convert them until the queue is drained"""
+
+    def __init__(self, shared, batch, poll_seconds=POLL_SECONDS):
+        self.shared = shared
+        self.batch = batch
+        self.poll_seconds = poll_seconds
+        self.stop_event = threading.Event()
+        self.succeeded = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def run(self):
+        """Run batch.max_workers claim loops; returns (succeeded, failed) for this process"""
+        threads = [threading.Thread(target=self.work, daemon=True) for _ in range(self.batch.max_workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            # join 带超时，主线程才能及时响应 SIGINT/SIGTERM
+            while thread.is_alive():
+                thread.join(0.5)
+        return self.succeeded, self.failed
+
+    def work(self):
+        idle = self.poll_seconds
+        while not self.stop_event.is_set():
+            claimed = self.shared.claim()
+            if claimed is None:
+                # 其它节点还持有租约时继续等待：它们若崩溃，租约过期后由这里接手
+                if not self.shared.any_leased():
+                    return
+                self.stop_event.wait(idle)
+                idle = min(idle * IDLE_BACKOFF, max(self.poll_seconds, self.shared.lease_seconds / 3))
+                continue
+            idle = self.poll_seconds
+            self.run_job(*claimed)
+
+    def run_job(self, job_id, job):
+        log(f"🔄 {job['input']}")
+        done = threading.Event()
+        lost = threading.Event()
+        heartbeat = threading.Thread(target=self.renew, args=(job_id, job, done, lost), daemon=True)
+        heartbeat.start()
+        started = time.monotonic()
+        try:
+            os.makedirs(os.path.dirname(job['output']), exist_ok=True)
+            ok, err = self.batch.convert_job(job)
+        except BaseException:
+            # 进程内异常：立即归还任务，而不是等租约过期
+            done.set()
+            self.shared.release(job_id)
+            raise
+        done.set()
+        heartbeat.join()
+        if lost.is_set():
+            log(f"⏹️ {job['input']} stopped: its lease was taken over by another worker")
+            return
+        if err == CANCELLED:
+            self.shared.release(job_id)
+            log(f"⏹️ {job['input']} cancelled, returned to the queue")
+            return
+        elapsed = time.monotonic() - started
+        self.shared.complete(job_id, ok, err, elapsed)
+        with self._lock:
+            if ok:
+                self.succeeded += 1
+            else:
+                self.failed += 1
+        if ok:
+            log(f"✅ {job['output']} ({elapsed:.1f}s)")
+        else:
+            log(f"❌ {job['input']}: {err.strip().splitlines()[-1] if err.strip() else 'failed'}")
+
+    def renew(self, job_id, job, done, lost):
+        """Renew a lease every third of its lifetime until the job finishes
+
+        If the lease was lost (expired and claimed elsewhere), the job is
+        cancelled so two workers never write the same output.
+        """
+        while not done.wait(self.shared.lease_seconds / 3):
+            if not self.shared.renew(job_id):
+                lost.set()
+                log(f"⚠️ lost the lease of {job_id}; cancelling {job['input']}")
+                control = self.batch.job_controls().get(job['input'])
+                if control is not None:
+                    control.cancel()
+                return
+
+    def stop(self, *_):
+        """Stop claiming jobs and cancel the running ones, handing them back to the queue at once"""
+        self.stop_event.set()
+        self.batch.control.cancel()
+
+def run_queue(shared, batch, poll_seconds=POLL_SECONDS):
+    """Work on a queue with signal handling; returns the process exit code"""
+    # 认领前按队列中最重的任务确定本机并发数和每个任务的线程数
+    jobs = shared.unfinished()
+    batch.schedule_for([job.get('resolution') for job in jobs], [job.get('preset', 'fast') for job in jobs])
+    worker = QueueWorker(shared, batch, poll_seconds)
+    signal.signal(signal.SIGINT, worker.stop)
+    signal.signal(signal.SIGTERM, worker.stop)
+    log(f"📡 {shared.worker} working on {shared.root} with {batch.max_workers} job(s) x {batch.threads} thread(s)")
+    try:
+        succeeded, failed = worker.run()
+    finally:
+        cache = batch.converter.probe_cache
+        if cache is not None:
+            cache.save()
+    counts = shared.status()
+    log(f"Done here: {succeeded} succeeded, {failed} failed · queue: {counts['succeeded']} succeeded, "
+        f"{counts['failed']} failed, {counts['pending']} pending, {counts['leased']} leased")
+    return 1 if failed else 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='shared_queue', description="Work on a shared-directory conversion queue")
+    parser.add_argument('queue_dir', help="queue directory on the shared mount")
+    parser.add_argument('-j', '--jobs', type=int, help="concurrent conversions on this host (default: auto)")
+    parser.add_argument('--threads', type=int, help="encoder threads per conversion (default: auto)")
+    parser.add_argument('--lease-seconds', type=float, default=LEASE_SECONDS,
+                        help="how long a silent worker keeps its jobs (default: %(default)s)")
+    parser.add_argument('--poll-seconds', type=float, default=POLL_SECONDS,
+                        help="how often to look for re-queued jobs while others are busy (default: %(default)s)")
+    parser.add_argument('--status', action='store_true', help="print queue counts as JSON and exit")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(os.path.join(args.queue_dir, 'jobs')):
+        print(f"error: not a queue directory: {args.queue_dir}", file=sys.stderr)
+        return 2
+    shared = SharedQueue(args.queue_dir, args.lease_seconds)
+    if args.status:
+        json.dump(shared.status(), sys.stdout)
+        sys.stdout.write("\n")
+        return 0
+    batch = BatchConverter(VideoConverter(ProbeCache()), args.jobs, threads=args.threads)
+    return run_queue(shared, batch, args.poll_seconds)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Watch Folder Daemon - feeds newly landed videos into the converter queue
+Uses inotify on Linux and falls back to polling elsewhere (or on network shares)
+
+Usage:
+  python watch_folder.py INPUT_DIR OUTPUT_DIR [--resolution 1080p --crf 23 ...]
+  python watch_folder.py --config watch.json
+
+Config file format:
+  {
+    "jobs": 2,
+    "threads": 4,
+    "stable_seconds": 3,
+    "folders": [
+      {"path": "/mnt/share/cam-a", "output": "/mnt/share/out/cam-a",
+       "format": "mp4", "resolution": "1080p", "crf": 23, "preset": "fast", "recursive": true}
+    ]
+  }
+"""
+
+import sys
+import os
+import json
+import time
+import queue
+import signal
+import select
+import struct
+import argparse
+import threading
+from datetime import datetime
+
+from converter_core import (
+    VideoConverter, BatchConverter, ProbeCache, ConversionManifest, scan_videos, CANCELLED
+)
+from convert_cli import parse_resolution
+
+# 每条规则在输出目录中保存的清单，保证同一文件不会被重复处理
+WATCH_MANIFEST_NAME = '.watch_manifest.jsonl'
+
+def log(message):
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] {message}", file=sys.stderr, flush=True)
+
+class WatchRule:
+    """One watched folder with its own conversion settings and output tree"""
+
+    def __init__(self, path, output, output_format='mp4', resolution=None, quality=None, preset='fast',
+                 recursive=True, remux='auto'):
+        self.path = os.path.abspath(path)
+        self.output = os.path.abspath(output)
+        self.output_format = output_format
+        self.resolution = resolution
+        self.quality = quality
+        self.preset = preset
+        self.recursive = recursive
+        self.remux = remux
+        self.manifest = ConversionManifest(os.path.join(self.output, WATCH_MANIFEST_NAME))
+
+    def owns(self, path):
+        """Whether a file belongs to this rule (and is not inside its own output tree)"""
+        path = os.path.abspath(path)
+        if path.startswith(self.output + os.sep):
+            return False
+        if self.recursive:
+            return path.startswith(self.path + os.sep)
+        return os.path.dirname(path) == self.path
+
+    def output_dir_for(self, input_path):
+        """Mirror the input's sub-folder under the output tree"""
+        rel = os.path.relpath(os.path.dirname(os.path.abspath(input_path)), self.path)
+        return os.path.normpath(os.path.join(self.output, rel))
+
+class InotifyWatcher:
+    """Minimal ctypes binding to Linux inotify (no third-party dependency)"""
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_ISDIR = 0x40000000
+    MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    _EVENT = struct.Struct('iIII')
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | getattr(os, 'O_CLOEXEC', 0))
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+
+    def add_tree(self, root, recursive=True):
+        """Watch a folder (and its sub-folders when recursive)"""
+        self._add(root)
+        if recursive:
+            for dirpath, dirnames, _ in os.walk(root):
+                for name in dirnames:
+                    self._add(os.path.join(dirpath, name))
+
+    def _add(self, path):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), self.MASK)
+        if wd >= 0:
+            self.watches[wd] = path
+
+    def read(self, timeout):
+        """Return (path, is_dir, overflow) tuples for events within timeout seconds"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events, offset = [], 0
+        while offset + self._EVENT.size <= len(data):
+            wd, mask, _, length = self._EVENT.unpack_from(data, offset)
+            offset += self._EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & self.IN_Q_OVERFLOW:
+                events.append((None, False, True))
+            elif wd in self.watches and name:
+                events.append((os.path.join(self.watches[wd], os.fsdecode(name)), bool(mask & self.IN_ISDIR), False))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+class WatchDaemon:
+    """Detect stable new files in the watched folders and convert them with a worker pool"""
+
+    def __init__(self, rules, converter, workers=None, stable_seconds=3.0, poll_interval=10.0, use_inotify=True,
+                 threads=None):
+        self.rules = rules
+        self.batch = BatchConverter(converter, workers, threads=threads)
+        # 工作线程启动前就要确定并发数与每个任务的线程数，按最重的规则估算
+        self.batch.schedule_for([rule.resolution for rule in rules], [rule.preset for rule in rules])
+        self.stable_seconds = stable_seconds
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify and sys.platform.startswith('linux')
+        self.pending = {}  # path -> (size, mtime_ns, stable_since)
+        self.handled = set()  # 本次运行中已入队的文件
+        self.jobs = queue.Queue()
+        self.stop_event = threading.Event()
+
+    def rule_for(self, path):
+        for rule in self.rules:
+            if rule.owns(path):
+                return rule
+        return None
+
+    def scan(self):
+        """Walk every watched folder once and register candidate files"""
+        for rule in self.rules:
+            self.scan_dir(rule, rule.path)
+
+    def scan_dir(self, rule, root):
+        for path in scan_videos(root, self.batch.converter.supported_formats, rule.recursive, skip_dirs=[rule.output]):
+            self.touch(path)
+
+    def touch(self, path):
+        """Register activity on a file; it is queued once its size stops changing"""
+        if path in self.handled or not self.batch.converter.is_supported(path) or not self.rule_for(path):
+            return
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.pending.pop(path, None)
+            return
+        previous = self.pending.get(path)
+        if previous and previous[:2] == (st.st_size, st.st_mtime_ns):
+            return
+        self.pending[path] = (st.st_size, st.st_mtime_ns, time.monotonic())
+
+    def check_stable(self):
+        """Queue pending files whose size and mtime have not changed for stable_seconds"""
+        now = time.monotonic()
+        for path, (size, mtime_ns, since) in list(self.pending.items()):
+            try:
+                st = os.stat(path)
+            except OSError:
+                del self.pending[path]
+                continue
+            if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                self.pending[path] = (st.st_size, st.st_mtime_ns, now)
+            elif st.st_size > 0 and now - since >= self.stable_seconds:
+                del self.pending[path]
+                self.enqueue(path)
+
+    def enqueue(self, path):
+        rule = self.rule_for(path)
+        self.handled.add(path)
+        job = self.batch.build_jobs([path], rule.output_format, rule.resolution, rule.quality, rule.preset,
+                                    rule.output_dir_for(path), rule.remux)[0]
+        if rule.manifest.has_handled(job):
+            return  # 之前已经处理过（输出可能已被下游移走）
+        job['rule'] = rule
+        log(f"📥 queued {path}")
+        self.jobs.put(job)
+
+    def worker(self):
+        while not self.stop_event.is_set():
+            try:
+                job = self.jobs.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                self.process(job)
+            finally:
+                self.jobs.task_done()
+
+    def process(self, job):
+        """Convert one queued job and record the outcome; errors fail the file, never the worker thread"""
+        rule = job.pop('rule')
+        started = time.monotonic()
+        try:
+            os.makedirs(os.path.dirname(job['output']), exist_ok=True)
+            ok, err = self.batch.convert_job(job)
+        except Exception as e:
+            # 例如输出共享盘已满或被卸载：该文件记为失败，线程继续处理后续文件
+            ok, err = False, f"{type(e).__name__}: {e}"
+        if err == CANCELLED:
+            # 停止时被中断的文件不记入清单，下次启动重新处理
+            log(f"⏹️ {job['input']} cancelled")
+            return
+        if ok:
+            log(f"✅ {job['output']} ({time.monotonic() - started:.1f}s)")
+        else:
+            log(f"❌ {job['input']}: {err.strip().splitlines()[-1] if err.strip() else 'failed'}")
+        try:
+            rule.manifest.record(job, ok, err)
+        except Exception as e:
+            log(f"⚠️ could not record {job['input']} in the manifest: {e}")
+
+    def save_cache(self):
+        """Persist new probe results so a restarted daemon does not probe them again"""
+        cache = self.batch.converter.probe_cache
+        if cache is not None:
+            cache.save()
+
+    def run(self):
+        """Run until stop() is called or SIGINT/SIGTERM arrives"""
+        for rule in self.rules:
+            os.makedirs(rule.output, exist_ok=True)
+        workers = [threading.Thread(target=self.worker, daemon=True) for _ in range(self.batch.max_workers)]
+        for thread in workers:
+            thread.start()
+
+        watcher = None
+        if self.use_inotify:
+            try:
+                watcher = InotifyWatcher()
+                for rule in self.rules:
+                    watcher.add_tree(rule.path, rule.recursive)
+            except (OSError, AttributeError) as e:
+                log(f"⚠️ inotify unavailable ({e}), falling back to polling")
+                watcher = None
+        log(f"👀 watching {len(self.rules)} folder(s) with {'inotify' if watcher else 'polling'}, "
+            f"{self.batch.max_workers} job(s) x {self.batch.threads} thread(s)")
+
+        self.scan()
+        last_scan = time.monotonic()
+        try:
+            while not self.stop_event.is_set():
+                if watcher:
+                    for path, is_dir, overflow in watcher.read(timeout=1.0):
+                        if overflow:
+                            self.scan()
+                        elif is_dir:
+                            # 新建的子目录：补充监听并扫描其中已有的文件
+                            for rule in self.rules:
+                                if rule.recursive and rule.owns(path):
+                                    watcher.add_tree(path)
+                                    self.scan_dir(rule, path)
+                                    break
+                        else:
+                            self.touch(path)
+                else:
+                    self.stop_event.wait(1.0)
+                # 网络共享上 inotify 可能收不到远端写入，定期全量扫描兜底
+                if time.monotonic() - last_scan >= self.poll_interval:
+                    self.scan()
+                    self.save_cache()
+                    last_scan = time.monotonic()
+                self.check_stable()
+        finally:
+            if watcher:
+                watcher.close()
+            self.stop_event.set()
+            for thread in workers:
+                thread.join()
+            self.save_cache()
+
+    def stop(self, *_):
+        self.stop_event.set()
+        self.batch.control.cancel()
+
+def load_rules(args, converter):
+    """Build WatchRules from --config or from positional INPUT_DIR OUTPUT_DIR"""
+    if args.config:
+        with open(args.config, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        args.jobs = args.jobs or config.get('jobs')
+        args.threads = args.threads or config.get('threads')
+        args.stable_seconds = config.get('stable_seconds', args.stable_seconds)
+        rules = []
+        for entry in config.get('folders', []):
+            rules.append(WatchRule(
+                entry['path'], entry['output'], entry.get('format', 'mp4'),
+                parse_resolution(entry.get('resolution'), converter), entry.get('crf'),
+                entry.get('preset', 'fast'), entry.get('recursive', True),
+                False if entry.get('no_remux') else 'auto',
+            ))
+        return rules
+    if not (args.input_dir and args.output_dir):
+        raise ValueError("INPUT_DIR and OUTPUT_DIR are required without --config")
+    return [WatchRule(args.input_dir, args.output_dir, args.format, parse_resolution(args.resolution, converter),
+                      args.crf, args.preset, not args.no_recursive, False if args.no_remux else 'auto')]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='watch_folder', description="Convert videos as they land in watched folders")
+    parser.add_argument('input_dir', nargs='?')
+    parser.add_argument('output_dir', nargs='?')
+    parser.add_argument('-c', '--config', help="JSON config with several folders and per-folder presets")
+    parser.add_argument('-f', '--format', default='mp4', choices=VideoConverter().supported_formats)
+    parser.add_argument('-r', '--resolution', help="720p, 1080p, 4K or WIDTHxHEIGHT")
+    parser.add_argument('--crf', type=int)
+    parser.add_argument('-p', '--preset', default='fast', choices=VideoConverter().encoding_presets)
+    parser.add_argument('-j', '--jobs', type=int,
+                        help="concurrent conversions (default: auto from cores, resolution and preset)")
+    parser.add_argument('--threads', type=int, help="encoder threads per conversion (default: auto)")
+    parser.add_argument('--stable-seconds', type=float, default=3.0,
+                        help="how long a file's size must stay unchanged before it is queued")
+    parser.add_argument('--poll-interval', type=float, default=10.0, help="full rescan interval in seconds")
+    parser.add_argument('--polling', action='store_true', help="disable inotify and only poll")
+    parser.add_argument('--no-recursive', action='store_true')
+    parser.add_argument('--no-remux', action='store_true')
+    args = parser.parse_args(argv)
+
+    converter = VideoConverter(ProbeCache())
+    try:
+        rules = load_rules(args, converter)
+    except (OSError, ValueError, KeyError, argparse.ArgumentTypeError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+    if not rules:
+        print("error: no folders to watch", file=sys.stderr)
+        return 2
+
+    daemon = WatchDaemon(rules, converter, args.jobs, args.stable_seconds, args.poll_interval, not args.polling,
+                         args.threads)
+    signal.signal(signal.SIGINT, daemon.stop)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    daemon.run()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Converter core tests - the pure planning and bookkeeping logic behind the converters
+Nothing here starts ffmpeg; batch conversions are replaced by a fake convert_job
+
+Usage:
+  python -m pytest tests/test_converter_core.py
+  python -m unittest tests/test_converter_core.py
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from converter_core import (
+    FFmpegProgress, format_progress, plan_scale, even_crop, plan_concurrency, x264_thread_args, plan_segments,
+    ConversionManifest, DedupIndex, BatchConverter, VideoConverter
+)
+
+class FFmpegProgressTest(unittest.TestCase):
+
+    def feed(self, progress, block):
+        return [progress.feed(line) for line in block.strip().splitlines()]
+
+    def test_block_is_complete_only_at_progress_line(self):
+        progress = FFmpegProgress(duration=10.0, total_frames=250)
+        results = self.feed(progress, "frame=50\nfps=25.0\nout_time_us=2000000\nspeed=2.0x\nprogress=continue")
+        self.assertEqual(results, [False, False, False, False, True])
+        self.assertFalse(progress.feed("garbage without separator"))
+
+    def test_snapshot_uses_frames_then_time(self):
+        progress = FFmpegProgress(duration=10.0, total_frames=250)
+        self.feed(progress, "frame=50\nfps=25.0\nout_time_us=2000000\nspeed=2.0x\n"
+                            "total_size=1024\nstream_0_0_q=23.0\nprogress=continue")
+        info = progress.snapshot()
+        self.assertEqual(info['frame'], 50)
+        self.assertAlmostEqual(info['fraction'], 0.2)
+        self.assertAlmostEqual(info['out_time'], 2.0)
+        self.assertAlmostEqual(info['speed'], 2.0)
+        self.assertAlmostEqual(info['eta'], 4.0)  # 剩余 8 秒媒体，2 倍速
+        self.assertEqual(info['total_size'], 1024)
+        self.assertEqual(info['stream_q'], {'stream_0_0_q': '23.0'})
+        self.assertFalse(info['finished'])
+
+        by_time = FFmpegProgress(duration=10.0)
+        self.feed(by_time, "frame=0\nout_time_ms=5000000\nprogress=continue")
+        self.assertAlmostEqual(by_time.snapshot()['fraction'], 0.5)
+
+    def test_end_block_finishes(self):
+        progress = FFmpegProgress()
+        self.feed(progress, "frame=10\nfps=N/A\nspeed=N/A\nprogress=end")
+        info = progress.snapshot()
+        self.assertTrue(info['finished'])
+        self.assertEqual((info['fraction'], info['eta'], info['fps']), (1.0, 0.0, 0.0))
+        self.assertIn("10 frames", format_progress(info))
+
+class ScalePlanTest(unittest.TestCase):
+
+    def video(self, width, height, sar=1.0):
+        return {'width': width, 'height': height, 'sar': sar}
+
+    def test_matching_size_needs_no_filter(self):
+        self.assertIsNone(plan_scale(self.video(1920, 1080), (1920, 1080)))
+        self.assertIsNone(plan_scale(self.video(1920, 1080), None))
+        self.assertIsNone(plan_scale(self.video(1920, 1080), (0, 0)))
+
+    def test_vertical_source_keeps_its_orientation(self):
+        self.assertIsNone(plan_scale(self.video(1080, 1920), (1920, 1080)))
+        plan = plan_scale(self.video(720, 1280), (1920, 1080))
+        self.assertEqual(plan['size'], (1080, 1920))
+
+    def test_pad_letterboxes_and_crop_fills(self):
+        pad = plan_scale(self.video(640, 480), (1920, 1080), 'pad')
+        self.assertEqual(pad['filters'], [('scale', (1440, 1080), {}), ('setsar', (1,), {}),
+                                          ('pad', (1920, 1080, 240, 0), {})])
+        crop = plan_scale(self.video(640, 480), (1920, 1080), 'crop')
+        self.assertEqual(crop['filters'], [('scale', (1920, 1440), {}), ('setsar', (1,), {}),
+                                           ('crop', (1920, 1080), {})])
+        stretch = plan_scale(self.video(640, 480), (1920, 1080), 'stretch')
+        self.assertEqual(stretch['filters'][0], ('scale', (1920, 1080), {}))
+
+    def test_sizes_are_even_and_anamorphic_is_squared(self):
+        self.assertEqual(plan_scale(self.video(1920, 1080), (1281, 721))['size'], (1280, 720))
+        # 720x576 SAR 64:45 显示为 1024x576
+        plan = plan_scale(self.video(720, 576, 64 / 45), (1024, 576))
+        self.assertEqual(plan['filters'][0], ('scale', (1024, 576), {}))
+
+    def test_unprobed_source_scales_at_run_time(self):
+        plan = plan_scale(None, (1280, 720))
+        self.assertEqual(plan['size'], (1280, 720))
+        name, args, kwargs = plan['filters'][0]
+        self.assertEqual((name, kwargs['force_original_aspect_ratio']), ('scale', 'decrease'))
+
+    def test_even_crop(self):
+        self.assertIsNone(even_crop({'width': 1280, 'height': 720}))
+        self.assertIsNone(even_crop({}))
+        self.assertEqual(even_crop({'width': 1281, 'height': 721}),
+                         {'size': (1280, 720), 'filters': [('crop', (1280, 720), {'x': 0, 'y': 0})]})
+
+class ConcurrencyPlanTest(unittest.TestCase):
+
+    def test_threads_follow_resolution_and_preset(self):
+        self.assertEqual(plan_concurrency(16, 1080, 'fast'), (2, 8))
+        self.assertEqual(plan_concurrency(16, 480, 'fast'), (4, 4))
+        self.assertEqual(plan_concurrency(16, 2160, 'slow'), (1, 16))  # 20 个线程封顶为核数
+        self.assertEqual(plan_concurrency(1, 2160, 'veryslow'), (1, 1))
+
+    def test_overrides(self):
+        self.assertEqual(plan_concurrency(16, 1080, workers=4), (4, 4))
+        self.assertEqual(plan_concurrency(16, 1080, threads=3), (5, 3))
+        self.assertEqual(plan_concurrency(16, 1080, workers=3, threads=7), (3, 7))
+
+    def test_x264_thread_args(self):
+        self.assertEqual(x264_thread_args(None), {})
+        self.assertEqual(x264_thread_args(8), {'threads': 8, 'x264-params': 'lookahead-threads=2'})
+        self.assertEqual(x264_thread_args(2), {'threads': 2, 'x264-params': 'lookahead-threads=1'})
+
+    def test_segments_follow_keyframes(self):
+        self.assertEqual(plan_segments(100, 4), (4, 25.0))
+        self.assertEqual(plan_segments(100, 4, 2.0), (4, 26.0))
+        self.assertEqual(plan_segments(100, 4, 30.0), (3, 30.0))
+        self.assertEqual(plan_segments(100, 4, 60.0)[0], 1)
+        self.assertEqual(plan_segments(None, 4), (1, None))
+
+class TempDirTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='converter_core_test_')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def write(self, name, data=b'video'):
+        path = os.path.join(self.tmp, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def job(self, name, **params):
+        return dict({'input': self.write(name), 'output': os.path.join(self.tmp, 'out', name + '.mp4'),
+                     'resolution': None, 'quality': 23, 'preset': 'fast'}, **params)
+
+class ConversionManifestTest(TempDirTest):
+
+    def test_finished_job_is_current_after_reload(self):
+        path = os.path.join(self.tmp, 'manifest.jsonl')
+        job = self.job('a.mov')
+        self.write('out/a.mov.mp4', b'converted')
+        ConversionManifest(path).record(job, True)
+        self.assertTrue(ConversionManifest(path).is_current(job))
+
+    def test_changes_invalidate_the_record(self):
+        path = os.path.join(self.tmp, 'manifest.jsonl')
+        job = self.job('a.mov')
+        output = self.write('out/a.mov.mp4', b'converted')
+        manifest = ConversionManifest(path)
+        manifest.record(job, True)
+        self.assertFalse(manifest.is_current(dict(job, quality=18)))
+        self.write('out/a.mov.mp4', b'edited by hand')
+        os.utime(output, ns=(0, 0))
+        self.assertFalse(manifest.is_current(job))
+
+    def test_failed_job_is_not_current_but_handled(self):
+        path = os.path.join(self.tmp, 'manifest.jsonl')
+        job = self.job('a.mov')
+        manifest = ConversionManifest(path)
+        manifest.record(job, False, "boom")
+        reloaded = ConversionManifest(path)
+        self.assertFalse(reloaded.is_current(job))
+        self.assertTrue(reloaded.has_handled(job))
+
+    def test_torn_last_line_is_ignored(self):
+        path = os.path.join(self.tmp, 'manifest.jsonl')
+        job = self.job('a.mov')
+        self.write('out/a.mov.mp4', b'converted')
+        ConversionManifest(path).record(job, True)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write('{"input": "/half')
+        self.assertTrue(ConversionManifest(path).is_current(job))
+
+class DedupIndexTest(TempDirTest):
+
+    def test_duplicates_get_the_leaders_outputs(self):
+        dedup = DedupIndex()
+        leader = self.job('a.mov')
+        early = dict(self.job('b.mov'), input=self.write('b.mov', b'video'))
+        other = dict(self.job('c.mov'), input=self.write('c.mov', b'different'))
+        self.assertEqual(dedup.claim(leader), (None, None))
+        self.assertEqual(dedup.claim(early), (leader, None))
+        self.assertEqual(dedup.claim(other), (None, None))
+
+        self.write('out/a.mov.mp4', b'converted')
+        self.assertEqual(dedup.finish(leader, True, ""), [(early, True, "")])
+        with open(early['output'], 'rb') as f:
+            self.assertEqual(f.read(), b'converted')
+
+        late = dict(self.job('d.mov'), input=self.write('d.mov', b'video'))
+        self.assertEqual(dedup.claim(late), (leader, (True, "")))
+        self.assertEqual(dedup.materialize(leader, late, True, ""), (True, ""))
+        self.assertTrue(os.path.exists(late['output']))
+
+    def test_different_parameters_are_not_duplicates(self):
+        dedup = DedupIndex()
+        self.assertEqual(dedup.claim(self.job('a.mov')), (None, None))
+        self.assertEqual(dedup.claim(dict(self.job('b.mov'), quality=18)), (None, None))
+
+    def test_failed_leader_fails_its_duplicates(self):
+        dedup = DedupIndex()
+        leader, duplicate = self.job('a.mov'), self.job('b.mov')
+        dedup.claim(leader)
+        dedup.claim(duplicate)
+        self.assertEqual(dedup.finish(leader, False, "boom"), [(duplicate, False, "boom")])
+
+class FakeBatch(BatchConverter):
+    """BatchConverter whose jobs sleep instead of encoding and record how many ran at once"""
+
+    def __init__(self, max_workers, fail=()):
+        super().__init__(VideoConverter(), max_workers)
+        self.fail = set(fail)
+        self.running = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def convert_job(self, job, progress_callback=None):
+        with self._lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        try:
+            time.sleep(0.05)
+            if job['input'] in self.fail:
+                raise RuntimeError("decoder exploded")
+            return True, ""
+        finally:
+            with self._lock:
+                self.running -= 1
+
+class BatchRunTest(unittest.TestCase):
+
+    def jobs(self, count):
+        return [{'input': f"clip_{i}.mp4", 'output': f"out_{i}.mp4"} for i in range(count)]
+
+    def test_pool_is_bounded(self):
+        batch = FakeBatch(max_workers=3)
+        results = batch.run(self.jobs(10))
+        self.assertEqual(len(results), 10)
+        self.assertTrue(all(ok for _, ok, _ in results))
+        self.assertLessEqual(batch.peak, 3)
+        self.assertGreater(batch.peak, 1)
+
+    def test_one_error_fails_only_its_job(self):
+        batch = FakeBatch(max_workers=2, fail={'clip_3.mp4'})
+        done, progress = [], []
+        results = batch.run(self.jobs(6), on_file_done=lambda index, job, ok, err: done.append((index, ok, err)),
+                            on_batch_progress=lambda finished, total: progress.append((finished, total)))
+        failed = [(job['input'], err) for job, ok, err in results if not ok]
+        self.assertEqual(failed, [('clip_3.mp4', "Batch worker error: decoder exploded")])
+        self.assertEqual(sorted(index for index, _, _ in done), list(range(6)))
+        self.assertIn((3, False, "Batch worker error: decoder exploded"), done)
+        self.assertEqual(progress[-1], (6, 6))
+        self.assertEqual(batch.stats['succeeded'], 5)
+
+if __name__ == "__main__":
+    unittest.main()
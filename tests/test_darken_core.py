@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Darken core tests - lookup tables against moviepy's colorx and the ffmpeg filter choice
+Needs numpy only; neither moviepy nor ffmpeg is run
+
+Usage:
+  python -m pytest tests/test_darken_core.py
+  python -m unittest tests/test_darken_core.py
+"""
+
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from converter_core import CANCELLED
+from darken_core import (
+    darken_lut, FrameLUT, darken_filter, audio_codec_for, build_darken_jobs, DarkenBatch
+)
+
+def colorx(frame, factor):
+    """moviepy.video.fx.colorx, the fallback engine's original per-frame code"""
+    return np.minimum(255, factor * frame).astype('uint8')
+
+class DarkenLUTTest(unittest.TestCase):
+
+    def setUp(self):
+        self.frame = np.random.default_rng(7).integers(0, 256, (36, 64, 3), dtype=np.uint8)
+
+    def test_brightness_matches_colorx_exactly(self):
+        for factor in (0.1, 0.35, 0.5, 0.8, 1.0, 1.3, 2.0):
+            with self.subTest(factor=factor):
+                np.testing.assert_array_equal(FrameLUT(factor)(self.frame), colorx(self.frame, factor))
+
+    def test_table_shape_and_identity(self):
+        table = darken_lut()
+        self.assertEqual((table.shape, table.dtype), ((3, 256), np.uint8))
+        np.testing.assert_array_equal(table[0], np.arange(256))
+
+    def test_per_channel_curves(self):
+        out = FrameLUT(brightness=(1.0, 0.5, 0.0))(self.frame)
+        np.testing.assert_array_equal(out[..., 0], self.frame[..., 0])
+        np.testing.assert_array_equal(out[..., 1], colorx(self.frame[..., 1], 0.5))
+        self.assertFalse(out[..., 2].any())
+
+    def test_gamma_and_contrast(self):
+        table = darken_lut(gamma=2.0)
+        self.assertEqual((table[0, 0], table[0, 255]), (0, 255))
+        self.assertGreater(table[0, 64], 64)  # gamma > 1 提亮暗部
+        contrast = darken_lut(contrast=2.0)[0]
+        self.assertEqual((contrast[0], contrast[255]), (0, 255))
+        self.assertLess(contrast[100], 100)
+
+    def test_output_buffer_is_reused_and_alpha_kept(self):
+        lut = FrameLUT(0.5)
+        first = lut(self.frame)
+        self.assertIs(lut(self.frame), first)
+        rgba = np.dstack([self.frame, np.full(self.frame.shape[:2], 200, np.uint8)])
+        out = FrameLUT(brightness=(0.5, 0.5, 0.4))(rgba)
+        self.assertTrue((out[..., 3] == 200).all())
+
+class DarkenFilterTest(unittest.TestCase):
+
+    def test_limited_range_yuv_darkens_in_yuv(self):
+        name, options = darken_filter(0.5, 'yuv420p', 'tv')
+        self.assertEqual(name, 'lutyuv')
+        self.assertEqual(options['y'], "(val-minval)*0.5+minval")
+
+    def test_full_range_rgb_and_brightening_use_lutrgb(self):
+        for pix_fmt, color_range, brightness in (('yuvj420p', None, 0.5), ('yuv420p', 'pc', 0.5),
+                                                 ('rgb24', None, 0.5), ('yuv420p', 'tv', 1.5), (None, None, 0.5)):
+            with self.subTest(pix_fmt=pix_fmt, color_range=color_range, brightness=brightness):
+                self.assertEqual(darken_filter(brightness, pix_fmt, color_range)[0], 'lutrgb')
+
+    def test_audio_copied_when_container_allows(self):
+        self.assertEqual(audio_codec_for({'codec': 'aac'}, 'out.mp4'), 'copy')
+        self.assertEqual(audio_codec_for({'codec': 'pcm_s16le'}, 'out.mp4'), 'aac')
+        self.assertEqual(audio_codec_for({'codec': 'pcm_s16le'}, 'out.mkv'), 'copy')
+        self.assertEqual(audio_codec_for(None, 'out.mp4'), 'aac')
+
+class DarkenBatchTest(unittest.TestCase):
+
+    def test_clashing_names_are_numbered(self):
+        jobs = build_darken_jobs([('/a/clip.mp4', 0.5), ('/b/clip.mov', 0.6), ('/c/other.mp4', 0.7)], '/out')
+        self.assertEqual([job['output'] for job in jobs],
+                         [os.path.join('/out', 'clip_darkened.mp4'), os.path.join('/out', 'clip_darkened_2.mp4'),
+                          os.path.join('/out', 'other_darkened.mp4')])
+
+    def test_worker_error_fails_one_job(self):
+        batch = DarkenBatch(max_workers=2)
+
+        def run_job(job, progress_callback=None):
+            if job['input'] == 'bad.mp4':
+                raise OSError("share unmounted")
+            return True, ""
+        batch.run_job = run_job
+        finished = []
+        result = batch.run([{'input': 'good.mp4'}, {'input': 'bad.mp4'}],
+                           on_finish=lambda index, ok, err: finished.append((index, ok, err)))
+        self.assertEqual(result, (1, 1))
+        self.assertEqual(sorted(finished), [(0, True, ""), (1, False, "Darken error: share unmounted")])
+
+    def test_cancelled_batch_starts_nothing(self):
+        batch = DarkenBatch(max_workers=1)
+        batch.control.cancel()
+        started = []
+        self.assertEqual(batch.run([{'input': 'a.mp4'}, {'input': 'b.mp4'}], on_start=started.append,
+                                   on_finish=lambda index, ok, err: self.assertEqual(err, CANCELLED)), (0, 2))
+        self.assertEqual(started, [])
+
+if __name__ == "__main__":
+    unittest.main()
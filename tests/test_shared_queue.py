@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared queue tests - several QueueWorker processes on one temporary queue directory
+Conversions are replaced by a fake batch, so no ffmpeg is needed
+
+Usage:
+  python -m pytest tests/test_shared_queue.py
+  python -m unittest tests/test_shared_queue.py
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from converter_core import JobControl, CANCELLED
+from shared_queue import SharedQueue, QueueWorker
+
+class FakeBatch:
+    """Stands in for BatchConverter: logs each claim, waits a moment and writes the output"""
+
+    max_workers = 1
+
+    def __init__(self, log_path, seconds=0.2):
+        self.log_path = log_path
+        self.seconds = seconds
+        self.control = JobControl()
+        self.controls = {}
+
+    def job_controls(self):
+        return dict(self.controls)
+
+    def convert_job(self, job):
+        control = self.controls[job['input']] = JobControl(self.control)
+        # O_APPEND 写入单行，多个进程同时记录也不会交错
+        with open(self.log_path, 'a', encoding='utf-8') as f:
+            f.write(f"{os.getpid()} {job['input']}\n")
+        deadline = time.monotonic() + self.seconds
+        while time.monotonic() < deadline and not control.cancelled:
+            time.sleep(0.02)
+        del self.controls[job['input']]
+        if control.cancelled:
+            return False, CANCELLED
+        open(job['output'], 'w').close()
+        return True, ""
+
+def work(root, log_path, lease_seconds, seconds=0.2):
+    """Child process: drain the queue with one QueueWorker"""
+    shared = SharedQueue(root, lease_seconds)
+    QueueWorker(shared, FakeBatch(log_path, seconds), poll_seconds=0.2).run()
+
+def read_claims(log_path):
+    if not os.path.exists(log_path):
+        return []
+    with open(log_path, 'r', encoding='utf-8') as f:
+        return [line.split(' ', 1) for line in f.read().splitlines()]
+
+@unittest.skipUnless(hasattr(os, 'fork'), "needs fork to start workers from the test module")
+class SharedQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='shared_queue_test_')
+        self.root = os.path.join(self.tmp, 'queue')
+        self.log_path = os.path.join(self.tmp, 'claims.log')
+        self.context = multiprocessing.get_context('fork')
+        self.processes = []
+
+    def tearDown(self):
+        for process in self.processes:
+            if process.is_alive():
+                process.kill()
+            process.join()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def enqueue(self, count):
+        jobs = [{'input': os.path.join(self.tmp, 'in', f"clip_{i}.mp4"),
+                 'output': os.path.join(self.tmp, 'out', f"clip_{i}.mp4")} for i in range(count)]
+        SharedQueue(self.root).enqueue(jobs)
+        return jobs
+
+    def start(self, lease_seconds, seconds=0.2):
+        process = self.context.Process(target=work, args=(self.root, self.log_path, lease_seconds, seconds))
+        process.start()
+        self.processes.append(process)
+        return process
+
+    def wait_for(self, condition, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if condition():
+                return True
+            time.sleep(0.05)
+        return False
+
+    def test_each_job_runs_exactly_once(self):
+        jobs = self.enqueue(12)
+        workers = [self.start(lease_seconds=30) for _ in range(3)]
+        for process in workers:
+            process.join(60)
+            self.assertEqual(process.exitcode, 0)
+
+        claims = read_claims(self.log_path)
+        inputs = sorted(job_input for _, job_input in claims)
+        self.assertEqual(inputs, sorted(job['input'] for job in jobs))
+        # 三个进程都参与了
+        self.assertGreater(len({pid for pid, _ in claims}), 1)
+        self.assertEqual(SharedQueue(self.root).status(),
+                         {'pending': 0, 'leased': 0, 'succeeded': 12, 'failed': 0})
+
+    def test_expired_lease_is_reclaimed_after_kill(self):
+        job = self.enqueue(1)[0]
+        # 第一个进程卡在任务中，被 kill -9 后不再续租
+        stuck = self.start(lease_seconds=1.0, seconds=60)
+        self.assertTrue(self.wait_for(lambda: read_claims(self.log_path)))
+        stuck.kill()
+        stuck.join()
+
+        rescuer = self.start(lease_seconds=1.0)
+        rescuer.join(60)
+        self.assertEqual(rescuer.exitcode, 0)
+
+        claims = read_claims(self.log_path)
+        self.assertEqual([job_input for _, job_input in claims], [job['input'], job['input']])
+        self.assertEqual([int(pid) for pid, _ in claims], [stuck.pid, rescuer.pid])
+        self.assertEqual(SharedQueue(self.root).status()['succeeded'], 1)
+        self.assertTrue(os.path.exists(job['output']))
+
+    def test_lost_lease_cancels_the_running_job(self):
+        job = self.enqueue(1)[0]
+        shared = SharedQueue(self.root, lease_seconds=0.6)
+        worker = QueueWorker(shared, FakeBatch(self.log_path, seconds=30), poll_seconds=0.2)
+        thread = threading.Thread(target=worker.run, daemon=True)
+        thread.start()
+        self.assertTrue(self.wait_for(lambda: read_claims(self.log_path)))
+        # 模拟租约过期后被另一个节点接手
+        job_id = shared.job_id(job)
+        with open(shared.lease_path(job_id), 'w', encoding='utf-8') as f:
+            f.write('{"worker": "other-host:1:x"}')
+        self.assertTrue(self.wait_for(lambda: not worker.batch.controls, timeout=10))
+        worker.stop()
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(os.path.exists(job['output']))
+        status = SharedQueue(self.root).status()
+        self.assertEqual((status['succeeded'], status['failed']), (0, 0))
+
+if __name__ == "__main__":
+    unittest.main()